@@ -0,0 +1,102 @@
+# agents/compaction.py
+"""
+Message-history compaction and turn limits for the ReAct agents.
+
+`create_react_agent` sends the whole message list to the model on every
+turn, so each tool result is paid for again on every later turn. The
+pre-model hook built here leaves the graph state untouched (the full
+history is still what callers and streams see) and only changes what the
+model is sent:
+
+- tool results the model has already answered (there is an AI message
+  after them) are cut to their first lines, AGENT_COMPACT_TOOL_TOKENS each;
+- if the history is still over AGENT_CONTEXT_TOKENS, those consumed
+  results shrink to a one-line reference, oldest first;
+- on turn AGENT_MAX_TURNS the model is told to answer without more tools.
+  `turn_limit()` is the matching recursion limit: should the model call
+  tools anyway, the run stops instead of looping: the agent answers
+  "Sorry, need more steps..." or, if the steps run out mid-turn, LangGraph
+  raises GraphRecursionError. main_graph.invoke_agent turns both into the
+  last text the model wrote (child agents report the error as a string).
+
+Estimated input tokens per turn are recorded by tools.tracing.
+
+    agent = create_react_agent(model, tools, prompt=..., pre_model_hook=pre_model_hook("supervisor"))
+    agent = agent.with_config(turn_limit())
+
+Set AGENT_COMPACTION=0 to send the full history (the turn limit still applies).
+"""
+from __future__ import annotations
+import os
+from typing import Any, Callable, Dict, List, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from tools import tracing
+from tools.budget import fit_lines
+
+AGENT_COMPACTION = os.getenv("AGENT_COMPACTION", "1").lower() not in ("0", "false", "no", "off")
+AGENT_MAX_TURNS = int(os.getenv("AGENT_MAX_TURNS", 6))
+AGENT_CONTEXT_TOKENS = int(os.getenv("AGENT_CONTEXT_TOKENS", 6000))
+AGENT_COMPACT_TOOL_TOKENS = int(os.getenv("AGENT_COMPACT_TOOL_TOKENS", 150))
+
+FINAL_TURN_NOTE = ("You have used all tool calls for this request. Write the final answer now from the "
+                   "information above, without calling any tools.")
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content or [])
+
+
+def _shorten(msg: ToolMessage, budget: int) -> ToolMessage:
+    lines = _text(msg.content).splitlines()
+    if budget <= 0:
+        kept = lines[:1] + [f"[{len(lines) - 1} more lines omitted; already read]"] if len(lines) > 1 else lines
+    else:
+        kept = fit_lines(lines, budget, "[{n} more lines omitted; already read]")
+    return msg.model_copy(update={"content": "\n".join(kept)})
+
+
+def compact_messages(messages: Sequence[BaseMessage], context_tokens: int = AGENT_CONTEXT_TOKENS,
+                     tool_tokens: int = AGENT_COMPACT_TOOL_TOKENS) -> List[BaseMessage]:
+    """The history as it should be sent to the model (see module docstring)."""
+    out = list(messages)
+    last_ai = max((i for i, m in enumerate(out) if isinstance(m, AIMessage)), default=-1)
+    consumed = [i for i, m in enumerate(out[:last_ai]) if isinstance(m, ToolMessage)]
+    for i in consumed:
+        out[i] = _shorten(out[i], tool_tokens)
+    for i in consumed:
+        if count_tokens_approximately(out) <= context_tokens:
+            break
+        out[i] = _shorten(out[i], 0)
+    return out
+
+
+def pre_model_hook(agent: str, max_turns: int = AGENT_MAX_TURNS) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Pre-model hook for create_react_agent: compacts the model input and records its size."""
+    def hook(state: Dict[str, Any]) -> Dict[str, Any]:
+        messages = state["messages"]
+        turn = 1 + sum(isinstance(m, AIMessage) for m in messages)
+        with tracing.span("agent.context", agent=agent, turn=turn) as sp:
+            sent = compact_messages(messages) if AGENT_COMPACTION else list(messages)
+            if turn >= max_turns:
+                sent.append(HumanMessage(FINAL_TURN_NOTE))
+            tokens = count_tokens_approximately(sent)
+            sp.set(tokens=tokens, history_tokens=count_tokens_approximately(messages))
+            tracing.record_agent_turn(agent, turn, tokens)
+        return {"llm_input_messages": sent}
+    return hook
+
+
+def turn_limit(max_turns: int = AGENT_MAX_TURNS) -> Dict[str, int]:
+    """Graph config capping a ReAct agent (with pre_model_hook) at `max_turns` model calls.
+
+    Past the cap the agent's last reply is replaced with a "need more steps" note,
+    or the run raises langgraph.errors.GraphRecursionError and returns no state;
+    see main_graph.invoke_agent.
+    """
+    # each turn is three graph steps: pre_model_hook, agent, tools
+    return {"recursion_limit": 3 * max_turns}
@@ -0,0 +1,226 @@
+# agents/llm_cache.py
+"""
+Exact-match, content-addressed cache for chat model responses.
+
+Plugged into every `ChatOpenAI` built by agents.registry (LangChain's `cache=`
+hook). The key is a SHA-256 of the model configuration string LangChain
+produces (model, temperature and the bound tool schemas) plus the normalized
+message list, so repeated plans for the same city and dates replay the model's
+answers instead of waiting on the API. Entries live in SQLite with a TTL and a
+total size cap (least-recently-used rows are evicted first).
+
+Bypass for a single request with:
+
+    with bypass_llm_cache():
+        supervisor.invoke(...)
+"""
+from __future__ import annotations
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+from tools import tracing
+from tools.cache import default_db_path
+
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+# fields that differ between otherwise identical conversations
+_VOLATILE_KEYS = {"response_metadata", "usage_metadata"}
+
+
+@contextmanager
+def bypass_llm_cache(enabled: bool = True):
+    """Skip cache lookups and writes for LLM calls made inside this block."""
+    token = _bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Strip volatile fields and rename tool-call ids by order of appearance."""
+    try:
+        data = json.loads(prompt)
+    except ValueError:
+        return prompt
+    aliases: Dict[str, str] = {}
+
+    def alias(v: Any) -> Any:
+        if not isinstance(v, str):
+            return v
+        return aliases.setdefault(v, f"call_{len(aliases)}")
+
+    def walk(node: Any, in_tool_call: bool = False) -> Any:
+        if isinstance(node, list):
+            return [walk(x, in_tool_call) for x in node]
+        if not isinstance(node, dict):
+            return node
+        out = {}
+        for k, v in node.items():
+            if k in _VOLATILE_KEYS:
+                continue
+            if k == "tool_call_id" or (k == "id" and in_tool_call):
+                out[k] = alias(v)
+            elif k == "id" and not isinstance(v, list):
+                # message ids are dropped; the serializer's class path ("id": [...]) is kept
+                continue
+            else:
+                out[k] = walk(v, in_tool_call or k in ("tool_calls", "invalid_tool_calls"))
+        return out
+
+    return json.dumps(walk(data), sort_keys=True, separators=(",", ":"))
+
+
+def _encode(g: Generation) -> Dict[str, Any]:
+    if isinstance(g, ChatGeneration):
+        return {"message": message_to_dict(g.message), "info": g.generation_info}
+    return {"text": g.text, "info": g.generation_info}
+
+
+def _decode(d: Dict[str, Any]) -> Generation:
+    if "message" in d:
+        return ChatGeneration(message=messages_from_dict([d["message"]])[0], generation_info=d.get("info"))
+    return Generation(text=d["text"], generation_info=d.get("info"))
+
+
+class SQLiteLLMCache(BaseCache):
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = LLM_CACHE_TTL,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path or default_db_path("llm_cache.sqlite3")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " tokens INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL, expires_at REAL)"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def cache_key(prompt: str, llm_string: str) -> str:
+        h = hashlib.sha256()
+        h.update(llm_string.encode("utf-8"))
+        h.update(b"\0")
+        h.update(normalize_prompt(prompt).encode("utf-8"))
+        return h.hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        if _bypass.get():
+            return None
+        key = self.cache_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, tokens, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[2] is not None and row[2] <= now):
+                self.misses += 1
+                tracing.record_cache("llm", False)
+                return None
+            self._db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            tracing.record_cache("llm", True)
+            self.tokens_saved += row[1]
+        try:
+            generations = [_decode(g) for g in json.loads(row[0])]
+        except (ValueError, KeyError, TypeError):
+            return None
+        # the replayed usage_metadata is what the original call spent: tracing counts it apart
+        for g in generations:
+            g.generation_info = {**(g.generation_info or {}), "cached": True}
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if _bypass.get():
+            return
+        key = self.cache_key(prompt, llm_string)
+        value = json.dumps([_encode(g) for g in return_val])
+        tokens = 0
+        for g in return_val:
+            usage = getattr(getattr(g, "message", None), "usage_metadata", None) or {}
+            tokens += int(usage.get("total_tokens") or 0)
+        now = time.time()
+        expires_at = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, tokens, created_at, last_used, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, value, len(value), tokens, now, now, expires_at),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM llm_cache ORDER BY last_used ASC").fetchall():
+            self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM llm_cache")
+            self._db.commit()
+            self.hits = self.misses = self.tokens_saved = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "tokens_saved": self.tokens_saved,
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache: Optional[SQLiteLLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[SQLiteLLMCache]:
+    """Process-wide LLM cache, or None when disabled with LLM_CACHE=0."""
+    global _cache
+    if os.getenv("LLM_CACHE", "1").lower() in ("0", "false", "no", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = SQLiteLLMCache()
+            except sqlite3.Error:
+                return None
+        return _cache
+
+
+def llm_cache_stats() -> Dict[str, Any]:
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
@@ -1,20 +1,26 @@
 # agents/poi_agent.py
 from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
+from agents.compaction import pre_model_hook, turn_limit
+from agents.registry import get_graph, get_llm, llm_key
 from tools.poi_tools import poi_tool as poi_tool_func
 
 def build_poi_agent(model: str, api_key: str, base_url: str, temperature: float = 0.2):
     """
     Build a standalone POI agent.
     Exposes `poi_tool(city, radius, limit)`.
+    The compiled graph and its LLM client are shared process-wide (agents.registry).
     """
-    llm = ChatOpenAI(model=model, api_key=api_key, base_url=base_url, temperature=temperature)
-    agent = create_react_agent(
-        model=llm,
-        tools=[poi_tool_func],
-        prompt=(
-            "You are a points-of-interest assistant. When asked, return a readable list "
-            "of top POIs for a city, with short descriptions. Use the poi_tool."
-        ),
-    )
-    return agent
+    def build():
+        llm = get_llm(model, api_key, base_url, temperature)
+        agent = create_react_agent(
+            model=llm,
+            tools=[poi_tool_func],
+            prompt=(
+                "You are a points-of-interest assistant. When asked, return a readable list "
+                "of top POIs for a city, with short descriptions. Use the poi_tool."
+            ),
+            pre_model_hook=pre_model_hook("poi_agent"),
+        ).with_config(turn_limit())
+        return agent
+
+    return get_graph("poi_agent", llm_key(model, base_url, temperature, api_key), build)
@@ -0,0 +1,105 @@
+# agents/registry.py
+"""
+Process-wide registry of LLM clients and compiled agent graphs.
+
+Streamlit reruns the script on every interaction and serves many sessions from
+one process. Building a `ChatOpenAI` client (with its own HTTP pool) and
+compiling a `create_react_agent` graph on each click is pure overhead, so both
+are built once per configuration and shared. All functions are thread-safe.
+"""
+from __future__ import annotations
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from langchain_openai import ChatOpenAI
+
+from agents.llm_cache import get_llm_cache
+from tools import tracing
+
+_lock = threading.Lock()
+_llms: Dict[Tuple, ChatOpenAI] = {}
+_graphs: Dict[Hashable, Any] = {}
+_build_locks: Dict[Hashable, threading.Lock] = {}
+_metrics: Dict[str, Dict[str, float]] = {}
+
+
+def _record(name: str, seconds: float) -> None:
+    m = _metrics.setdefault(name, {"builds": 0, "build_seconds": 0.0, "hits": 0})
+    m["builds"] += 1
+    m["build_seconds"] += seconds
+
+
+def _hit(name: str) -> None:
+    _metrics.setdefault(name, {"builds": 0, "build_seconds": 0.0, "hits": 0})["hits"] += 1
+
+
+def llm_key(model: str, base_url: str, temperature: float, api_key: str = "") -> Tuple:
+    # the key itself is never stored, only a fingerprint to keep different accounts apart
+    fp = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+    return (model, base_url, float(temperature), fp)
+
+
+def get_llm(model: str, api_key: str, base_url: str, temperature: float = 0.2) -> ChatOpenAI:
+    """Shared ChatOpenAI client for (model, base_url, temperature)."""
+    key = llm_key(model, base_url, temperature, api_key)
+    with _lock:
+        llm = _llms.get(key)
+        if llm is not None:
+            _hit("llm")
+            return llm
+        t0 = time.perf_counter()
+        # exact-match response cache (None when disabled via LLM_CACHE=0); one trace span per
+        # turn, with token usage also reported for streamed turns
+        llm = ChatOpenAI(model=model, api_key=api_key, base_url=base_url, temperature=temperature,
+                         cache=get_llm_cache(), callbacks=tracing.llm_callbacks() or None, stream_usage=True)
+        _llms[key] = llm
+        _record("llm", time.perf_counter() - t0)
+        return llm
+
+
+def get_graph(name: str, key: Hashable, builder: Callable[[], Any]) -> Any:
+    """Return the graph cached under (name, key), building it with `builder()` once.
+
+    Concurrent callers for the same key wait for the first build instead of
+    compiling duplicates; a builder that raises caches nothing.
+    """
+    full_key = (name, key)
+    with _lock:
+        graph = _graphs.get(full_key)
+        if graph is not None:
+            _hit(name)
+            return graph
+        build_lock = _build_locks.setdefault(full_key, threading.Lock())
+    with build_lock:
+        with _lock:
+            graph = _graphs.get(full_key)
+            if graph is not None:
+                _hit(name)
+                return graph
+        t0 = time.perf_counter()
+        graph = builder()
+        with _lock:
+            _graphs[full_key] = graph
+            _record(name, time.perf_counter() - t0)
+        return graph
+
+
+def registry_stats() -> Dict[str, Any]:
+    """Build counts, cumulative build time and cache hits per kind of object."""
+    with _lock:
+        return {
+            "llm_clients": len(_llms),
+            "graphs": len(_graphs),
+            "metrics": {k: dict(v) for k, v in _metrics.items()},
+        }
+
+
+def reset_registry() -> None:
+    """Forget every cached client and graph (e.g. after rotating API keys)."""
+    with _lock:
+        _llms.clear()
+        _graphs.clear()
+        _build_locks.clear()
+        _metrics.clear()
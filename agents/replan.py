@@ -0,0 +1,362 @@
+# agents/replan.py
+"""
+Checkpointed, incremental re-planning for interactive sessions.
+
+Users often plan again after changing only `daily_limit` or moving the
+end date by a day, and a plan with no memory redoes every fetch and every
+LLM turn. Here a plan is a small LangGraph graph whose state is
+checkpointed per session in SQLite (REPLAN_DB). The state holds the
+request, the geocode, the POI pool, the weather days, the day assignments
+and the answer. On the next run each node redoes its work only when its
+inputs changed:
+
+    geocode   the city
+    pois      the geocode; a trip long enough to need a bigger pool
+    weather   the geocode; only days not stored yet (or expired) are fetched
+    schedule  the pool, the number of days, daily_limit, the rainy days
+    compose   any of the above, or the dates (no I/O)
+    polish    the composed plan: one LLM pass in "fast_polish" mode, none in "fast"
+    agent     the composed plan, in "agent" mode: the ReAct supervisor plans with
+              its own tool calls, which are answered from the session's geocode,
+              POIs and weather (main_graph.get_supervisor, FetchContext.seed_*)
+
+So a new daily_limit re-runs only the scheduler and a date extension
+fetches only the added days' weather; either ends with a single LLM pass
+(or, in "agent" mode, the supervisor's turns without upstream calls for
+what did not change). A run that changes nothing answers from the
+checkpoint without an LLM call.
+
+    for ev in stream_plan(city, start_date, end_date, daily_limit, session=session_id): ...
+    replan(session_id, city, start_date, end_date, daily_limit, mode="fast")     # -> markdown
+
+Only the latest checkpoint of a session is kept. Sessions live in a file
+on this host, so replicas need a shared REPLAN_DB or sticky sessions.
+"""
+from __future__ import annotations
+import datetime
+import os
+import sqlite3
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TypedDict
+
+from dateutil.parser import parse as parse_date
+from langgraph.graph import END, START, StateGraph
+
+from agents.registry import get_graph
+from tools import tracing
+from tools.cache import default_db_path
+from tools.fetch_context import POOL_LIMIT, POOL_RADIUS, FetchContext, current_context, get_context
+from tools.geo import pois_within
+from tools.geocode import normalize_query
+from tools.itinerary_tools import itinerary_pool
+from tools.poi_record import POI
+from tools.scheduler import DayPlan
+from tools.transport import failure_note
+from tools.weather_fetcher import DAILY_VARS, WEATHER_FORECAST_TTL
+
+REPLAN_DB = os.getenv("REPLAN_DB") or default_db_path("sessions.sqlite3")
+
+# what poi_tool answers with by default
+POI_LIST_RADIUS = 2000
+POI_LIST_LIMIT = 8
+
+
+class PlanState(TypedDict, total=False):
+    # the request (input of every run)
+    city: str
+    start_date: str
+    end_date: str
+    daily_limit: int
+    mode: str                                # main_graph.PLAN_MODES
+    error: Optional[str]
+    # intermediate results, kept between the runs of a session
+    geo_query: Optional[str]                 # normalized city the geocode answers
+    geo: Optional[Dict[str, Any]]
+    pool_at: Optional[List[float]]           # [lat, lon] the pool was fetched for
+    pool_limit: int
+    pool: List[List[Any]]                    # POI records as lists
+    weather_at: Optional[List[float]]
+    weather_days: Dict[str, Dict[str, Any]]  # ISO date -> DAILY_VARS values and fetch time "_at"
+    schedule_key: Optional[List[Any]]
+    days: List[Dict[str, Any]]               # DayPlan fields per day
+    outputs: Dict[str, str]                  # itinerary_tool / weather_tool / poi_tool sections
+    draft: str
+    answer_from: Optional[str]               # the draft `answer` was written from
+    answer_mode: Optional[str]               # and the mode it was written in
+    answer: Optional[str]
+
+
+def _dates(state: PlanState) -> Tuple[datetime.date, datetime.date]:
+    return datetime.date.fromisoformat(state["start_date"]), datetime.date.fromisoformat(state["end_date"])
+
+
+def _trip_days(state: PlanState) -> List[datetime.date]:
+    sd, ed = _dates(state)
+    return [sd + datetime.timedelta(days=i) for i in range((ed - sd).days + 1)]
+
+
+def _pool_needed(state: PlanState) -> int:
+    # the pool itinerary_tool asks for (its circle lies within POOL_RADIUS)
+    return itinerary_pool(state["daily_limit"], len(_trip_days(state)))[1]
+
+
+def _latlon(state: PlanState) -> List[float]:
+    return [state["geo"]["lat"], state["geo"]["lon"]]
+
+
+def _pois(state: PlanState) -> List[POI]:
+    return [POI(name, lat, lon, category, indoor, tuple(tuple(t) for t in tags))
+            for name, lat, lon, category, indoor, tags in state.get("pool") or []]
+
+
+def _weather_block(state: PlanState) -> Dict[str, Any]:
+    """The trip's days as an Open-Meteo `daily` block; {} if any day is missing."""
+    stored = state.get("weather_days") or {}
+    days = [d.isoformat() for d in _trip_days(state)]
+    if any(d not in stored for d in days):
+        return {}
+    out: Dict[str, Any] = {"time": days}
+    for k in DAILY_VARS:
+        out[k] = [stored[d].get(k) for d in days]
+    return out
+
+
+def _fresh(day: datetime.date, fetched_at: float) -> bool:
+    # the same rule as the weather cache: days safely in the past never change
+    if day < datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=1):
+        return True
+    return time.time() - fetched_at < WEATHER_FORECAST_TTL
+
+
+def _request(state: PlanState) -> PlanState:
+    try:
+        sd = parse_date(state["start_date"]).date()
+        ed = parse_date(state["end_date"]).date()
+    except Exception:
+        return {"error": "ERROR: Dates must be YYYY-MM-DD."}
+    if ed < sd:
+        return {"error": "ERROR: end_date must be same or after start_date."}
+    return {"start_date": sd.isoformat(), "end_date": ed.isoformat(), "error": None}
+
+
+def _geocode(state: PlanState) -> PlanState:
+    with tracing.span("replan.geocode") as sp:
+        key = normalize_query(state["city"])
+        if state.get("error") or (state.get("geo") and state.get("geo_query") == key):
+            sp.set(reused=True)
+            return {}
+        ctx = get_context()
+        g = ctx.geocode(state["city"])
+        if g is None:
+            return {"geo": None, "geo_query": None,
+                    "error": f"ERROR: Could not geocode '{state['city']}'{failure_note(ctx.errors.get('geocode'))}."}
+        return {"geo": g, "geo_query": key}
+
+
+def _pool(state: PlanState) -> PlanState:
+    with tracing.span("replan.pois") as sp:
+        if state.get("error"):
+            return {}
+        needed = _pool_needed(state)
+        pool, limit = state.get("pool") or [], state.get("pool_limit", 0)
+        # a pool that came back short of its limit already holds everything in the circle
+        if state.get("pool_at") == _latlon(state) and (limit >= needed or len(pool) < limit):
+            sp.set(reused=True)
+            return {}
+        lat, lon = _latlon(state)
+        limit = max(needed, POOL_LIMIT)
+        pois = get_context().pois(lat, lon, radius=POOL_RADIUS, limit=limit)
+        sp.set(pool=len(pois or []))
+        return {"pool_at": [lat, lon] if pois else None, "pool_limit": limit,
+                "pool": [[p.name, p.lat, p.lon, p.category, p.indoor, [list(t) for t in p.tags]] for p in pois or []]}
+
+
+def _weather(state: PlanState) -> PlanState:
+    with tracing.span("replan.weather") as sp:
+        if state.get("error"):
+            return {}
+        lat, lon = _latlon(state)
+        stored = dict(state.get("weather_days") or {}) if state.get("weather_at") == [lat, lon] else {}
+        missing = [d for d in _trip_days(state)
+                   if d.isoformat() not in stored or not _fresh(d, stored[d.isoformat()]["_at"])]
+        sp.set(days=len(_trip_days(state)), missing_days=len(missing))
+        if not missing:
+            sp.set(reused=True)
+            return {}
+        # one fetch per contiguous run of missing days
+        runs: List[List[datetime.date]] = []
+        for d in missing:
+            if runs and runs[-1][-1] + datetime.timedelta(days=1) == d:
+                runs[-1].append(d)
+            else:
+                runs.append([d])
+        ctx = get_context()
+        now = time.time()
+        for run in runs:
+            daily = ctx.weather(lat, lon, run[0].isoformat(), run[-1].isoformat()) or {}
+            for i, day in enumerate(daily.get("time") or []):
+                stored[day] = {k: (daily.get(k) or [None] * (i + 1))[i] for k in DAILY_VARS}
+                stored[day]["_at"] = now
+        return {"weather_at": [lat, lon], "weather_days": stored}
+
+
+def _schedule(state: PlanState) -> PlanState:
+    from tools.itinerary_tools import plan_days, rainy_days
+
+    with tracing.span("replan.schedule") as sp:
+        if state.get("error"):
+            return {}
+        num_days = len(_trip_days(state))
+        pool = _pois(state)[:_pool_needed(state)]
+        weather = _weather_block(state)
+        key = [_latlon(state), num_days, state["daily_limit"], zlib.crc32("\n".join(p.name for p in pool).encode()),
+               rainy_days(weather, num_days)]
+        if key == state.get("schedule_key"):
+            sp.set(reused=True)
+            return {}
+        plans = plan_days(state["geo"], num_days, state["daily_limit"], pool, weather)
+        return {"schedule_key": key, "days": [p._asdict() for p in plans]}
+
+
+def _compose(state: PlanState) -> PlanState:
+    from main_graph import compose_fast_plan
+    from tools.itinerary_tools import render_itinerary
+    from tools.poi_tools import format_pois
+    from tools.weather_tools import format_weather
+
+    if state.get("error"):
+        return {"outputs": {}, "draft": state["error"]}
+    ctx = get_context()
+    g = state["geo"]
+    sd, ed = _dates(state)
+    pois = _pois(state)
+    weather = _weather_block(state)
+    plans = [DayPlan(**d) for d in state.get("days") or []]
+    outputs = {
+        "itinerary_tool": render_itinerary(g, sd, ed, plans, pois[:_pool_needed(state)], weather,
+                                           pois_note=failure_note(ctx.errors.get("pois"))),
+        "weather_tool": format_weather(g["name"], sd.isoformat(), ed.isoformat(), weather, ctx),
+        "poi_tool": format_pois(g, pois_within(pois, g["lat"], g["lon"], POI_LIST_RADIUS, POI_LIST_LIMIT), ctx),
+    }
+    return {"outputs": outputs,
+            "draft": compose_fast_plan(outputs["itinerary_tool"], outputs["weather_tool"], outputs["poi_tool"])}
+
+
+def _answered(state: PlanState) -> bool:
+    """The stored answer was written from the current draft in the current mode."""
+    return bool(state.get("answer")) and state.get("answer_from") == state["draft"] \
+        and state.get("answer_mode") == state["mode"]
+
+
+def _polish(state: PlanState) -> PlanState:
+    from main_graph import polish_plan
+
+    draft = state["draft"]
+    if state["mode"] == "fast" or state.get("error"):
+        return {"answer": draft, "answer_from": draft, "answer_mode": state["mode"]}
+    if _answered(state):
+        return {}
+    return {"answer": polish_plan(draft), "answer_from": draft, "answer_mode": state["mode"]}
+
+
+def _agent(state: PlanState) -> PlanState:
+    from main_graph import _user_request, get_supervisor, invoke_agent
+
+    if _answered(state):
+        return {}
+    # the supervisor's tool calls find the session's results in the plan's context
+    ctx = get_context()
+    lat, lon = _latlon(state)
+    ctx.seed_geocode(state["city"], state["geo"])
+    if state.get("pool_at") == [lat, lon]:
+        ctx.seed_pois(lat, lon, POOL_RADIUS, state["pool_limit"], _pois(state))
+    weather = _weather_block(state)
+    if weather:
+        ctx.seed_weather(lat, lon, weather)
+    answer = invoke_agent(get_supervisor(), {"messages": [
+        {"role": "user", "content": _user_request(state["city"], state["start_date"], state["end_date"],
+                                                  state["daily_limit"])}
+    ]})
+    return {"answer": answer, "answer_from": state["draft"], "answer_mode": "agent"}
+
+
+def _after_request(state: PlanState) -> str:
+    return "compose" if state.get("error") else "geocode"
+
+
+def _after_compose(state: PlanState) -> str:
+    return "agent" if state["mode"] == "agent" and not state.get("error") else "polish"
+
+
+def _build():
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    os.makedirs(os.path.dirname(REPLAN_DB) or ".", exist_ok=True)
+    saver = SqliteSaver(sqlite3.connect(REPLAN_DB, check_same_thread=False))
+    g = StateGraph(PlanState)
+    for name, fn in (("request", _request), ("geocode", _geocode), ("pois", _pool), ("weather", _weather),
+                     ("schedule", _schedule), ("compose", _compose), ("polish", _polish), ("agent", _agent)):
+        g.add_node(name, fn)
+    g.add_edge(START, "request")
+    g.add_conditional_edges("request", _after_request, ["geocode", "compose"])
+    # POIs and weather only depend on the geocode: they run side by side
+    g.add_edge("geocode", "pois")
+    g.add_edge("geocode", "weather")
+    g.add_edge(["pois", "weather"], "schedule")
+    g.add_edge("schedule", "compose")
+    g.add_conditional_edges("compose", _after_compose, ["polish", "agent"])
+    g.add_edge("polish", END)
+    g.add_edge("agent", END)
+    return g.compile(checkpointer=saver)
+
+
+def get_replanner():
+    """The compiled re-planning graph (one per process and REPLAN_DB)."""
+    return get_graph("replan", REPLAN_DB, _build)
+
+
+def _run_config(session: str) -> Dict[str, Any]:
+    return {"configurable": {"thread_id": session}}
+
+
+def stream_replan(session: str, city: str, start_date: str, end_date: str, daily_limit: int = 3,
+                  mode: str = "fast_polish") -> Iterator[Tuple[str, Any]]:
+    """Run the plan of `session` for these parameters, yielding LangGraph
+    ("updates", {node: update}) and ("messages", (chunk, meta)) items; an
+    empty update means the node reused the session's stored result.
+    `mode` is one of main_graph.PLAN_MODES."""
+    graph = get_replanner()
+    request = {"city": city, "start_date": start_date, "end_date": end_date, "daily_limit": int(daily_limit),
+               "mode": mode, "error": None}
+    with (current_context() or FetchContext()).activate():
+        # only the final state of a run is written: that is all the next run needs
+        yield from graph.stream(request, _run_config(session), stream_mode=["updates", "messages"],
+                                durability="exit")
+    _keep_latest(graph.checkpointer, session)
+
+
+def _keep_latest(saver: Any, session: str) -> None:
+    # SqliteSaver has no prune(); checkpoint ids sort by time, as its own "latest" lookup relies on
+    latest = "(SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?)"
+    with saver.cursor() as cur:
+        for table in ("checkpoints", "writes"):
+            cur.execute(f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id < {latest}", (session, session))
+
+
+def session_answer(session: str) -> Optional[str]:
+    """The answer of the session's latest plan (None if it has none)."""
+    return get_replanner().get_state(_run_config(session)).values.get("answer")
+
+
+def replan(session: str, city: str, start_date: str, end_date: str, daily_limit: int = 3,
+           mode: str = "fast_polish") -> Optional[str]:
+    """Plan (or re-plan) the trip of `session` and return the markdown answer."""
+    for _ in stream_replan(session, city, start_date, end_date, daily_limit, mode):
+        pass
+    return session_answer(session)
+
+
+def forget_session(session: str) -> None:
+    """Drop everything stored for `session`."""
+    get_replanner().checkpointer.delete_thread(session)
@@ -1,65 +1,198 @@
 # agents/supervisor_agent.py
-from typing import Callable
+import asyncio
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage
+from langchain_core.tools import StructuredTool
 
+from agents.compaction import pre_model_hook, turn_limit
+from agents.registry import get_graph, get_llm, llm_key
 from agents.weather_agent import build_weather_agent
 from agents.poi_agent import build_poi_agent
 from agents.itinerary_agent import build_itinerary_agent
+from tools import tracing
+
+# Per-child time budget (seconds) and the number of child conversations that may run
+# at once across the process when called through the sync path.
+CHILD_AGENT_TIMEOUT = float(os.getenv("CHILD_AGENT_TIMEOUT", 60))
+CHILD_AGENT_WORKERS = int(os.getenv("CHILD_AGENT_WORKERS", 6))
+
+# Sync callers run their children on one shared event loop thread, through the
+# async path, so a child past its timeout is cancelled instead of left running.
+_child_loop: Optional[asyncio.AbstractEventLoop] = None
+_child_slots: Optional[asyncio.Semaphore] = None
+_child_loop_lock = threading.Lock()
 
 # We will return the supervisor agent that has wrapper tools that call the child agents.
 # These wrappers must have docstrings (for schema conversion).
 
+
+def final_text(state: Any) -> str:
+    """Text of the child's final answer: the last AI message that is not a tool call."""
+    msgs = state.get("messages", []) if isinstance(state, dict) else []
+    for m in reversed(msgs):
+        if isinstance(m, AIMessage):
+            if m.content and not m.tool_calls:
+                return m.content if isinstance(m.content, str) else str(m.content)
+        elif isinstance(m, dict) and m.get("role") in ("assistant", "ai") and m.get("content"):
+            return m.get("content")
+    return "ERROR: child produced no answer"
+
+
+def _payload(prompt: str) -> Dict[str, Any]:
+    return {"messages": [{"role": "user", "content": prompt}]}
+
+
+def _run_on_child_loop(make_coro: Callable[[asyncio.Semaphore], Any]) -> Any:
+    """Run `make_coro(slots)` on the shared child loop and wait for its result.
+
+    The coroutine is scheduled from this thread, so it sees the caller's
+    context variables (e.g. the plan's FetchContext and trace span).
+    """
+    global _child_loop, _child_slots
+    with _child_loop_lock:
+        if _child_loop is None:
+            _child_loop = asyncio.new_event_loop()
+            _child_slots = asyncio.Semaphore(CHILD_AGENT_WORKERS)
+            threading.Thread(target=_child_loop.run_forever, name="child-agents", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(make_coro(_child_slots), _child_loop).result()
+
+
+async def _ainvoke(agent, prompt: str, slots: Optional[asyncio.Semaphore]) -> Any:
+    if slots is None:
+        return await agent.ainvoke(_payload(prompt))
+    async with slots:
+        return await agent.ainvoke(_payload(prompt))
+
+
+def run_child(agent, prompt: str, timeout: float = CHILD_AGENT_TIMEOUT, name: str = "child") -> str:
+    """Invoke a child agent, giving up after `timeout` seconds.
+
+    Runs arun_child on the shared child loop, at most CHILD_AGENT_WORKERS
+    children at a time; a child that times out is cancelled.
+    """
+    return _run_on_child_loop(lambda slots: arun_child(agent, prompt, timeout, name, slots))
+
+
+async def arun_child(agent, prompt: str, timeout: float = CHILD_AGENT_TIMEOUT, name: str = "child",
+                     slots: Optional[asyncio.Semaphore] = None) -> str:
+    """Async run_child: the child is cancelled outright when it exceeds `timeout`.
+
+    With `slots` the child waits for a free slot first, within the same timeout.
+    """
+    try:
+        with tracing.span(f"agent:{name}"):
+            return final_text(await asyncio.wait_for(_ainvoke(agent, prompt, slots), timeout))
+    except asyncio.TimeoutError:
+        return f"TIMEOUT: no answer within {timeout:.0f}s."
+    except Exception as e:
+        return f"ERROR: {e.__class__.__name__}: {e}"
+
+
+def run_children(calls: List[Tuple[str, Any, str]], timeout: float = CHILD_AGENT_TIMEOUT) -> Dict[str, str]:
+    """Fan out (name, agent, prompt) calls concurrently and join their answers by name."""
+    return _run_on_child_loop(lambda slots: arun_children(calls, timeout, slots))
+
+
+async def arun_children(calls: List[Tuple[str, Any, str]], timeout: float = CHILD_AGENT_TIMEOUT,
+                        slots: Optional[asyncio.Semaphore] = None) -> Dict[str, str]:
+    """Async run_children: children run as tasks, each with its own timeout."""
+    answers = await asyncio.gather(*(arun_child(agent, prompt, timeout, name, slots)
+                                     for name, agent, prompt in calls))
+    return {name: answer for (name, _, _), answer in zip(calls, answers)}
+
+
 def build_supervisor_agent(model: str, api_key: str, base_url: str, temperature: float = 0.2):
+    """Supervisor over the three child agents. Built once per configuration; all four
+    agents share a single pooled LLM client (agents.registry)."""
+    return get_graph(
+        "supervisor_agent",
+        llm_key(model, base_url, temperature, api_key),
+        lambda: _build_supervisor_agent(model, api_key, base_url, temperature),
+    )
+
+
+def _build_supervisor_agent(model: str, api_key: str, base_url: str, temperature: float):
     # Build child agents
     weather_agent = build_weather_agent(model, api_key, base_url, temperature)
     poi_agent = build_poi_agent(model, api_key, base_url, temperature)
     itinerary_agent = build_itinerary_agent(model, api_key, base_url, temperature)
 
-    # wrapper functions that call the child agents' invoke and return their output
+    def weather_prompt(city, start_date, end_date):
+        return f"Provide weather for {city} from {start_date} to {end_date}."
+
+    def poi_prompt(city, radius, limit):
+        return f"Find POIs near {city}; radius={radius}; limit={limit}."
+
+    def itinerary_prompt(city, start_date, end_date, daily_limit):
+        return f"Create itinerary for {city} from {start_date} to {end_date}, daily_limit={daily_limit}."
+
+    def trip_calls(city, start_date, end_date, daily_limit, radius, limit):
+        return [
+            ("weather", weather_agent, weather_prompt(city, start_date, end_date)),
+            ("pois", poi_agent, poi_prompt(city, radius, limit)),
+            ("itinerary", itinerary_agent, itinerary_prompt(city, start_date, end_date, daily_limit)),
+        ]
+
+    def join(results: Dict[str, str]) -> str:
+        return "\n\n".join(f"## {name.title()}\n{text}" for name, text in results.items())
+
+    # wrapper functions that call the child agents and return their final answer
     def weather_agent_call(city: str, start_date: str, end_date: str) -> str:
         """Call the weather agent. Args: city (str), start_date (YYYY-MM-DD), end_date (YYYY-MM-DD)."""
-        payload = {"messages": [{"role": "user", "content": f"Provide weather for {city} from {start_date} to {end_date}."}]}
-        state = weather_agent.invoke(payload)
-        # extract best textual output robustly:
-        msgs = state.get("messages", []) if isinstance(state, dict) else []
-        for m in msgs:
-            if isinstance(m, dict) and m.get("content"):
-                return m.get("content")
-        # fallback
-        return str(state)
+        return run_child(weather_agent, weather_prompt(city, start_date, end_date), name="weather")
+
+    async def aweather_agent_call(city: str, start_date: str, end_date: str) -> str:
+        return await arun_child(weather_agent, weather_prompt(city, start_date, end_date), name="weather")
 
     def poi_agent_call(city: str, radius: int = 2000, limit: int = 8) -> str:
         """Call the POI agent. Args: city (str), radius (int), limit (int)."""
-        payload = {"messages": [{"role": "user", "content": f"Find POIs near {city}; radius={radius}; limit={limit}."}]}
-        state = poi_agent.invoke(payload)
-        msgs = state.get("messages", []) if isinstance(state, dict) else []
-        for m in msgs:
-            if isinstance(m, dict) and m.get("content"):
-                return m.get("content")
-        return str(state)
+        return run_child(poi_agent, poi_prompt(city, radius, limit), name="pois")
+
+    async def apoi_agent_call(city: str, radius: int = 2000, limit: int = 8) -> str:
+        return await arun_child(poi_agent, poi_prompt(city, radius, limit), name="pois")
 
     def itinerary_agent_call(city: str, start_date: str, end_date: str, daily_limit: int = 3) -> str:
         """Call the itinerary agent. Args: city (str), start_date (YYYY-MM-DD), end_date (YYYY-MM-DD), daily_limit (int)."""
-        payload = {"messages": [{"role": "user", "content": f"Create itinerary for {city} from {start_date} to {end_date}, daily_limit={daily_limit}."}]}
-        state = itinerary_agent.invoke(payload)
-        msgs = state.get("messages", []) if isinstance(state, dict) else []
-        for m in msgs:
-            if isinstance(m, dict) and m.get("content"):
-                return m.get("content")
-        return str(state)
+        return run_child(itinerary_agent, itinerary_prompt(city, start_date, end_date, daily_limit), name="itinerary")
+
+    async def aitinerary_agent_call(city: str, start_date: str, end_date: str, daily_limit: int = 3) -> str:
+        return await arun_child(itinerary_agent, itinerary_prompt(city, start_date, end_date, daily_limit), name="itinerary")
 
-    # now create supervisor LLM
-    llm = ChatOpenAI(model=model, api_key=api_key, base_url=base_url, temperature=temperature)
+    def all_agents_call(city: str, start_date: str, end_date: str, daily_limit: int = 3,
+                        radius: int = 2000, limit: int = 8) -> str:
+        """Call the weather, POI and itinerary agents in parallel and return all three answers.
+        Args: city (str), start_date (YYYY-MM-DD), end_date (YYYY-MM-DD), daily_limit (int), radius (int), limit (int)."""
+        return join(run_children(trip_calls(city, start_date, end_date, daily_limit, radius, limit)))
+
+    async def aall_agents_call(city: str, start_date: str, end_date: str, daily_limit: int = 3,
+                               radius: int = 2000, limit: int = 8) -> str:
+        return join(await arun_children(trip_calls(city, start_date, end_date, daily_limit, radius, limit)))
+
+    def as_tool(func: Callable, coroutine: Callable) -> StructuredTool:
+        return StructuredTool.from_function(func=func, coroutine=coroutine, name=func.__name__)
+
+    # supervisor LLM: the same shared client the child agents use
+    llm = get_llm(model, api_key, base_url, temperature)
 
     # register wrappers as tools for the supervisor: they must have docstrings (they do)
     agent = create_react_agent(
         model=llm,
-        tools=[weather_agent_call, poi_agent_call, itinerary_agent_call],
+        tools=[
+            as_tool(all_agents_call, aall_agents_call),
+            as_tool(weather_agent_call, aweather_agent_call),
+            as_tool(poi_agent_call, apoi_agent_call),
+            as_tool(itinerary_agent_call, aitinerary_agent_call),
+        ],
         prompt=(
             "You are a travel supervisor. Coordinate the weather agent, the POI agent "
-            "and the itinerary agent. Decide which agent to call and when, fetch results "
-            "and synthesize a final plan that includes weather, POIs and an itinerary table."
+            "and the itinerary agent. For a full trip plan call all_agents_call once: it "
+            "consults all three agents in parallel. Use the single-agent tools only to "
+            "refine one part, then synthesize a final plan that includes weather, POIs "
+            "and an itinerary table."
         ),
-    )
+        pre_model_hook=pre_model_hook("supervisor_agent"),
+    ).with_config(turn_limit())
     return agent
@@ -1,7 +1,8 @@
 # agents/weather_agent.py
 from typing import Optional, Dict, Any
 from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
+from agents.compaction import pre_model_hook, turn_limit
+from agents.registry import get_graph, get_llm, llm_key
 
 from tools.weather_tools import weather_tool as weather_tool_func
 from tools.geocode import geocode_city
@@ -10,14 +11,19 @@ def build_weather_agent(model: str, api_key: str, base_url: str, temperature: fl
     """
     Build a standalone weather agent.
     Exposes a single tool `weather_tool(city, start_date, end_date)`.
+    The compiled graph and its LLM client are shared process-wide (agents.registry).
     """
-    llm = ChatOpenAI(model=model, api_key=api_key, base_url=base_url, temperature=temperature)
-    agent = create_react_agent(
-        model=llm,
-        tools=[weather_tool_func],
-        prompt=(
-            "You are a focused weather assistant. When asked, return a concise daily "
-            "weather summary for the given city and date range. Use the weather_tool."
-        ),
-    )
-    return agent
+    def build():
+        llm = get_llm(model, api_key, base_url, temperature)
+        agent = create_react_agent(
+            model=llm,
+            tools=[weather_tool_func],
+            prompt=(
+                "You are a focused weather assistant. When asked, return a concise daily "
+                "weather summary for the given city and date range. Use the weather_tool."
+            ),
+            pre_model_hook=pre_model_hook("weather_agent"),
+        ).with_config(turn_limit())
+        return agent
+
+    return get_graph("weather_agent", llm_key(model, base_url, temperature, api_key), build)
@@ -1,40 +1,75 @@
 # app.py
+import uuid
+
 import streamlit as st
-from main_graph import get_supervisor
-from langchain_core.messages import AIMessage, HumanMessage
+from main_graph import PLAN_MODE, PLAN_MODES, stream_plan
 
 st.set_page_config(page_title="Agentic Travel Planner", layout="wide")
 
 st.title("Agentic Travel Planner")
 
+MODE_LABELS = {
+    "agent": "Agent (LLM decides tool calls)",
+    "fast": "Fast (fixed pipeline, no LLM)",
+    "fast_polish": "Fast + one LLM polish pass",
+}
+TOOL_SECTIONS = {
+    "weather_tool": "Weather",
+    "poi_tool": "Points of Interest",
+    "itinerary_tool": "Draft itinerary",
+}
+
 city = st.text_input("City (e.g. Hyderabad)", "Hyderabad")
 start_date = st.text_input("Start date", "2025/10/02")
 end_date = st.text_input("End date", "2025/10/04")
 daily_limit = st.number_input("POIs per day", min_value=1, max_value=10, value=3)
+mode = st.radio("Planning mode", PLAN_MODES, index=PLAN_MODES.index(PLAN_MODE) if PLAN_MODE in PLAN_MODES else 0,
+                format_func=MODE_LABELS.get, horizontal=True)
+use_llm_cache = st.checkbox("Reuse cached model answers", value=True)
+# the plans of this browser session are checkpointed: changing a parameter and planning
+# again only recomputes what the change affects (agents/replan.py)
+session = st.session_state.setdefault("plan_session", uuid.uuid4().hex)
 
 if st.button("Plan Trip"):
-    with st.spinner("Planning trip..."):
-        supervisor = get_supervisor()
-        state = supervisor.invoke({
-            "messages": [
-                {"role": "user", "content": f"I want a trip plan to {city} from {start_date} to {end_date}. Provide weather, POIs and itinerary with daily limit {daily_limit}."}
-            ]
-        })
-
-        msgs = state.get("messages", [])
-
-        # ✅ Extract only the final AI message (not tool calls)
-        final_msg = None
-        for m in reversed(msgs):  # iterate backwards
-            if isinstance(m, AIMessage):
-                final_msg = m.content
-                break
-            elif isinstance(m, dict) and m.get("role") == "assistant":
-                final_msg = m.get("content")
-                break
-
-        if final_msg:
+    status = st.status("Planning trip...")
+    # tool results render as soon as each tool returns; the answer streams token by token
+    live = {name: st.empty() for name in TOOL_SECTIONS}
+    answer = st.empty()
+    tokens, timings, final_msg, trace = [], [], None, None
+
+    for ev in stream_plan(city, start_date, end_date, int(daily_limit), mode=mode, use_llm_cache=use_llm_cache,
+                          session=session):
+        if ev.kind == "tool_start":
+            status.update(label=f"Calling {ev.name}... ({ev.elapsed:.1f}s)")
+        elif ev.kind == "tool" and ev.name in live:
+            with live[ev.name].container():
+                with st.expander(f"{TOOL_SECTIONS[ev.name]} (ready after {ev.elapsed:.1f}s)", expanded=False):
+                    st.markdown(ev.data)
+        elif ev.kind == "token":
+            tokens.append(ev.data)
+            answer.markdown("".join(tokens))
+        elif ev.kind == "discard":
+            tokens.clear()
+            answer.empty()
+        elif ev.kind == "stage":
+            timings.append({"stage": ev.name, "seconds": round(ev.data, 2), "finished at (s)": round(ev.elapsed, 2)})
+        elif ev.kind == "trace":
+            trace = ev.data
+        elif ev.kind == "final":
+            final_msg = ev.data
+            timings.append({"stage": "total", "seconds": round(ev.elapsed, 2), "finished at (s)": round(ev.elapsed, 2)})
+
+    if final_msg:
+        status.update(label="Trip planned", state="complete")
+        with answer.container():
             st.markdown("## Result")
             st.markdown(final_msg)
-        else:
-            st.error("No final itinerary generated. Please check logs.")
+    else:
+        status.update(label="Planning failed", state="error")
+        st.error("No final itinerary generated. Please check logs.")
+
+    with st.expander("Where the time went"):
+        st.table(timings)
+        if trace:
+            st.caption("Per-stage trace (spans, payload sizes, tokens, retries, cache hits)")
+            st.json(trace, expanded=False)
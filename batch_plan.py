@@ -0,0 +1,282 @@
+# batch_plan.py
+"""
+Plan many trips from a JSONL file.
+
+Each input line is a trip request:
+
+    {"id": "pkg-17", "city": "Hyderabad", "start_date": "2025-12-01", "end_date": "2025-12-03", "daily_limit": 3}
+
+`id` is optional (a hash of the request is used instead) and so are
+`daily_limit` (default 3) and `mode` (one of main_graph.PLAN_MODES, default
+--mode). Requests for the same city share one FetchContext, whose geocode,
+POI pool and weather are fetched once up front (weather once per run of
+overlapping or adjacent trip dates, so trips months apart do not pull in the
+days between them). Every plan in the group is then answered from that context.
+
+Plans run on a bounded thread pool. Per-host concurrency and rate limits are
+still enforced by tools.transport, so --workers only bounds how many plans
+are in flight. Results are appended to the output JSONL as they finish, one
+line per request with its timings. Rerunning with the same output file skips
+requests already answered successfully, so an interrupted batch resumes where
+it stopped.
+
+    python batch_plan.py trips.jsonl -o plans.jsonl --workers 4 --mode fast
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from dateutil.parser import parse as parse_date
+
+from tools import tracing
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 4))
+
+
+def request_id(req: Dict[str, Any]) -> str:
+    """The request's own `id`, or a stable hash of what it asks for."""
+    if req.get("id") not in (None, ""):
+        return str(req["id"])
+    fields = [req.get("city"), req.get("start_date"), req.get("end_date"),
+              int(req.get("daily_limit") or 3), req.get("mode")]
+    return hashlib.sha1(json.dumps(fields).encode("utf-8")).hexdigest()[:16]
+
+
+def read_requests(path: str) -> List[Dict[str, Any]]:
+    reqs = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{lineno}: invalid JSON ({e})") from e
+            if not isinstance(req, dict) or not req.get("city"):
+                raise ValueError(f"{path}:{lineno}: each line needs at least a 'city'")
+            reqs.append(req)
+    return reqs
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids already answered successfully in an existing output file."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if isinstance(row, dict) and row.get("status") == "ok":
+                done.add(str(row.get("id")))
+    return done
+
+
+def merge_ranges(ranges: Iterable[Tuple[datetime.date, datetime.date]]) -> List[Tuple[datetime.date, datetime.date]]:
+    """Merge overlapping or adjacent (start, end) date ranges, in date order."""
+    merged: List[Tuple[datetime.date, datetime.date]] = []
+    for sd, ed in sorted(ranges):
+        if merged and sd <= merged[-1][1] + datetime.timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], ed))
+        else:
+            merged.append((sd, ed))
+    return merged
+
+
+class _Output:
+    """Append-only JSONL writer shared by the workers; every row is flushed to disk."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        # terminate a line left half-written by a crash so the next row starts cleanly
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._f = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._f.write("\n")
+
+    def write(self, row: Dict[str, Any]) -> None:
+        line = json.dumps(row, ensure_ascii=False)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class _CityGroup:
+    """All requests for one city, served from one shared FetchContext."""
+
+    def __init__(self, city: str, reqs: List[Dict[str, Any]]):
+        from tools.fetch_context import FetchContext
+
+        self.city = city
+        self.reqs = reqs
+        self.ctx = FetchContext()
+        self._lock = threading.Lock()
+        self._prefetched = False
+        self.prefetch_seconds = 0.0
+
+    def prefetch(self) -> float:
+        """Fetch the group's shared data once; returns the time this call spent waiting on it."""
+        from tools.itinerary_tools import itinerary_pool
+
+        t0 = time.perf_counter()
+        with self._lock:
+            if self._prefetched:
+                return time.perf_counter() - t0
+            self._prefetched = True
+            g = self.ctx.geocode(self.city)
+            if g is not None:
+                trips = []
+                for r in self.reqs:
+                    try:
+                        sd, ed = parse_date(r["start_date"]).date(), parse_date(r["end_date"]).date()
+                    except Exception:
+                        continue
+                    if ed >= sd:
+                        trips.append((sd, ed, int(r.get("daily_limit") or 3)))
+                if trips:
+                    # the itinerary tool asks for the largest POI pool; size it for the biggest trip
+                    radius, pool_limit = max(itinerary_pool(limit, (ed - sd).days + 1) for sd, ed, limit in trips)
+                    self.ctx.pois(g["lat"], g["lon"], radius=radius, limit=pool_limit)
+                    for sd, ed in merge_ranges((sd, ed) for sd, ed, _ in trips):
+                        self.ctx.weather(g["lat"], g["lon"], sd.isoformat(), ed.isoformat())
+            self.prefetch_seconds = time.perf_counter() - t0
+            return self.prefetch_seconds
+
+
+def group_by_city(reqs: Iterable[Dict[str, Any]]) -> List[_CityGroup]:
+    from tools.geocode import normalize_query
+
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    names: Dict[str, str] = {}
+    for r in reqs:
+        key = normalize_query(r["city"])
+        groups.setdefault(key, []).append(r)
+        names.setdefault(key, r["city"])
+    return [_CityGroup(names[k], v) for k, v in groups.items()]
+
+
+def _run_one(group: _CityGroup, req: Dict[str, Any], mode: Optional[str], use_llm_cache: bool,
+             submitted: float) -> Dict[str, Any]:
+    from main_graph import plan_trip
+
+    started = time.perf_counter()
+    row: Dict[str, Any] = {
+        "id": request_id(req),
+        "city": req.get("city"),
+        "start_date": req.get("start_date"),
+        "end_date": req.get("end_date"),
+        "daily_limit": int(req.get("daily_limit") or 3),
+        "mode": req.get("mode") or mode,
+    }
+    prefetch_s, plan_start, tr = 0.0, started, None
+    try:
+        with tracing.trace("batch_request", id=row["id"], city=row["city"]) as tr:
+            prefetch_s = group.prefetch()
+            plan_start = time.perf_counter()
+            with group.ctx.activate():
+                plan = plan_trip(row["city"], row["start_date"], row["end_date"], row["daily_limit"],
+                                 mode=row["mode"], use_llm_cache=use_llm_cache)
+        if not plan:
+            row.update(status="error", plan=None, error="the planner produced no answer")
+        elif plan.startswith("ERROR:"):
+            row.update(status="error", plan=None, error=plan[len("ERROR:"):].strip())
+        else:
+            row.update(status="ok", plan=plan, error=None)
+    except Exception as e:
+        row.update(status="error", plan=None, error=f"{type(e).__name__}: {e}")
+    done = time.perf_counter()
+    row["timings"] = {
+        "queued_s": round(started - submitted, 4),
+        "prefetch_s": round(prefetch_s, 4),
+        "plan_s": round(done - plan_start, 4),
+        "total_s": round(done - submitted, 4),
+    }
+    if tr is not None:
+        d = tr.to_dict()
+        row["stages"], row["counters"] = d["stages"], d["counters"]
+    row["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return row
+
+
+def run_batch(input_path: str, output_path: str, workers: int = BATCH_WORKERS, mode: Optional[str] = None,
+              use_llm_cache: bool = True, log=sys.stderr) -> Dict[str, Any]:
+    """Plan every request in `input_path`, appending results to `output_path`. Returns a summary."""
+    t0 = time.perf_counter()
+    reqs = read_requests(input_path)
+    done = completed_ids(output_path)
+    todo = [r for r in reqs if request_id(r) not in done]
+    groups = group_by_city(todo)
+    out = _Output(output_path)
+    ok = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            # interleave groups so one big city does not hold every worker on its prefetch
+            order = []
+            for i in range(max((len(g.reqs) for g in groups), default=0)):
+                order.extend((g, g.reqs[i]) for g in groups if i < len(g.reqs))
+            futures = [ex.submit(_run_one, g, r, mode, use_llm_cache, time.perf_counter()) for g, r in order]
+            for fut in as_completed(futures):
+                row = fut.result()
+                out.write(row)
+                if row["status"] == "ok":
+                    ok += 1
+                else:
+                    failed += 1
+                if log is not None:
+                    print(f"[{ok + failed}/{len(todo)}] {row['id']} {row['city']}: {row['status']} "
+                          f"({row['timings']['total_s']:.2f}s)", file=log)
+    finally:
+        out.close()
+    upstream = {"geocode": 0, "pois": 0, "weather": 0}
+    for g in groups:
+        for k, v in g.ctx.upstream_calls.items():
+            upstream[k] = upstream.get(k, 0) + v
+    return {
+        "requests": len(reqs),
+        "skipped": len(reqs) - len(todo),
+        "ok": ok,
+        "failed": failed,
+        "groups": len(groups),
+        "upstream_calls": upstream,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from main_graph import PLAN_MODE, PLAN_MODES
+
+    ap = argparse.ArgumentParser(description="Plan trips in bulk from a JSONL file.")
+    ap.add_argument("input", help="JSONL file of trip requests")
+    ap.add_argument("-o", "--output", default="plans.jsonl", help="JSONL results file (appended; enables resume)")
+    ap.add_argument("-w", "--workers", type=int, default=BATCH_WORKERS, help="plans in flight at once")
+    ap.add_argument("--mode", choices=PLAN_MODES, default=PLAN_MODE, help="default plan mode")
+    ap.add_argument("--no-llm-cache", action="store_true", help="force fresh model calls")
+    args = ap.parse_args(argv)
+
+    summary = run_batch(args.input, args.output, workers=args.workers, mode=args.mode,
+                        use_llm_cache=not args.no_llm_cache)
+    print(json.dumps(summary, indent=2))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Offline benchmarks: local upstream stand-ins and a load harness (python -m bench.harness)."""
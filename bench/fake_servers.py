@@ -0,0 +1,415 @@
+"""
+Local stand-ins for Nominatim, Overpass, Open-Meteo and an OpenAI-compatible
+chat endpoint, for offline benchmarks.
+
+Each service runs on its own loopback port in a daemon thread and can be
+given a latency (mean + uniform jitter, in seconds) and an error rate (the
+share of requests answered with `error_status`). Responses are synthesized
+deterministically from the request, or replayed from recorded JSON fixtures:
+
+    fixtures/nominatim.json    {"<city>": [<nominatim result>, ...], ...}
+    fixtures/overpass.json     {"elements": [...]}            (served for every query)
+    fixtures/open_meteo.json   {"daily": {...}}               (sliced to the requested dates)
+
+The chat endpoint plays a scripted ReAct turn: when the conversation does not
+end in tool results it calls the offered tools (only `all_agents_call` when
+the supervisor offers it), filling arguments from the city and dates in the
+last user message; once tool results are present it returns a final answer
+built from them.
+
+    with FakeUpstreams() as fake:
+        fake.apply_env()          # point the fetchers and the LLM client at it
+        ...
+        fake.counts()             # -> {"nominatim": 3, "overpass": 3, ...}
+"""
+from __future__ import annotations
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+SERVICES = ("nominatim", "overpass", "open_meteo", "llm")
+
+_CATEGORIES = [
+    ("tourism", "museum"), ("tourism", "attraction"), ("tourism", "gallery"), ("historic", "monument"),
+    ("leisure", "park"), ("amenity", "theatre"), ("tourism", "viewpoint"), ("amenity", "marketplace"),
+]
+
+
+class ServiceConfig(NamedTuple):
+    latency: float = 0.0       # mean added delay per request, seconds
+    jitter: float = 0.0        # +/- uniform jitter around `latency`
+    error_rate: float = 0.0    # share of requests answered with error_status
+    error_status: int = 503
+    pois_per_query: int = 120  # overpass: elements available around any point
+
+
+def _seed(*parts: Any) -> int:
+    return int(hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).hexdigest()[:12], 16)
+
+
+def _load_fixture(fixtures: Optional[str], name: str) -> Any:
+    if not fixtures:
+        return None
+    path = os.path.join(fixtures, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# --- synthesized upstream answers ------------------------------------------
+
+def nominatim_answer(q: str) -> List[Dict[str, Any]]:
+    if not q.strip() or "nowhere" in q.lower():
+        return []
+    rnd = random.Random(_seed("geo", q.strip().lower()))
+    return [{"lat": f"{rnd.uniform(-60, 60):.6f}", "lon": f"{rnd.uniform(-170, 170):.6f}",
+             "display_name": q.strip().title()}]
+
+
+def _overpass_elements(radius: int, lat: float, lon: float, limit: int, available: int,
+                       first_id: int) -> List[Dict[str, Any]]:
+    rnd = random.Random(_seed("poi", round(lat, 4), round(lon, 4)))
+    elements = []
+    for i in range(min(limit, available)):
+        key, value = _CATEGORIES[i % len(_CATEGORIES)]
+        # spread inside the query circle (degrees ~ metres / 111 km)
+        r = radius * (rnd.random() ** 0.5) / 111_000
+        a = rnd.uniform(0, 2 * math.pi)
+        plat, plon = lat + r * math.cos(a), lon + r * math.sin(a)
+        tags = {key: value, "name": f"{value.title()} {i + 1}"}
+        if i % 3 == 2:
+            elements.append({"type": "way", "id": first_id + i, "center": {"lat": plat, "lon": plon}, "tags": tags})
+        else:
+            elements.append({"type": "node", "id": first_id + i, "lat": plat, "lon": plon, "tags": tags})
+    return elements
+
+
+def overpass_answer(query: str, available: int) -> Dict[str, Any]:
+    # one block per distinct circle; batched queries ("->.leg0; .leg0 out count; ...") hold several
+    centers = list(dict.fromkeys(re.findall(r"around:(\d+),(-?[\d.]+),(-?[\d.]+)", query))) or [("2000", "0", "0")]
+    # output limits ("out body 40;"), not "[out:json][timeout:15]"; two per block (nodes, ways)
+    limits = [int(n) for n in re.findall(r"\bout\s[^;]*?(\d+)\s*;", query)] or [available]
+    batched = "out count" in query
+    elements = []
+    for k, (radius, lat, lon) in enumerate(centers):
+        limit = limits[min(2 * k, len(limits) - 1)]
+        if batched:
+            nodes = sum(1 for i in range(available) if i % 3 != 2)
+            elements.append({"type": "count", "id": 0, "tags": {
+                "nodes": str(nodes), "ways": str(available - nodes), "relations": "0", "total": str(available)}})
+        elements += _overpass_elements(int(radius), float(lat), float(lon), limit, available, 10_000 * k)
+    return {"elements": elements}
+
+
+def _open_meteo_daily(lat: Optional[str], lon: Optional[str], days: List[str]) -> Dict[str, Any]:
+    rnd = random.Random(_seed("wx", lat, lon))
+    daily = {"time": days, "temperature_2m_max": [], "temperature_2m_min": [], "precipitation_sum": [], "weathercode": []}
+    for _ in days:
+        tmax = round(rnd.uniform(12, 34), 1)
+        daily["temperature_2m_max"].append(tmax)
+        daily["temperature_2m_min"].append(round(tmax - rnd.uniform(5, 12), 1))
+        daily["precipitation_sum"].append(round(max(0.0, rnd.gauss(1.5, 4)), 1))
+        daily["weathercode"].append(rnd.choice([0, 1, 2, 3, 61, 63]))
+    return daily
+
+
+def open_meteo_answer(params: Dict[str, str], recorded: Optional[Dict[str, Any]] = None) -> Any:
+    sd = date.fromisoformat(params["start_date"])
+    ed = date.fromisoformat(params["end_date"])
+    days = [(sd + timedelta(days=i)).isoformat() for i in range((ed - sd).days + 1)]
+
+    def daily_for(lat: str, lon: str) -> Dict[str, Any]:
+        if recorded:
+            daily = recorded.get("daily", {})
+            times = daily.get("time", [])
+            idx = [times.index(d) for d in days if d in times]
+            return {k: [v[i] for i in idx] for k, v in daily.items() if isinstance(v, list)}
+        return _open_meteo_daily(lat, lon, days)
+
+    # comma-separated coordinates ask for several locations: the answer is a list in that order
+    lats = str(params.get("latitude", "")).split(",")
+    lons = str(params.get("longitude", "")).split(",")
+    if len(lats) == 1:
+        return {"daily": daily_for(params.get("latitude"), params.get("longitude"))}
+    return [{"latitude": float(lat), "longitude": float(lon), "daily": daily_for(lat, lon)}
+            for lat, lon in zip(lats, lons)]
+
+
+# --- scripted chat model -----------------------------------------------------
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_CITY = re.compile(r"(?:\bto|\bfor|\bnear|\bin)\s+([A-Z][^,;.\n]*?)(?:\s+from\b|[,;.\n]|$)")
+
+
+def _trip_args(text: str) -> Dict[str, Any]:
+    dates = _DATE.findall(text)
+    m = _CITY.search(text)
+    limit = re.search(r"daily[ _]limit\D*(\d+)", text)
+    return {
+        "city": m.group(1).strip() if m else "Benchville",
+        "start_date": dates[0] if dates else date.today().isoformat(),
+        "end_date": dates[1] if len(dates) > 1 else (dates[0] if dates else date.today().isoformat()),
+        "daily_limit": int(limit.group(1)) if limit else 3,
+    }
+
+
+def _tool_args(schema: Dict[str, Any], trip: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Arguments for a tool call from the trip in the request, or None if a required one is unknown."""
+    args = {}
+    for name, spec in (schema.get("properties") or {}).items():
+        if name in trip:
+            args[name] = trip[name]
+        elif "default" in spec:
+            args[name] = spec["default"]
+        elif spec.get("type") == "integer":
+            args[name] = 2000 if name == "radius" else 8
+    if any(name not in args for name in schema.get("required") or []):
+        return None
+    return args
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return content or ""
+
+
+def chat_answer(body: Dict[str, Any]) -> Dict[str, Any]:
+    """The assistant message for an OpenAI chat-completions request body."""
+    messages = body.get("messages") or []
+    if messages and messages[-1].get("role") == "tool":
+        results = []
+        for m in reversed(messages):
+            if m.get("role") != "tool":
+                break
+            results.append(_text(m.get("content")))
+        return {"role": "assistant", "content": "FINAL PLAN\n\n" + "\n\n".join(reversed(results))}
+
+    user = next((_text(m.get("content")) for m in reversed(messages) if m.get("role") == "user"), "")
+    trip = _trip_args(user)
+    tools = [t.get("function", {}) for t in body.get("tools") or []]
+    if any(t.get("name") == "all_agents_call" for t in tools):
+        tools = [t for t in tools if t.get("name") == "all_agents_call"]
+    if not tools:
+        return {"role": "assistant", "content": f"Plan for {trip['city']}."}
+    # tools whose arguments cannot be filled from a single-city request (multi-city legs) are skipped
+    args = [(t["name"], _tool_args(t.get("parameters") or {}, trip)) for t in tools]
+    calls = [{
+        "id": f"call_{uuid.uuid4().hex[:12]}",
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(a)},
+    } for name, a in args if a is not None]
+    if not calls:
+        return {"role": "assistant", "content": f"Plan for {trip['city']}."}
+    return {"role": "assistant", "content": None, "tool_calls": calls}
+
+
+def _usage(body: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, int]:
+    # rough token counts (~4 characters per token) so token accounting has something to add up
+    prompt = sum(len(_text(m.get("content"))) for m in body.get("messages") or []) // 4 + 1
+    completion = len(json.dumps(message)) // 4 + 1
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+# --- HTTP plumbing -------------------------------------------------------------
+
+class _Service:
+    def __init__(self, name: str, config: ServiceConfig, fixtures: Optional[str]):
+        self.name = name
+        self.config = config
+        self.fixtures = fixtures
+        self.recorded = {
+            "nominatim": _load_fixture(fixtures, "nominatim.json"),
+            "overpass": _load_fixture(fixtures, "overpass.json"),
+            "open_meteo": _load_fixture(fixtures, "open_meteo.json"),
+        }.get(name)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rnd = random.Random(_seed("errors", name))
+
+    def delay_and_fail(self) -> Optional[int]:
+        """Apply latency; return an error status to send instead of an answer, if any."""
+        c = self.config
+        with self.lock:
+            self.requests += 1
+            fail = c.error_rate > 0 and self.rnd.random() < c.error_rate
+            if fail:
+                self.errors += 1
+            delay = max(0.0, c.latency + (self.rnd.uniform(-c.jitter, c.jitter) if c.jitter else 0.0))
+        if delay:
+            time.sleep(delay)
+        return c.error_status if fail else None
+
+    def answer(self, path: str, query: Dict[str, str], body: bytes) -> Any:
+        if self.name == "nominatim":
+            q = query.get("q", "")
+            if isinstance(self.recorded, dict):
+                return self.recorded.get(q, self.recorded.get(q.lower(), []))
+            return nominatim_answer(q)
+        if self.name == "overpass":
+            if self.recorded is not None:
+                return self.recorded
+            text = body.decode("utf-8", "replace")
+            if text.startswith("data="):
+                text = parse_qs(text).get("data", [""])[0]
+            return overpass_answer(text, self.config.pois_per_query)
+        if self.name == "open_meteo":
+            return open_meteo_answer(query, self.recorded)
+        req = json.loads(body or b"{}")
+        message = chat_answer(req)
+        return req, message
+
+
+def _handler(service: _Service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # keep benchmark output clean
+            pass
+
+        def _send(self, status: int, payload: bytes, ctype: str = "application/json", extra=None):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(payload)))
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _handle(self, body: bytes):
+            status = service.delay_and_fail()
+            if status is not None:
+                extra = {"Retry-After": "0"} if status == 429 else None
+                self._send(status, b'{"error": "injected"}', extra=extra)
+                return
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            if service.name != "llm":
+                self._send(200, json.dumps(service.answer(parts.path, query, body)).encode("utf-8"))
+                return
+            req, message = service.answer(parts.path, query, body)
+            model = req.get("model", "fake-model")
+            created = int(time.time())
+            cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            if req.get("stream"):
+                self._stream(cid, created, model, req, message)
+                return
+            finish = "tool_calls" if message.get("tool_calls") else "stop"
+            payload = {
+                "id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+                "usage": _usage(req, message),
+            }
+            self._send(200, json.dumps(payload).encode("utf-8"))
+
+        def _stream(self, cid: str, created: int, model: str, req: Dict[str, Any], message: Dict[str, Any]):
+            def chunk(delta, finish=None, usage=None):
+                d = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+                if usage:
+                    d["usage"] = usage
+                return f"data: {json.dumps(d)}\n\n".encode("utf-8")
+
+            frames = [chunk({"role": "assistant", "content": ""})]
+            if message.get("tool_calls"):
+                for i, tc in enumerate(message["tool_calls"]):
+                    frames.append(chunk({"tool_calls": [dict(tc, index=i)]}))
+                frames.append(chunk({}, "tool_calls"))
+            else:
+                words = re.findall(r"\S+\s*", message.get("content") or "")
+                for i in range(0, len(words), 8):
+                    frames.append(chunk({"content": "".join(words[i:i + 8])}))
+                frames.append(chunk({}, "stop"))
+            frames.append(chunk({}, usage=_usage(req, message)) if (req.get("stream_options") or {}).get("include_usage") else b"")
+            frames.append(b"data: [DONE]\n\n")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for f in frames:
+                if f:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(f), f))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            self._handle(b"")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self._handle(self.rfile.read(length) if length else b"")
+
+    return Handler
+
+
+class FakeUpstreams:
+    """All four stand-ins, each on its own loopback port."""
+
+    def __init__(self, configs: Optional[Dict[str, ServiceConfig]] = None, fixtures: Optional[str] = None,
+                 host: str = "127.0.0.1"):
+        configs = configs or {}
+        self.host = host
+        self.services = {name: _Service(name, configs.get(name, ServiceConfig()), fixtures) for name in SERVICES}
+        self._servers: Dict[str, ThreadingHTTPServer] = {}
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "FakeUpstreams":
+        for name, svc in self.services.items():
+            srv = ThreadingHTTPServer((self.host, 0), _handler(svc))
+            srv.daemon_threads = True
+            t = threading.Thread(target=srv.serve_forever, name=f"fake-{name}", daemon=True)
+            t.start()
+            self._servers[name] = srv
+            self._threads.append(t)
+        return self
+
+    def stop(self) -> None:
+        for srv in self._servers.values():
+            srv.shutdown()
+            srv.server_close()
+        self._servers.clear()
+
+    def __enter__(self) -> "FakeUpstreams":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def base(self, name: str) -> str:
+        return f"http://{self.host}:{self._servers[name].server_address[1]}"
+
+    @property
+    def urls(self) -> Dict[str, str]:
+        return {
+            "NOMINATIM_URL": self.base("nominatim") + "/search",
+            "OVERPASS_URL": self.base("overpass") + "/api/interpreter",
+            "OPEN_METEO_URL": self.base("open_meteo") + "/v1/forecast",
+            "OPENAI_API_BASE": self.base("llm") + "/v1",
+        }
+
+    def apply_env(self) -> None:
+        """Point the fetchers and the LLM client at the stand-ins (before importing them)."""
+        os.environ.update(self.urls)
+        os.environ.setdefault("GROQ_API_KEY", "bench-key")
+
+    def counts(self) -> Dict[str, int]:
+        return {name: svc.requests for name, svc in self.services.items()}
+
+    def errors(self) -> Dict[str, int]:
+        return {name: svc.errors for name, svc in self.services.items()}
+
+    def reset(self) -> None:
+        for svc in self.services.values():
+            with svc.lock:
+                svc.requests = svc.errors = 0
@@ -0,0 +1,343 @@
+"""
+Offline benchmark harness.
+
+Starts the local stand-ins from bench.fake_servers, points the fetchers and
+the LLM client at them, and plans trips through one of these entry points at
+a fixed concurrency:
+
+    tools        weather_tool, poi_tool and itinerary_tool called one after another
+    fast         main_graph.fast_plan (fixed pipeline, no LLM)
+    supervisor   main_graph.get_supervisor() via plan_trip(mode="agent")
+    multi_agent  agents.supervisor_agent.build_supervisor_agent(...).invoke
+
+It reports latency percentiles, throughput and external calls per plan. Every
+plan uses a fresh city by default, so the run measures cold-cache behaviour.
+Pass --cities to replay a smaller set and measure warm caches. Results can be
+saved as a baseline (bench/baselines/<name>.json), which records the run's
+configuration with its numbers; later runs print the change against it.
+--check re-runs the baseline's own configuration (plans, concurrency, cities,
+stand-in latencies and error rates, rate limits) whatever the other flags
+say, and exits non-zero on a regression.
+
+    python -m bench.harness supervisor --plans 50 --concurrency 8 --llm-latency 0.3
+    python -m bench.harness fast --plans 200 --concurrency 16 --save-baseline
+    python -m bench.harness fast --check
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from bench.fake_servers import SERVICES, FakeUpstreams, ServiceConfig
+
+SCENARIOS = ("tools", "fast", "supervisor", "multi_agent")
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+# relative slowdown of p50/p95 (or throughput drop) tolerated before --check fails
+DEFAULT_TOLERANCE = 0.25
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list (q in 0..100)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), int(round(q / 100.0 * len(sorted_values) + 0.5))))
+    return sorted_values[rank - 1]
+
+
+def trips(n: int, cities: Optional[int] = None, days: int = 3) -> List[Dict[str, Any]]:
+    """`n` trip requests over `cities` distinct cities (default: one city per trip)."""
+    cities = cities or n
+    today = datetime.date.today()
+    out = []
+    for i in range(n):
+        sd = today + datetime.timedelta(days=i % 7)
+        out.append({
+            "city": f"Benchcity {i % cities}",
+            "start_date": sd.isoformat(),
+            "end_date": (sd + datetime.timedelta(days=days - 1)).isoformat(),
+            "daily_limit": 3,
+        })
+    return out
+
+
+def _planner(scenario: str) -> Callable[[Dict[str, Any]], str]:
+    """The function that plans one trip for `scenario` (imports happen after the env is set)."""
+    if scenario == "tools":
+        from tools.itinerary_tools import itinerary_tool
+        from tools.poi_tools import poi_tool
+        from tools.weather_tools import weather_tool
+
+        def run(t):
+            parts = [weather_tool(t["city"], t["start_date"], t["end_date"]),
+                     poi_tool(t["city"]),
+                     itinerary_tool(t["city"], t["start_date"], t["end_date"], t["daily_limit"])]
+            return next((p for p in parts if p.startswith("ERROR:")), "\n\n".join(parts))
+        return run
+
+    if scenario == "fast":
+        from main_graph import fast_plan
+        return lambda t: fast_plan(t["city"], t["start_date"], t["end_date"], t["daily_limit"])
+
+    if scenario == "supervisor":
+        from main_graph import plan_trip
+        return lambda t: plan_trip(t["city"], t["start_date"], t["end_date"], t["daily_limit"], mode="agent") or ""
+
+    if scenario == "multi_agent":
+        import main_graph
+        from agents.supervisor_agent import build_supervisor_agent, final_text
+        from tools.fetch_context import FetchContext
+
+        def run(t):
+            agent = build_supervisor_agent(main_graph.LLM_MODEL, main_graph.GROQ_API_KEY, main_graph.OPENAI_API_BASE)
+            prompt = main_graph._user_request(t["city"], t["start_date"], t["end_date"], t["daily_limit"])
+            with FetchContext().activate():
+                return final_text(agent.invoke({"messages": [{"role": "user", "content": prompt}]}))
+        return run
+
+    raise ValueError(f"Unknown scenario {scenario!r}; expected one of {SCENARIOS}")
+
+
+def _mirror_host_policies(fake: FakeUpstreams) -> None:
+    """Give each stand-in the concurrency/rate policy of the upstream it replaces."""
+    from tools import transport
+
+    real = {"nominatim": "nominatim.openstreetmap.org", "overpass": "overpass-api.de",
+            "open_meteo": "api.open-meteo.com"}
+    for name, host in real.items():
+        transport.HOST_POLICIES[transport.host_of(fake.base(name))] = transport.HOST_POLICIES[host]
+
+
+def run_benchmark(scenario: str, plans: int = 20, concurrency: int = 4, cities: Optional[int] = None,
+                  configs: Optional[Dict[str, ServiceConfig]] = None, fixtures: Optional[str] = None,
+                  real_limits: bool = True, llm_cache: bool = False, warmup: int = 1) -> Dict[str, Any]:
+    """Run one benchmark in this process and return its report.
+
+    Must run before the app modules are imported elsewhere in the process:
+    their upstream URLs are read from the environment at import time.
+    """
+    with FakeUpstreams(configs, fixtures) as fake:
+        fake.apply_env()
+        os.environ["TRAVEL_AGENT_CACHE_DIR"] = tempfile.mkdtemp(prefix="travel-bench-")
+        os.environ["LLM_CACHE"] = "1" if llm_cache else "0"
+        if real_limits:
+            _mirror_host_policies(fake)
+        plan = _planner(scenario)
+
+        # first call builds graphs / clients and opens pools; not part of the measurement
+        for i in range(warmup):
+            plan(trips(1)[0] | {"city": f"Warmup city {i}"})
+        fake.reset()
+
+        latencies: List[float] = []
+        failures: List[str] = []
+        lock = threading.Lock()
+
+        def one(t):
+            t0 = time.perf_counter()
+            try:
+                out = plan(t)
+                err = out[:200] if (not out or out.startswith(("ERROR:", "TIMEOUT:"))) else None
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}"
+            dt = time.perf_counter() - t0
+            with lock:
+                latencies.append(dt)
+                if err is not None:
+                    failures.append(err)
+
+        wall0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+            list(ex.map(one, trips(plans, cities)))
+        wall = time.perf_counter() - wall0
+        counts, injected = fake.counts(), fake.errors()
+
+    lat = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "plans": plans,
+        "concurrency": concurrency,
+        "cities": cities or plans,
+        "failures": len(failures),
+        "failure_samples": failures[:3],
+        "latency_ms": {
+            "p50": round(percentile(lat, 50) * 1000, 1),
+            "p95": round(percentile(lat, 95) * 1000, 1),
+            "p99": round(percentile(lat, 99) * 1000, 1),
+            "mean": round(sum(lat) / len(lat) * 1000, 1) if lat else 0.0,
+            "max": round(lat[-1] * 1000, 1) if lat else 0.0,
+        },
+        "throughput_per_s": round(plans / wall, 3) if wall else 0.0,
+        "calls_per_plan": {name: round(counts[name] / plans, 3) for name in SERVICES},
+        "injected_errors": injected,
+        "config": {
+            "services": {name: (configs or {}).get(name, ServiceConfig())._asdict() for name in SERVICES},
+            "real_limits": real_limits,
+            "llm_cache": llm_cache,
+            "fixtures": fixtures,
+        },
+        "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(BASELINE_DIR))
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# --- baselines ---------------------------------------------------------------
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def load_baseline(name: str) -> Optional[Dict[str, Any]]:
+    path = baseline_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(name: str, report: Dict[str, Any]) -> str:
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def baseline_run_args(baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """run_benchmark keyword arguments reproducing the configuration a baseline was recorded with."""
+    config = baseline["config"]
+    return {
+        "plans": baseline["plans"],
+        "concurrency": baseline["concurrency"],
+        "cities": baseline["cities"],
+        "configs": {name: ServiceConfig(**cfg) for name, cfg in config["services"].items()},
+        "fixtures": config.get("fixtures"),
+        "real_limits": config.get("real_limits", True),
+        "llm_cache": config.get("llm_cache", False),
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Regressions of `report` against `baseline`, as human-readable lines (empty if none)."""
+    problems = []
+    for q in ("p50", "p95"):
+        old, new = baseline["latency_ms"][q], report["latency_ms"][q]
+        if old and new > old * (1 + tolerance):
+            problems.append(f"{q} latency {old:.1f} -> {new:.1f} ms (+{(new / old - 1) * 100:.0f}%)")
+    old, new = baseline["throughput_per_s"], report["throughput_per_s"]
+    if old and new < old * (1 - tolerance):
+        problems.append(f"throughput {old:.2f} -> {new:.2f} plans/s ({(new / old - 1) * 100:.0f}%)")
+    for svc, new in report["calls_per_plan"].items():
+        old = baseline["calls_per_plan"].get(svc, 0.0)
+        # external calls are deterministic for a given config: any increase is a regression
+        if new > old + 1e-9:
+            problems.append(f"{svc} calls per plan {old:g} -> {new:g}")
+    if report["failures"] > baseline.get("failures", 0):
+        problems.append(f"failures {baseline.get('failures', 0)} -> {report['failures']}")
+    return problems
+
+
+def format_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    def delta(new, old):
+        if old in (None, 0):
+            return ""
+        return f"  ({(new / old - 1) * 100:+.0f}% vs baseline {old:g})"
+
+    lat, base_lat = report["latency_ms"], (baseline or {}).get("latency_ms", {})
+    lines = [
+        f"scenario {report['scenario']}: {report['plans']} plans, concurrency {report['concurrency']}, "
+        f"{report['cities']} cities, {report['failures']} failed",
+    ]
+    for q in ("p50", "p95", "p99"):
+        lines.append(f"  {q:<4} {lat[q]:>9.1f} ms{delta(lat[q], base_lat.get(q))}")
+    lines.append(f"  throughput {report['throughput_per_s']:.2f} plans/s"
+                 f"{delta(report['throughput_per_s'], (baseline or {}).get('throughput_per_s'))}")
+    base_calls = (baseline or {}).get("calls_per_plan", {})
+    calls = ", ".join(f"{k} {v:g}" + (f" (was {base_calls[k]:g})" if k in base_calls and base_calls[k] != v else "")
+                      for k, v in report["calls_per_plan"].items())
+    lines.append(f"  external calls per plan: {calls}")
+    if report["failure_samples"]:
+        lines.append(f"  first failure: {report['failure_samples'][0]}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Offline benchmark with local upstream stand-ins.")
+    ap.add_argument("scenario", choices=SCENARIOS)
+    ap.add_argument("--plans", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--cities", type=int, default=None, help="distinct cities (default: one per plan, cold caches)")
+    ap.add_argument("--fixtures", help="directory with recorded nominatim/overpass/open_meteo JSON to replay")
+    for svc in SERVICES:
+        flag = svc.replace("_", "-")
+        ap.add_argument(f"--{flag}-latency", type=float, default=0.0, help=f"{svc}: mean latency (s)")
+        ap.add_argument(f"--{flag}-jitter", type=float, default=0.0, help=f"{svc}: +/- latency jitter (s)")
+        ap.add_argument(f"--{flag}-errors", type=float, default=0.0, help=f"{svc}: error rate 0..1")
+        ap.add_argument(f"--{flag}-error-status", type=int, default=503, help=f"{svc}: injected HTTP status")
+    ap.add_argument("--pois-per-query", type=int, default=120, help="overpass elements available per query")
+    ap.add_argument("--no-rate-limits", action="store_true",
+                    help="do not apply the real upstreams' concurrency/rate policies to the stand-ins")
+    ap.add_argument("--llm-cache", action="store_true", help="keep the LLM response cache enabled")
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--name", help="baseline name (default: the scenario)")
+    ap.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    ap.add_argument("--check", action="store_true", help="exit 1 if the run regresses against the baseline")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    ap.add_argument("--json", help="also write the report to this file")
+    args = ap.parse_args(argv)
+
+    configs = {}
+    for svc in SERVICES:
+        flag = svc.replace("-", "_")
+        configs[svc] = ServiceConfig(
+            latency=getattr(args, f"{flag}_latency"),
+            jitter=getattr(args, f"{flag}_jitter"),
+            error_rate=getattr(args, f"{flag}_errors"),
+            error_status=getattr(args, f"{flag}_error_status"),
+            pois_per_query=args.pois_per_query,
+        )
+    run_args = dict(plans=args.plans, concurrency=args.concurrency, cities=args.cities, configs=configs,
+                    fixtures=args.fixtures, real_limits=not args.no_rate_limits, llm_cache=args.llm_cache)
+    name = args.name or args.scenario
+    baseline = load_baseline(name)
+    if args.check and baseline is not None:
+        # a check is only meaningful under the conditions the baseline was measured in
+        run_args = baseline_run_args(baseline)
+        print(f"checking with the configuration of baseline '{name}' ({baseline.get('commit')})", file=sys.stderr)
+    report = run_benchmark(args.scenario, warmup=args.warmup, **run_args)
+    if baseline is not None and any(baseline.get(k) != report[k] for k in ("plans", "concurrency", "cities", "config")):
+        print(f"note: baseline '{name}' was recorded with a different configuration; "
+              "deltas are not comparable", file=sys.stderr)
+    print(format_report(report, baseline))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        print(f"baseline saved to {save_baseline(name, report)}")
+    if args.check and baseline is not None:
+        problems = compare(report, baseline, args.tolerance)
+        for p in problems:
+            print(f"REGRESSION: {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,11 +3,19 @@ from __future__ import annotations
 import os
 import sys
 from dotenv import load_dotenv
-from typing import List, Callable
+import time
+from typing import Any, Iterator, List, Callable, NamedTuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from tools.fetch_context import FetchContext
 
 # LangGraph / LangChain wrapper
 from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
+from langchain_core.tools import StructuredTool
+
+from agents.compaction import AGENT_MAX_TURNS, pre_model_hook, turn_limit
+from agents.registry import get_graph, get_llm, llm_key
+from tools import tracing
 
 # load .env if present
 load_dotenv()
@@ -17,6 +25,13 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY") or os.getenv("OPENAI_API_KEY")
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.groq.com/openai/v1")
 LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
 
+# Planning modes:
+#   "agent"       - ReAct supervisor decides which tools to call (several LLM turns)
+#   "fast"        - fixed weather/POI/itinerary pipeline, no LLM call at all
+#   "fast_polish" - fixed pipeline plus a single LLM call to polish the markdown
+PLAN_MODES = ("agent", "fast", "fast_polish")
+PLAN_MODE = os.getenv("PLAN_MODE", "agent")
+
 
 def _preflight_check():
     """
@@ -38,11 +53,33 @@ def _preflight_check():
         raise RuntimeError("GROQ_API_KEY looks like a placeholder. Replace it with a real key.")
 
 
-def get_supervisor():
+def _as_tool(func: Callable, coroutine: Optional[Callable] = None) -> StructuredTool:
+    """Wrap a sync tool (and its optional async twin) so both invoke and ainvoke work."""
+    return StructuredTool.from_function(func=func, coroutine=coroutine, name=func.__name__)
+
+
+def get_supervisor(context: Optional["FetchContext"] = None):
     """
-    Build and return a LangGraph REACT-style supervisor agent.
+    Return a LangGraph REACT-style supervisor agent.
     The Streamlit app expects this function to exist and return an agent object.
+
+    Without `context` the compiled graph is built once per process (see
+    agents.registry) and shared by every caller; activate a per-plan
+    FetchContext around `invoke` to share fetches between tool calls:
+
+        with FetchContext().activate():
+            get_supervisor().invoke(...)
+
+    If `context` (a tools.fetch_context.FetchContext) is given, a dedicated graph is
+    built with the tools bound to it (the LLM client is still shared).
     """
+    if context is None:
+        key = llm_key(LLM_MODEL, OPENAI_API_BASE, 0.2, GROQ_API_KEY or "")
+        return get_graph("supervisor", key, _build_supervisor)
+    return _build_supervisor(context)
+
+
+def _build_supervisor(context: Optional["FetchContext"] = None):
     # Preflight: ensure API key present
     _preflight_check()
 
@@ -64,31 +101,461 @@ def get_supervisor():
     weather_tool = getattr(tools, "weather_tool")
     poi_tool = getattr(tools, "poi_tool")
     itinerary_tool = getattr(tools, "itinerary_tool")
+    aweather_tool = getattr(tools, "aweather_tool", None)
+    apoi_tool = getattr(tools, "apoi_tool", None)
+    aitinerary_tool = getattr(tools, "aitinerary_tool", None)
+    multi_tool = getattr(tools, "multi_city_itinerary_tool", None)
+    amulti_tool = getattr(tools, "amulti_city_itinerary_tool", None)
+    if context is not None:
+        weather_tool, poi_tool, itinerary_tool = (
+            context.bind(weather_tool), context.bind(poi_tool), context.bind(itinerary_tool)
+        )
+        aweather_tool, apoi_tool, aitinerary_tool = (
+            context.bind(f) if f else None for f in (aweather_tool, apoi_tool, aitinerary_tool)
+        )
+        multi_tool, amulti_tool = (context.bind(f) if f else None for f in (multi_tool, amulti_tool))
 
-    # Build LLM wrapper — this will raise a clear exception if the key is invalid
-    llm = ChatOpenAI(
-        model=LLM_MODEL,
-        api_key=GROQ_API_KEY,
-        base_url=OPENAI_API_BASE,
-        temperature=0.2,
-    )
+    # Shared LLM wrapper — this will raise a clear exception if the key is invalid
+    llm = get_llm(LLM_MODEL, GROQ_API_KEY, OPENAI_API_BASE, temperature=0.2)
 
-    # Create the REACT-style supervisor agent using the three tools
+    agent_tools = [
+        _as_tool(weather_tool, aweather_tool),
+        _as_tool(poi_tool, apoi_tool),
+        _as_tool(itinerary_tool, aitinerary_tool),
+    ]
+    tool_lines = ""
+    if multi_tool:
+        agent_tools.append(_as_tool(multi_tool, amulti_tool))
+        tool_lines = ("- multi_city_itinerary_tool(legs, daily_limit) -> itinerary for a trip through several "
+                      "cities; legs is a list of {city, start_date, end_date}\n")
+
+    # Create the REACT-style supervisor agent using the tools
     agent = create_react_agent(
         model=llm,
-        tools=[weather_tool, poi_tool, itinerary_tool],
+        tools=agent_tools,
         prompt=(
             "You are a travel-planning supervisor. Tools available:\n"
             "- weather_tool(city, start_date, end_date) -> returns weather summary\n"
             "- poi_tool(city, radius, limit) -> returns POIs list\n"
-            "- itinerary_tool(city, start_date, end_date, daily_limit) -> returns itinerary\n\n"
+            "- itinerary_tool(city, start_date, end_date, daily_limit) -> returns itinerary\n"
+            + tool_lines + "\n"
             "When calling tools, send city names and dates as strings and numeric values as integers.\n"
             "Produce a final reply containing weather, POIs, and a day-by-day itinerary table with a Notes column."
         ),
-    )
+        # older tool results are compacted before each model call; turns are capped per plan
+        pre_model_hook=pre_model_hook("supervisor"),
+    ).with_config(turn_limit())
     return agent
 
 
+def _user_request(city: str, start_date: str, end_date: str, daily_limit: int) -> str:
+    return (f"I want a trip plan to {city} from {start_date} to {end_date}. "
+            f"Provide weather, POIs and itinerary with daily limit {daily_limit}.")
+
+
+def final_ai_text(state) -> Optional[str]:
+    """Content of the last assistant message in an agent state (not tool calls)."""
+    from langchain_core.messages import AIMessage
+
+    msgs = state.get("messages", []) if isinstance(state, dict) else []
+    for m in reversed(msgs):
+        if isinstance(m, AIMessage):
+            if m.content and not m.tool_calls:
+                return m.content
+        elif isinstance(m, dict) and m.get("role") == "assistant" and m.get("content"):
+            return m.get("content")
+    return None
+
+
+# what create_react_agent answers in place of tool calls it has no steps left to run
+OUT_OF_STEPS = "Sorry, need more steps to process this request."
+
+
+def cut_off_answer(state) -> str:
+    """Answer for an agent run stopped by its turn limit: the last text the model
+    wrote, even alongside tool calls, else an error."""
+    from langchain_core.messages import AIMessage
+
+    msgs = state.get("messages", []) if isinstance(state, dict) else []
+    for m in reversed(msgs):
+        if isinstance(m, AIMessage) and isinstance(m.content, str) and m.content.strip() \
+                and m.content != OUT_OF_STEPS:
+            return m.content
+    return (f"ERROR: The planner used up its {AGENT_MAX_TURNS} turns without a final answer; "
+            "try again or use the 'fast' mode.")
+
+
+def agent_answer(state) -> Optional[str]:
+    """final_ai_text, or cut_off_answer if the agent ran out of turns."""
+    text = final_ai_text(state)
+    return cut_off_answer(state) if text == OUT_OF_STEPS else text
+
+
+def invoke_agent(agent, payload) -> Optional[str]:
+    """Run a ReAct agent and return its final answer (agent_answer).
+
+    Past the turn limit LangGraph either has the agent answer OUT_OF_STEPS or, when
+    the step count runs out mid-turn, raises GraphRecursionError; both end in
+    cut_off_answer.
+    """
+    from langgraph.errors import GraphRecursionError
+
+    state = {}
+    try:
+        # streamed values rather than invoke(), so the last state survives a cut-off run
+        for state in agent.stream(payload, stream_mode="values"):
+            pass
+    except GraphRecursionError:
+        return cut_off_answer(state)
+    return agent_answer(state)
+
+
+async def ainvoke_agent(agent, payload) -> Optional[str]:
+    """Async invoke_agent."""
+    from langgraph.errors import GraphRecursionError
+
+    state = {}
+    try:
+        async for state in agent.astream(payload, stream_mode="values"):
+            pass
+    except GraphRecursionError:
+        return cut_off_answer(state)
+    return agent_answer(state)
+
+
+def compose_fast_plan(itinerary: str, weather: str, pois: str) -> str:
+    """The deterministic plan: the three tool answers under their headings."""
+    if itinerary.startswith("ERROR:"):
+        return itinerary
+    return "\n\n".join([itinerary, "## Weather", weather, "## Points of Interest", pois])
+
+
+def _polish_messages(md: str) -> list:
+    return [
+        ("system", "You are a travel writer. Rewrite the trip plan below into a friendly, well-structured "
+                   "markdown reply. Keep the day-by-day itinerary table (with its Notes column), the weather "
+                   "and the POIs; do not invent places or numbers."),
+        ("user", md),
+    ]
+
+
+def polish_plan(md: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+    """One LLM pass rewriting the composed plan; falls back to `md` if the call fails.
+
+    The single polish step of every fast_polish path. `on_token` is handed the reply as it
+    streams in; a reply replayed from the LLM cache arrives as one piece.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    streamed = []
+
+    class Forward(BaseCallbackHandler):
+        def on_llm_new_token(self, token: str, **kwargs) -> None:
+            if token:
+                streamed.append(token)
+                on_token(token)
+
+    try:
+        _preflight_check()
+        llm = get_llm(LLM_MODEL, GROQ_API_KEY, OPENAI_API_BASE, temperature=0.2)
+        # always stream=True: it is part of the cache key, so every caller shares the entries
+        config = {"callbacks": [Forward()]} if on_token else None
+        text = llm.invoke(_polish_messages(md), config, stream=True).content or md
+    except Exception:
+        # polishing is cosmetic: the deterministic plan is still a valid answer
+        return md
+    if on_token and not streamed:
+        on_token(text)
+    return text
+
+
+async def afast_plan(city: str, start_date: str, end_date: str, daily_limit: int = 3, polish: bool = False) -> str:
+    """Deterministic plan: run the three tools as a fixed pipeline, then optionally
+    make one LLM call to polish the combined markdown."""
+    import asyncio
+    from tools.fetch_context import FetchContext, current_context
+    from tools.itinerary_tools import aitinerary_tool
+    from tools.poi_tools import apoi_tool
+    from tools.weather_tools import aweather_tool
+
+    with (current_context() or FetchContext()).activate():
+        itinerary, weather = await asyncio.gather(
+            aitinerary_tool(city, start_date, end_date, daily_limit),
+            aweather_tool(city, start_date, end_date),
+        )
+        # runs after the itinerary so it is served from its (larger) POI pool
+        pois = await apoi_tool(city)
+    md = compose_fast_plan(itinerary, weather, pois)
+    if not polish or itinerary.startswith("ERROR:"):
+        return md
+    return await asyncio.to_thread(polish_plan, md)
+
+
+def fast_plan(city: str, start_date: str, end_date: str, daily_limit: int = 3, polish: bool = False) -> str:
+    """Sync wrapper around afast_plan."""
+    from tools.aio import run_sync
+
+    return run_sync(afast_plan(city, start_date, end_date, daily_limit, polish))
+
+
+def plan_trip(city: str, start_date: str, end_date: str, daily_limit: int = 3, mode: Optional[str] = None,
+              use_llm_cache: bool = True, session: Optional[str] = None) -> Optional[str]:
+    """Plan a trip and return the final markdown (None if the agent produced no answer).
+
+    `mode` is one of PLAN_MODES; defaults to the PLAN_MODE environment variable.
+    `use_llm_cache=False` forces fresh model calls for this request.
+    If a FetchContext is already active (e.g. one shared by a batch of trips to
+    the same city) it is reused instead of starting a fresh one.
+    With a `session` id the plan is checkpointed and a later plan of the same
+    session only recomputes what its changed parameters affect (agents.replan).
+    """
+    from agents.llm_cache import bypass_llm_cache
+
+    with bypass_llm_cache(not use_llm_cache), \
+            tracing.trace("plan", city=city, start_date=start_date, end_date=end_date, mode=mode or PLAN_MODE):
+        if session:
+            from agents.replan import replan
+
+            return replan(session, city, start_date, end_date, daily_limit, mode=_session_mode(mode))
+        return _plan_trip(city, start_date, end_date, daily_limit, mode)
+
+
+def _session_mode(mode: Optional[str]) -> str:
+    mode = mode or PLAN_MODE
+    if mode not in PLAN_MODES:
+        raise ValueError(f"Unknown plan mode {mode!r}; expected one of {PLAN_MODES}")
+    return mode
+
+
+def _plan_trip(city: str, start_date: str, end_date: str, daily_limit: int, mode: Optional[str]) -> Optional[str]:
+    mode = mode or PLAN_MODE
+    if mode not in PLAN_MODES:
+        raise ValueError(f"Unknown plan mode {mode!r}; expected one of {PLAN_MODES}")
+    if mode != "agent":
+        return fast_plan(city, start_date, end_date, daily_limit, polish=(mode == "fast_polish"))
+
+    from tools.fetch_context import FetchContext, current_context
+
+    supervisor = get_supervisor()
+    with (current_context() or FetchContext()).activate():
+        return invoke_agent(supervisor, {"messages": [
+            {"role": "user", "content": _user_request(city, start_date, end_date, daily_limit)}
+        ]})
+
+
+async def aplan_trip(city: str, start_date: str, end_date: str, daily_limit: int = 3, mode: Optional[str] = None,
+                     use_llm_cache: bool = True) -> Optional[str]:
+    """Async plan_trip: the whole plan runs on the caller's event loop, so cancelling it
+    (e.g. on a request deadline) stops the plan instead of leaving a worker thread busy."""
+    from agents.llm_cache import bypass_llm_cache
+    from tools.fetch_context import FetchContext, current_context
+
+    mode = mode or PLAN_MODE
+    if mode not in PLAN_MODES:
+        raise ValueError(f"Unknown plan mode {mode!r}; expected one of {PLAN_MODES}")
+    with bypass_llm_cache(not use_llm_cache), \
+            tracing.trace("plan", city=city, start_date=start_date, end_date=end_date, mode=mode):
+        if mode != "agent":
+            return await afast_plan(city, start_date, end_date, daily_limit, polish=(mode == "fast_polish"))
+        supervisor = get_supervisor()
+        with (current_context() or FetchContext()).activate():
+            return await ainvoke_agent(supervisor, {"messages": [
+                {"role": "user", "content": _user_request(city, start_date, end_date, daily_limit)}
+            ]})
+
+
+class PlanEvent(NamedTuple):
+    """One step of a streamed plan.
+
+    kind:
+      "tool_start" - the plan started calling tool `name`
+      "tool"       - tool `name` returned; `data` is its text output
+      "token"      - a chunk of the final answer; `data` is the text
+      "discard"    - drop streamed tokens so far (that LLM turn ended in tool calls)
+      "stage"      - a timed stage finished; `data` is its duration in seconds
+      "trace"      - the plan's trace (tools.tracing), sent just before "final"
+      "final"      - the plan is done; `data` is the final markdown (or None)
+    """
+    kind: str
+    name: str
+    data: Any
+    elapsed: float  # seconds since the plan started
+
+
+def stream_plan(city: str, start_date: str, end_date: str, daily_limit: int = 3,
+                mode: Optional[str] = None, use_llm_cache: bool = True,
+                session: Optional[str] = None) -> Iterator[PlanEvent]:
+    """Plan a trip, yielding PlanEvents as tool results and answer tokens become available.
+
+    With a `session` id, see plan_trip; stages the session could reuse are
+    reported as "<stage> (reused)".
+    """
+    from agents.llm_cache import bypass_llm_cache
+
+    mode = mode or PLAN_MODE
+    if mode not in PLAN_MODES:
+        raise ValueError(f"Unknown plan mode {mode!r}; expected one of {PLAN_MODES}")
+    with bypass_llm_cache(not use_llm_cache), \
+            tracing.trace("plan", city=city, start_date=start_date, end_date=end_date, mode=mode) as tr:
+        if session:
+            events = _stream_session(session, city, start_date, end_date, daily_limit, _session_mode(mode))
+        elif mode == "agent":
+            events = _stream_agent(city, start_date, end_date, daily_limit)
+        else:
+            events = _stream_fast(city, start_date, end_date, daily_limit, polish=(mode == "fast_polish"))
+        for ev in events:
+            if ev.kind == "final" and tr is not None:
+                yield PlanEvent("trace", "plan", tr.to_dict(), ev.elapsed)
+            yield ev
+
+
+def _stream_agent(city: str, start_date: str, end_date: str, daily_limit: int) -> Iterator[PlanEvent]:
+    from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+    from langgraph.errors import GraphRecursionError
+    from tools.fetch_context import FetchContext, current_context
+
+    t0 = time.perf_counter()
+    supervisor = get_supervisor()
+    payload = {"messages": [{"role": "user", "content": _user_request(city, start_date, end_date, daily_limit)}]}
+    turn, turn_start, final = 0, 0.0, None
+    tool_started, agent_msgs = {}, []
+    with (current_context() or FetchContext()).activate():
+        try:
+            for stream_mode, chunk in supervisor.stream(payload, stream_mode=["messages", "updates"]):
+                now = time.perf_counter() - t0
+                if stream_mode == "messages":
+                    msg, meta = chunk
+                    if isinstance(msg, AIMessageChunk) and msg.content and meta.get("langgraph_node") == "agent":
+                        yield PlanEvent("token", "agent", msg.content, now)
+                    continue
+                for node, update in (chunk or {}).items():
+                    msgs = (update or {}).get("messages", []) if isinstance(update, dict) else []
+                    if node == "agent":
+                        turn += 1
+                        yield PlanEvent("stage", f"LLM turn {turn}", now - turn_start, now)
+                        for m in msgs:
+                            if isinstance(m, AIMessage) and m.tool_calls:
+                                yield PlanEvent("discard", "agent", None, now)
+                                for tc in m.tool_calls:
+                                    tool_started[tc.get("id")] = now
+                                    yield PlanEvent("tool_start", tc.get("name", ""), tc.get("args"), now)
+                            elif isinstance(m, AIMessage) and m.content:
+                                final = m.content
+                        agent_msgs.extend(msgs)
+                        turn_start = now
+                    elif node == "tools":
+                        for m in msgs:
+                            if isinstance(m, ToolMessage):
+                                yield PlanEvent("tool", m.name or "tool", m.content, now)
+                                yield PlanEvent("stage", m.name or "tool", now - tool_started.get(m.tool_call_id, now), now)
+                        turn_start = now
+        except GraphRecursionError:
+            final = OUT_OF_STEPS
+    if final == OUT_OF_STEPS:
+        # out of turns: keep whatever the model last wrote
+        final = cut_off_answer({"messages": agent_msgs})
+    yield PlanEvent("final", "agent", final, time.perf_counter() - t0)
+
+
+def _stream_fast(city: str, start_date: str, end_date: str, daily_limit: int, polish: bool) -> Iterator[PlanEvent]:
+    import contextvars
+    import queue
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from tools.fetch_context import FetchContext, current_context
+    from tools.itinerary_tools import itinerary_tool
+    from tools.poi_tools import poi_tool
+    from tools.weather_tools import weather_tool
+
+    t0 = time.perf_counter()
+    ctx = current_context() or FetchContext()
+    outputs = {}
+
+    def timed(fn, *args):
+        start = time.perf_counter()
+        return fn(*args), time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        # each tool runs in a copy of this context so its spans land in the plan's trace
+        futures = {
+            ex.submit(contextvars.copy_context().run, timed, ctx.bind(itinerary_tool),
+                      city, start_date, end_date, daily_limit): "itinerary_tool",
+            ex.submit(contextvars.copy_context().run, timed, ctx.bind(weather_tool),
+                      city, start_date, end_date): "weather_tool",
+        }
+        for name in futures.values():
+            yield PlanEvent("tool_start", name, None, time.perf_counter() - t0)
+        for fut in as_completed(futures):
+            name = futures[fut]
+            outputs[name], seconds = fut.result()
+            now = time.perf_counter() - t0
+            yield PlanEvent("tool", name, outputs[name], now)
+            yield PlanEvent("stage", name, seconds, now)
+    # after the itinerary so it is served from its (larger) POI pool
+    yield PlanEvent("tool_start", "poi_tool", None, time.perf_counter() - t0)
+    outputs["poi_tool"], seconds = timed(ctx.bind(poi_tool), city)
+    now = time.perf_counter() - t0
+    yield PlanEvent("tool", "poi_tool", outputs["poi_tool"], now)
+    yield PlanEvent("stage", "poi_tool", seconds, now)
+
+    md = compose_fast_plan(outputs["itinerary_tool"], outputs["weather_tool"], outputs["poi_tool"])
+    if polish and not outputs["itinerary_tool"].startswith("ERROR:"):
+        start = time.perf_counter()
+        tokens, done, parts = queue.Queue(), object(), []
+
+        def polish():
+            try:
+                return polish_plan(md, tokens.put)
+            finally:
+                tokens.put(done)
+
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            fut = ex.submit(contextvars.copy_context().run, polish)
+            for token in iter(tokens.get, done):
+                parts.append(token)
+                yield PlanEvent("token", "polish", token, time.perf_counter() - t0)
+            polished = fut.result()
+        if parts and "".join(parts) != polished:
+            # the pass failed part-way and fell back to the deterministic plan
+            yield PlanEvent("discard", "polish", None, time.perf_counter() - t0)
+        now = time.perf_counter() - t0
+        yield PlanEvent("stage", "LLM polish", time.perf_counter() - start, now)
+        md = polished
+    yield PlanEvent("final", "fast", md, time.perf_counter() - t0)
+
+
+def _stream_session(session: str, city: str, start_date: str, end_date: str, daily_limit: int,
+                    mode: str) -> Iterator[PlanEvent]:
+    from agents.replan import session_answer, stream_replan
+
+    t0 = time.perf_counter()
+    last = 0.0
+    tokens = []
+    for stream_mode, chunk in stream_replan(session, city, start_date, end_date, daily_limit, mode):
+        now = time.perf_counter() - t0
+        if stream_mode == "messages":
+            msg, meta = chunk
+            # the supervisor's model node is "agent" too
+            node = meta.get("langgraph_node")
+            if node in ("polish", "agent") and isinstance(msg.content, str) and msg.content \
+                    and getattr(msg, "type", "") in ("ai", "AIMessageChunk"):
+                tokens.append(msg.content)
+                yield PlanEvent("token", node, msg.content, now)
+            continue
+        for node, update in (chunk or {}).items():
+            if node == "compose":
+                for name, text in (update or {}).get("outputs", {}).items():
+                    yield PlanEvent("tool", name, text, now)
+            label = {"polish": "LLM polish", "agent": "agent (LLM turns)"}.get(node, node)
+            yield PlanEvent("stage", label if update else f"{label} (reused)", now - last, now)
+            last = now
+    final = session_answer(session)
+    if tokens and "".join(tokens) != final:
+        # tokens of the supervisor's tool-calling turns, or a polish pass that failed
+        # part-way and fell back to the draft
+        yield PlanEvent("discard", "session", None, time.perf_counter() - t0)
+    yield PlanEvent("final", "session", final, time.perf_counter() - t0)
+
+
 # Allow running this module directly for a sanity check
 if __name__ == "__main__":
     try:
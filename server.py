@@ -0,0 +1,403 @@
+# server.py
+"""
+Headless HTTP planning service (ASGI), alongside the Streamlit app.
+
+    uvicorn server:app --host 0.0.0.0 --port 8000
+    python server.py --port 8000 --workers 4
+
+Endpoints (parameters as query string, or a JSON body for POST):
+
+    POST /plan          {city, start_date, end_date, daily_limit?, mode?, use_llm_cache?, trace?}
+    GET|POST /plan/stream   same parameters; Server-Sent Events, one per main_graph.PlanEvent
+    GET  /weather       city, start_date, end_date
+    GET  /pois          city, radius?, limit?
+    GET  /itinerary     city, start_date, end_date, daily_limit?
+    POST /itinerary/multi   {legs: [{city, start_date, end_date}, ...], daily_limit?}
+    GET  /healthz       liveness plus current load
+    GET  /metrics       Prometheus text (tools.tracing)
+
+Handlers are async; plans and tools run on the event loop, with blocking
+fetches on a worker pool sized by SERVICE_THREADS. At most
+SERVICE_MAX_CONCURRENCY requests run at once and up to SERVICE_MAX_QUEUE
+more wait for a slot; beyond that the service answers 429 with Retry-After
+so a load balancer can send the request elsewhere. Every request has a
+deadline (SERVICE_DEADLINE_S, lowered per request with an
+`X-Request-Deadline` header in seconds); time spent queued counts against it
+and a request that runs out of time gets 504 (or an "error" event when
+streaming). The process keeps no per-session state, so any number of
+replicas can run behind a load balancer.
+
+With WARM_CITIES and/or WARM_LOGS set, each worker also runs the cache
+warmer (tools.warmer) for the hot cities while it is up.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from main_graph import PLAN_MODE, PLAN_MODES, aplan_trip, stream_plan
+from tools import tracing
+from tools.revalidate import revalidate_stats
+from tools.warmer import CacheWarmer
+
+SERVICE_MAX_CONCURRENCY = int(os.getenv("SERVICE_MAX_CONCURRENCY", 16))
+SERVICE_MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", 64))
+SERVICE_DEADLINE_S = float(os.getenv("SERVICE_DEADLINE_S", 120))
+SERVICE_THREADS = int(os.getenv("SERVICE_THREADS", 64))
+SERVICE_RETRY_AFTER_S = int(os.getenv("SERVICE_RETRY_AFTER_S", 2))
+
+
+class Saturated(Exception):
+    """Every slot is busy and the queue is full."""
+
+
+class Limiter:
+    """At most `limit` holders at once; up to `max_queue` callers wait in FIFO order."""
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self._sem = asyncio.Semaphore(self.limit)
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+
+    async def acquire(self, timeout: Optional[float]) -> None:
+        """Take a slot, waiting at most `timeout` seconds (asyncio.TimeoutError after that)."""
+        if self._sem.locked() or self.queued:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise Saturated()
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout)
+            finally:
+                self.queued -= 1
+        else:
+            await self._sem.acquire()
+        self.active += 1
+
+    def release(self) -> None:
+        self.active -= 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "queued": self.queued, "limit": self.limit,
+                "max_queue": self.max_queue, "rejected": self.rejected}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _deadline(request: Request) -> float:
+    """Absolute (loop.time()) deadline for this request."""
+    seconds = SERVICE_DEADLINE_S
+    header = request.headers.get("x-request-deadline")
+    if header:
+        try:
+            seconds = min(seconds, max(0.0, float(header)))
+        except ValueError:
+            raise BadRequest("X-Request-Deadline must be a number of seconds")
+    return asyncio.get_running_loop().time() + seconds
+
+
+def _remaining(deadline: float) -> float:
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+
+async def _params(request: Request) -> Dict[str, Any]:
+    params: Dict[str, Any] = dict(request.query_params)
+    if request.method == "POST":
+        body = await request.body()
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise BadRequest("body must be a JSON object")
+            if not isinstance(data, dict):
+                raise BadRequest("body must be a JSON object")
+            params.update(data)
+    return params
+
+
+def _str(params: Dict[str, Any], name: str, required: bool = True) -> Optional[str]:
+    v = params.get(name)
+    if v in (None, ""):
+        if required:
+            raise BadRequest(f"'{name}' is required")
+        return None
+    return str(v)
+
+
+def _int(params: Dict[str, Any], name: str, default: int, lo: int, hi: int) -> int:
+    v = params.get(name)
+    if v in (None, ""):
+        return default
+    try:
+        n = int(v)
+    except (TypeError, ValueError):
+        raise BadRequest(f"'{name}' must be an integer")
+    if not lo <= n <= hi:
+        raise BadRequest(f"'{name}' must be between {lo} and {hi}")
+    return n
+
+
+def _bool(params: Dict[str, Any], name: str, default: bool) -> bool:
+    v = params.get(name)
+    if v in (None, ""):
+        return default
+    if isinstance(v, bool):
+        return v
+    return str(v).lower() not in ("0", "false", "no", "off")
+
+
+def _trip(params: Dict[str, Any]) -> Dict[str, Any]:
+    mode = _str(params, "mode", required=False) or PLAN_MODE
+    if mode not in PLAN_MODES:
+        raise BadRequest(f"'mode' must be one of {', '.join(PLAN_MODES)}")
+    return {
+        "city": _str(params, "city"),
+        "start_date": _str(params, "start_date"),
+        "end_date": _str(params, "end_date"),
+        "daily_limit": _int(params, "daily_limit", 3, 1, 10),
+        "mode": mode,
+        "use_llm_cache": _bool(params, "use_llm_cache", True),
+    }
+
+
+def _error(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status, headers=headers)
+
+
+def _text_result(text: Optional[str], extra: Optional[Dict[str, Any]] = None) -> JSONResponse:
+    """Tool and plan answers; their "ERROR: ..." strings become 422s."""
+    if not text:
+        return _error(502, "the planner produced no answer")
+    if text.startswith("ERROR:"):
+        return _error(422, text[len("ERROR:"):].strip())
+    return JSONResponse({"result": text, **(extra or {})})
+
+
+async def _limited(request: Request, handler) -> Response:
+    """Run `handler(params)` in a concurrency slot, within the request deadline."""
+    limiter: Limiter = request.app.state.limiter
+    try:
+        deadline = _deadline(request)
+        params = await _params(request)
+        await limiter.acquire(_remaining(deadline))
+    except BadRequest as e:
+        return _error(400, str(e))
+    except Saturated:
+        return _error(429, "server is at capacity, retry later", {"Retry-After": str(SERVICE_RETRY_AFTER_S)})
+    except asyncio.TimeoutError:
+        return _error(504, "deadline exceeded while queued")
+    try:
+        return await asyncio.wait_for(handler(params), _remaining(deadline))
+    except BadRequest as e:
+        return _error(400, str(e))
+    except asyncio.TimeoutError:
+        return _error(504, "deadline exceeded")
+    finally:
+        limiter.release()
+
+
+async def plan(request: Request) -> Response:
+    async def run(params):
+        trip = _trip(params)
+        with tracing.trace("request", path="/plan") as tr:
+            text = await aplan_trip(**trip)
+        extra = {"mode": trip["mode"]}
+        if _bool(params, "trace", False) and tr is not None:
+            extra["trace"] = tr.to_dict()
+        return _text_result(text, extra)
+    return await _limited(request, run)
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+_closing: set = set()  # keeps the clean-up tasks of finished streams alive
+
+
+async def _close_stream(events, ctx: contextvars.Context, step: Optional[asyncio.Future], limiter: Limiter) -> None:
+    """Stop a streamed plan at its next step, then free its slot."""
+    loop = asyncio.get_running_loop()
+    try:
+        if step is not None:
+            with contextlib.suppress(BaseException):
+                await step  # the generator can't be closed while a step is running
+        with contextlib.suppress(Exception):
+            await loop.run_in_executor(None, ctx.run, events.close)
+    finally:
+        limiter.release()
+
+
+async def _plan_events(trip: Dict[str, Any], limiter: Limiter, deadline: float) -> AsyncIterator[str]:
+    """SSE stream of a plan. stream_plan is a sync generator: each step runs on a worker
+    thread, always in the same Context so the plan's trace survives across steps."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    events = stream_plan(**trip)
+    done = object()
+    step = None
+    try:
+        while True:
+            step = loop.run_in_executor(None, ctx.run, next, events, done)
+            try:
+                ev = await asyncio.wait_for(asyncio.shield(step), _remaining(deadline))
+            except asyncio.TimeoutError:
+                yield _sse("error", {"error": "deadline exceeded"})
+                return
+            except Exception as e:
+                step = None
+                yield _sse("error", {"error": f"{type(e).__name__}: {e}"})
+                return
+            step = None
+            if ev is done:
+                return
+            yield _sse(ev.kind, {"name": ev.name, "data": ev.data, "elapsed": round(ev.elapsed, 4)})
+    finally:
+        # also reached when the client disconnects: the plan stops at its next step
+        task = loop.create_task(_close_stream(events, ctx, step, limiter))
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+
+
+async def plan_stream(request: Request) -> Response:
+    limiter: Limiter = request.app.state.limiter
+    try:
+        deadline = _deadline(request)
+        trip = _trip(await _params(request))
+        await limiter.acquire(_remaining(deadline))
+    except BadRequest as e:
+        return _error(400, str(e))
+    except Saturated:
+        return _error(429, "server is at capacity, retry later", {"Retry-After": str(SERVICE_RETRY_AFTER_S)})
+    except asyncio.TimeoutError:
+        return _error(504, "deadline exceeded while queued")
+    # the slot is released by the event stream when it ends
+    return StreamingResponse(_plan_events(trip, limiter, deadline), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def weather(request: Request) -> Response:
+    from tools.weather_tools import aweather_tool
+
+    async def run(params):
+        return _text_result(await aweather_tool(_str(params, "city"), _str(params, "start_date"),
+                                                _str(params, "end_date")))
+    return await _limited(request, run)
+
+
+async def pois(request: Request) -> Response:
+    from tools.poi_tools import apoi_tool
+
+    async def run(params):
+        return _text_result(await apoi_tool(_str(params, "city"), _int(params, "radius", 2000, 100, 20000),
+                                            _int(params, "limit", 8, 1, 50)))
+    return await _limited(request, run)
+
+
+async def itinerary(request: Request) -> Response:
+    from tools.itinerary_tools import aitinerary_tool
+
+    async def run(params):
+        return _text_result(await aitinerary_tool(_str(params, "city"), _str(params, "start_date"),
+                                                  _str(params, "end_date"), _int(params, "daily_limit", 3, 1, 10)))
+    return await _limited(request, run)
+
+
+def _legs(params: Dict[str, Any]) -> List[Dict[str, str]]:
+    from tools.itinerary_tools import MAX_TRIP_LEGS
+
+    legs = params.get("legs")
+    if not isinstance(legs, list) or not legs:
+        raise BadRequest("'legs' must be a non-empty list of {city, start_date, end_date}")
+    if len(legs) > MAX_TRIP_LEGS:
+        raise BadRequest(f"'legs' may have at most {MAX_TRIP_LEGS} entries")
+    out = []
+    for leg in legs:
+        if not isinstance(leg, dict):
+            raise BadRequest("each leg must be an object with city, start_date and end_date")
+        out.append({name: _str(leg, name) for name in ("city", "start_date", "end_date")})
+    return out
+
+
+async def multi_itinerary(request: Request) -> Response:
+    from tools.itinerary_tools import amulti_city_itinerary_tool
+
+    async def run(params):
+        return _text_result(await amulti_city_itinerary_tool(_legs(params), _int(params, "daily_limit", 3, 1, 10)))
+    return await _limited(request, run)
+
+
+async def healthz(request: Request) -> Response:
+    warmer = request.app.state.warmer
+    return JSONResponse({"status": "ok", "uptime_s": round(time.time() - request.app.state.started, 1),
+                         **request.app.state.limiter.stats(),
+                         "refresh": revalidate_stats(),
+                         "warmer": warmer.stats() if warmer is not None else None})
+
+
+async def metrics(request: Request) -> Response:
+    return PlainTextResponse(tracing.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    # blocking fetches run on the loop's default executor; size it for many concurrent plans
+    executor = ThreadPoolExecutor(max_workers=SERVICE_THREADS, thread_name_prefix="plan")
+    asyncio.get_running_loop().set_default_executor(executor)
+    app.state.limiter = Limiter(SERVICE_MAX_CONCURRENCY, SERVICE_MAX_QUEUE)
+    app.state.started = time.time()
+    app.state.warmer = CacheWarmer.from_env()
+    if app.state.warmer is not None:
+        app.state.warmer.start()
+    yield
+    if app.state.warmer is not None:
+        app.state.warmer.stop(timeout=1)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = Starlette(
+    routes=[
+        Route("/plan", plan, methods=["POST"]),
+        Route("/plan/stream", plan_stream, methods=["GET", "POST"]),
+        Route("/weather", weather, methods=["GET", "POST"]),
+        Route("/pois", pois, methods=["GET", "POST"]),
+        Route("/itinerary", itinerary, methods=["GET", "POST"]),
+        Route("/itinerary/multi", multi_itinerary, methods=["POST"]),
+        Route("/healthz", healthz),
+        Route("/metrics", metrics),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description="Run the headless planning service.")
+    ap.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", 8000)))
+    ap.add_argument("--workers", type=int, default=int(os.getenv("SERVICE_WORKERS", 1)),
+                    help="worker processes (each with its own limiter and caches)")
+    args = ap.parse_args()
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Shared test helpers."""
+from typing import Any
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from tools import geocode, poi_fetcher, weather_fetcher
+from tools.poi_record import POI
+from tools.transport import FetchResult
+
+CITIES = {"Pune": (18.52, 73.86), "Goa": (15.49, 73.83)}
+
+
+class ScriptedModel(BaseChatModel):
+    """Chat model answering each call with the next message of `replies`; `calls` counts them."""
+    replies: Any
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=next(self.replies))])
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fake geocode / POI / weather upstreams behind FetchContext (cities in CITIES); records each call."""
+    calls = {"geocode": [], "pois": [], "weather": []}
+
+    def fake_geocode(city):
+        calls["geocode"].append(city)
+        lat, lon = CITIES[city]
+        return FetchResult({"lat": lat, "lon": lon, "name": city})
+
+    def fake_pois(lat, lon, radius=2000, limit=8):
+        calls["pois"].append((lat, lon, radius, limit))
+        return FetchResult([POI(f"Place {i}", lat + 0.001 * (i % 6), lon + 0.001 * (i // 6), "museum", i % 2 == 0, ())
+                            for i in range(30)])
+
+    def fake_weather(lat, lon, start_date, end_date):
+        calls["weather"].append((start_date, end_date))
+        days = weather_fetcher._days(start_date, end_date)
+        daily = {"time": [d.isoformat() for d in days]}
+        for k in weather_fetcher.DAILY_VARS:
+            daily[k] = [1.0] * len(days)
+        return FetchResult(daily)
+
+    monkeypatch.setattr(geocode, "geocode_city_result", fake_geocode)
+    monkeypatch.setattr(poi_fetcher, "fetch_pois_result", fake_pois)
+    monkeypatch.setattr(weather_fetcher, "fetch_weather_result", fake_weather)
+
+    def reset():
+        for kind in ("geocode", "pois", "weather"):
+            calls[kind].clear()
+
+    calls["reset"] = reset
+    return calls
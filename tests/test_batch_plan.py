@@ -0,0 +1,96 @@
+"""batch_plan: grouping by city, the shared prefetch, resuming and the summary."""
+import datetime
+import json
+
+import pytest
+
+import batch_plan
+import main_graph
+from conftest import CITIES
+from tools.itinerary_tools import itinerary_pool
+
+D = datetime.date
+
+
+def _req(id_, city="Pune", start="2030-01-01", end="2030-01-03", **kw):
+    return dict(id=id_, city=city, start_date=start, end_date=end, **kw)
+
+
+def _write(path, rows):
+    path.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    """plan_trip answers "plan <city>", or an error for cities starting with "Err"; records its calls."""
+    planned = []
+
+    def plan_trip(city, start_date, end_date, daily_limit, mode=None, use_llm_cache=True):
+        planned.append((city, start_date, end_date))
+        return "ERROR: no such place" if city.startswith("Err") else f"plan {city}"
+
+    monkeypatch.setattr(main_graph, "plan_trip", plan_trip)
+    return planned
+
+
+def test_merge_ranges():
+    assert batch_plan.merge_ranges([
+        (D(2030, 3, 1), D(2030, 3, 2)),
+        (D(2030, 1, 1), D(2030, 1, 3)),
+        (D(2030, 1, 4), D(2030, 1, 5)),   # adjacent
+        (D(2030, 1, 2), D(2030, 1, 2)),   # inside
+    ]) == [(D(2030, 1, 1), D(2030, 1, 5)), (D(2030, 3, 1), D(2030, 3, 2))]
+    assert batch_plan.merge_ranges([]) == []
+
+
+def test_group_by_city():
+    groups = batch_plan.group_by_city([_req("a", "Pune"), _req("b", "Goa"), _req("c", "  pune "), _req("d", "PUNE")])
+    assert [(g.city, [r["id"] for r in g.reqs]) for g in groups] == [("Pune", ["a", "c", "d"]), ("Goa", ["b"])]
+
+
+def test_prefetch_fetches_each_run_of_dates(upstream):
+    [group] = batch_plan.group_by_city([
+        _req("a", start="2030-01-01", end="2030-01-03"),
+        _req("b", start="2030-01-04", end="2030-01-05", daily_limit=12),  # the biggest pool
+        _req("c", start="2030-06-10", end="2030-06-10"),
+        _req("bad", start="someday", end="2030-01-01"),
+    ])
+    group.prefetch()
+    group.prefetch()  # once per group
+    assert upstream["geocode"] == ["Pune"]
+    assert [call[2:] for call in upstream["pois"]] == [itinerary_pool(12, 2)]
+    assert upstream["weather"] == [("2030-01-01", "2030-01-05"), ("2030-06-10", "2030-06-10")]
+    # every trip in the group is then answered from the context
+    upstream["reset"]()
+    lat, lon = group.ctx.geocode("Pune")["lat"], group.ctx.geocode("Pune")["lon"]
+    assert len(group.ctx.weather(lat, lon, "2030-01-02", "2030-01-04")["time"]) == 3
+    assert upstream["weather"] == []
+
+
+def test_summary_and_resume(upstream, planner, monkeypatch, tmp_path):
+    monkeypatch.setitem(CITIES, "Errtown", (0.0, 0.0))
+    src, out = tmp_path / "trips.jsonl", tmp_path / "plans.jsonl"
+    _write(src, [_req("a"), _req("b", "Goa"), _req("c", "Errtown"), _req("d", "Goa", start="2030-02-01"),
+                 _req("e")])
+    # an earlier run answered "a", failed "b" and crashed while writing "c"
+    _write(out, [{"id": "a", "status": "ok"}, {"id": "b", "status": "error"}])
+    with open(out, "a", encoding="utf-8") as f:
+        f.write('{"id": "c", "status": "o')
+
+    summary = batch_plan.run_batch(str(src), str(out), workers=2, log=None)
+    assert {k: summary[k] for k in ("requests", "skipped", "ok", "failed", "groups")} == \
+        {"requests": 5, "skipped": 1, "ok": 3, "failed": 1, "groups": 3}
+    assert summary["upstream_calls"]["geocode"] == 3
+    assert sorted(city for city, _, _ in planner) == ["Errtown", "Goa", "Goa", "Pune"]
+
+    lines = out.read_text(encoding="utf-8").splitlines()
+    assert lines[2] == '{"id": "c", "status": "o'  # the torn line is left alone, on its own line
+    rows = {r["id"]: r for r in map(json.loads, lines[3:])}
+    assert sorted(rows) == ["b", "c", "d", "e"]
+    assert rows["c"]["status"] == "error" and rows["c"]["error"] == "no such place"
+    assert rows["d"]["plan"] == "plan Goa" and set(rows["d"]["timings"]) >= {"prefetch_s", "plan_s", "total_s"}
+
+    # a second run only retries the failure
+    planner.clear()
+    again = batch_plan.run_batch(str(src), str(out), log=None)
+    assert (again["skipped"], again["failed"]) == (4, 1) and planner == [("Errtown", "2030-01-01", "2030-01-03")]
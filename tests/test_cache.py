@@ -0,0 +1,121 @@
+"""TieredCache: TTLs, the SQLite tier, counters and purging; the geocode cache's keys and negative TTL."""
+import types
+
+import pytest
+
+from tools import cache as cache_mod, geocode
+from tools.cache import TieredCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache_mod, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def _rows(c):
+    return c._db.execute("SELECT k FROM kv WHERE ns = ? ORDER BY k", (c.namespace,)).fetchall()
+
+
+def test_entries_expire_after_their_ttl(clock):
+    c = TieredCache("cache_test", ttl=10)
+    c.set("default", 1)
+    c.set("longer", 2, ttl=100)
+    c.set("forever", 3, ttl=None)
+    clock[0] += 50
+    assert c.get("default") is None and c.lookup("default") is None
+    assert c.get("longer") == 2 and c.get("forever") == 3
+    clock[0] += 10 ** 6
+    assert c.get("longer", "gone") == "gone" and c.get("forever") == 3
+
+
+def test_disk_tier_answers_after_the_memory_tier(clock, tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    c = TieredCache("cache_test", ttl=10, max_entries=1, path=path)
+    c.set("a", {"x": 1})
+    c.set("b", [1, 2])  # pushes "a" out of the one-entry memory tier
+    assert list(c._mem) == ["b"]
+    assert c.get("a") == {"x": 1}
+    assert list(c._mem) == ["a"]  # promoted back into memory
+    assert c.get("a") == {"x": 1}
+    assert c.stats()["disk_hits"] == 1
+    # a new process sees the entry, but not once it has expired
+    assert TieredCache("cache_test", path=path).get("b") == [1, 2]
+    clock[0] += 11
+    assert TieredCache("cache_test", path=path).get("b") is None
+    assert TieredCache("other_namespace", path=path).get("b") is None
+
+
+def test_hit_and_miss_counters(clock):
+    c = TieredCache("cache_test", ttl=10, stale_ttl=100)
+    c.get("k")
+    c.set("k", "v")
+    c.get("k")
+    c.lookup("k")
+    clock[0] += 20
+    c.lookup("k")  # stale: a hit
+    c.get("k")     # stale is a miss for get()
+    stats = c.stats()
+    assert (stats["hits"], stats["misses"], stats["stale_hits"]) == (3, 2, 1)
+    assert stats["hit_rate"] == pytest.approx(0.6)
+    c.clear()
+    assert c.stats()["hits"] == c.stats()["misses"] == 0
+
+
+def test_expired_entries_are_purged(clock, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_mod, "CACHE_PURGE_EVERY", 3)
+    path = str(tmp_path / "c.sqlite3")
+    c = TieredCache("cache_test", ttl=10, stale_ttl=5, path=path)
+    c.set("old", 1)
+    c.set("kept", 2, ttl=None)
+    clock[0] += 16
+    assert [k for (k,) in _rows(c)] == ["kept", "old"]
+    c.set("new", 3)  # third write: purges "old", now past its stale window
+    assert [k for (k,) in _rows(c)] == ["kept", "new"]
+    assert "old" not in c._mem
+
+    clock[0] += 16
+    reopened = TieredCache("cache_test", ttl=10, stale_ttl=5, path=path)
+    assert [k for (k,) in _rows(reopened)] == ["kept"]
+
+
+@pytest.fixture
+def nominatim(monkeypatch):
+    """geocode with a fresh memory-only cache and a fake Nominatim that records its queries."""
+    monkeypatch.delenv("GAZETTEER_PATH", raising=False)
+    monkeypatch.setattr(geocode, "_cache", TieredCache("geocode_test", stale_ttl=geocode.GEOCODE_STALE_TTL))
+    asked = []
+
+    def remote(city):
+        asked.append(city)
+        return None if city.startswith("Xq") else {"lat": 1.0, "lon": 2.0, "name": city}
+
+    monkeypatch.setattr(geocode, "_geocode_remote", remote)
+    return asked
+
+
+@pytest.mark.parametrize("query, key", [
+    ("  New  York, ", "new york"),
+    ("NEW YORK,NY", "new york, ny"),
+    ("Saint-Étienne", "saint-étienne"),
+    ("ﬁrenze", "firenze"),  # NFKC folds the ligature
+    ("", ""),
+])
+def test_normalize_query(query, key):
+    assert geocode.normalize_query(query) == key
+
+
+def test_spellings_of_a_query_share_an_entry(nominatim):
+    for query in ("New York", "  new   york ", "NEW YORK,"):
+        assert geocode.geocode_city(query) == {"lat": 1.0, "lon": 2.0, "name": "New York"}
+    assert nominatim == ["New York"]
+
+
+def test_misses_expire_sooner(nominatim, clock):
+    assert geocode.geocode_city("Xqzvw") is None
+    geocode.geocode_city("Pune")
+    assert geocode.geocode_city("xqzvw") is None and nominatim == ["Xqzvw", "Pune"]
+    clock[0] += geocode.GEOCODE_NEGATIVE_TTL + 1
+    assert geocode._cache.lookup("xqzvw") == (None, False)
+    assert geocode._cache.lookup("pune")[1] is True
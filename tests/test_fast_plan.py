@@ -0,0 +1,68 @@
+"""The fast pipeline's polish step: one implementation behind fast_plan, stream_plan and the cache."""
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+import main_graph
+from agents.llm_cache import SQLiteLLMCache
+from conftest import ScriptedModel
+
+TRIP = ("Pune", "2030-01-01", "2030-01-02", 3)
+
+
+class StreamingModel(ScriptedModel):
+    """ScriptedModel that streams each reply word by word, failing after the first word when `fail`."""
+    fail: bool = False
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        words = next(self.replies).content.split(" ")
+        for i, word in enumerate(words):
+            if self.fail and i:
+                raise RuntimeError("connection reset")
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if not i else " " + word))
+
+
+@pytest.fixture
+def model(monkeypatch, upstream):
+    """model(**fields) -> the StreamingModel every polish call gets."""
+    monkeypatch.setattr(main_graph, "GROQ_API_KEY", "gsk_test")
+
+    def make(**fields):
+        llm = StreamingModel(replies=iter([AIMessage("a polished plan")] * 3), **fields)
+        monkeypatch.setattr(main_graph, "get_llm", lambda *a, **kw: llm)
+        return llm
+    return make
+
+
+def _stream(*trip):
+    events = list(main_graph._stream_fast(*trip, polish=True))
+    return [e.data for e in events if e.kind == "token"], [e.kind for e in events], events[-1].data
+
+
+def test_every_path_polishes_alike(model):
+    model()
+    assert main_graph.fast_plan(*TRIP, polish=True) == "a polished plan"
+    assert asyncio.run(main_graph.afast_plan(*TRIP, polish=True)) == "a polished plan"
+    tokens, _, final = _stream(*TRIP)
+    assert tokens == ["a", " polished", " plan"] and final == "a polished plan"
+
+
+def test_a_cached_polish_is_replayed_to_the_stream(model, tmp_path):
+    llm = model(cache=SQLiteLLMCache(str(tmp_path / "llm.db")))
+    assert main_graph.fast_plan(*TRIP, polish=True) == "a polished plan"
+    tokens, _, final = _stream(*TRIP)
+    assert tokens == ["a polished plan"] and final == "a polished plan"
+    assert llm.calls == 1
+
+
+def test_a_failed_polish_falls_back_to_the_draft(model, monkeypatch):
+    model(fail=True)
+    draft = main_graph.fast_plan(*TRIP)
+    assert main_graph.fast_plan(*TRIP, polish=True) == draft
+    tokens, kinds, final = _stream(*TRIP)
+    assert tokens == ["a"] and kinds[-3:] == ["discard", "stage", "final"] and final == draft
+    monkeypatch.setattr(main_graph, "GROQ_API_KEY", None)  # no key: still the draft, never an error
+    assert asyncio.run(main_graph.afast_plan(*TRIP, polish=True)) == draft
@@ -0,0 +1,140 @@
+"""The offline gazetteer: building from a GeoNames dump, exact and fuzzy lookup, completion."""
+import zipfile
+
+import pytest
+
+from tools import gazetteer, geocode
+
+# geonameid, name, asciiname, alternatenames, lat, lon, feature class, feature code, country, ..., population
+ROWS = [
+    ("1269843", "Hyderabad", "Hyderabad", "Haidarabad,Хайдарабад,HYD", 17.38405, 78.45636, "P", "IN", 6809970),
+    ("1176734", "Hyderabad", "Hyderabad", "Haidarabad", 25.39242, 68.37366, "P", "PK", 1386330),
+    ("2988507", "Paris", "Paris", "Lutetia,Parigi,75000", 48.85341, 2.3488, "P", "FR", 2138551),
+    ("4717560", "Paris", "Paris", "", 33.66094, -95.55551, "P", "US", 24171),
+    ("2980291", "Saint-Étienne", "Saint-Etienne", "", 45.43389, 4.39, "P", "FR", 171057),
+    ("1259229", "Pune", "Pune", "Poona", 18.51957, 73.85535, "P", "IN", 3124458),
+    ("2643743", "London", "London", "Londres", 51.50853, -0.12574, "P", "GB", 8961989),
+    ("6058560", "London", "London", "", 42.98339, -81.23304, "P", "CA", 346765),
+    ("3038789", "Parc Naturel", "Parc Naturel", "", 45.0, 5.0, "L", "FR", 0),   # not a populated place
+]
+
+
+def _line(geoid, name, ascii_name, alternates, lat, lon, fclass, cc, pop):
+    cols = [geoid, name, ascii_name, alternates, str(lat), str(lon), fclass, "PPL", cc,
+            "", "", "", "", "", str(pop), "", "", "Asia/Kolkata", "2024-01-01"]
+    return "\t".join(cols) + "\n"
+
+
+@pytest.fixture(scope="module")
+def dump(tmp_path_factory):
+    path = tmp_path_factory.mktemp("geonames") / "cities.txt"
+    path.write_text("".join(_line(*r) for r in ROWS) + "broken\tline\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture(scope="module")
+def gaz(dump, tmp_path_factory):
+    out = tmp_path_factory.mktemp("gaz") / "cities.gaz"
+    assert gazetteer.build_gazetteer(gazetteer.read_geonames(str(dump)), str(out)) == len(ROWS) - 1
+    g = gazetteer.Gazetteer(str(out))
+    yield g
+    g.close()
+
+
+def test_read_geonames_zip(dump, tmp_path):
+    archive = tmp_path / "cities.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("readme.txt", "not data")
+        zf.write(dump, "cities.txt")
+    rows = list(gazetteer.read_geonames(str(archive)))
+    assert [r[0] for r in rows] == [r[1] for r in ROWS if r[6] == "P"]
+    assert rows[0][2] == ["Haidarabad", "Хайдарабад", "HYD"]
+
+
+def test_min_population(dump, tmp_path):
+    n = gazetteer.build_gazetteer(gazetteer.read_geonames(str(dump)), str(tmp_path / "big.gaz"),
+                                  min_population=1_000_000)
+    assert n == 5
+
+
+@pytest.mark.parametrize("query, name, country", [
+    ("Hyderabad", "Hyderabad", "IN"),         # ties go to the more populous place
+    ("  hyderabad ", "Hyderabad", "IN"),
+    ("Haidarabad", "Hyderabad", "IN"),        # alternate name
+    ("Хайдарабад", "Hyderabad", "IN"),
+    ("Poona", "Pune", "IN"),
+    ("saint etienne", "Saint-Étienne", "FR"),  # accents and punctuation are ignored
+    ("SAINT-ÉTIENNE", "Saint-Étienne", "FR"),
+])
+def test_exact_lookup(gaz, query, name, country):
+    place = gaz.lookup(query)
+    assert (place.name, place.country, place.score) == (name, country, 1.0)
+
+
+@pytest.mark.parametrize("query, country, lat", [
+    ("Hyderabad, PK", "PK", 25.39242),
+    ("London, ca", "CA", 42.98339),
+    ("Paris, US", "US", 33.66094),
+])
+def test_city_and_country_code(gaz, query, country, lat):
+    place = gaz.lookup(query)
+    assert place.country == country
+    assert place.lat == pytest.approx(lat, abs=1e-4)
+
+
+@pytest.mark.parametrize("query", [
+    "Hyderabad, Telangana",   # "City, Region" is left to Nominatim
+    "10 Downing Street",      # so are addresses
+    "Pune, DE",               # no Pune in that country
+    "Xqzvw",
+    "",
+])
+def test_lookup_misses(gaz, query):
+    assert gaz.lookup(query) is None
+
+
+@pytest.mark.parametrize("query, name", [
+    ("Hyderbad", "Hyderabad"),
+    ("Londn", "London"),
+    ("Saint Etiene", "Saint-Étienne"),
+])
+def test_fuzzy_lookup(gaz, query, name):
+    place = gaz.lookup(query)
+    assert place.name == name
+    assert gazetteer.GAZETTEER_FUZZY_MIN <= place.score < 1.0
+
+
+@pytest.mark.parametrize("query", [
+    "Hyderabad Airport",   # more words than any city: a landmark, not a typo
+    "London Eye",
+    "Paris Hilton",
+    "Londonderry",         # one word, but much longer than "London"
+    "Saint",
+])
+def test_fuzzy_lookup_rejects_other_places(gaz, query):
+    assert gaz.lookup(query) is None
+
+
+def test_fuzzy_lookup_respects_the_country(gaz):
+    assert gaz.lookup("Hyderbad, PK").country == "PK"
+    assert gaz.lookup("Hyderbad", min_score=0.95) is None
+
+
+def test_suggest(gaz):
+    assert [(p.name, p.country) for p in gaz.suggest("Par")] == [("Paris", "FR"), ("Paris", "US")]
+    assert [p.name for p in gaz.suggest("pa", limit=1)] == ["Paris"]
+    assert [p.name for p in gaz.suggest("saint-e")] == ["Saint-Étienne"]
+    assert gaz.suggest("zz") == [] and gaz.suggest("") == []
+
+
+def test_geocode_answers_from_the_gazetteer(gaz, monkeypatch):
+    monkeypatch.setenv("GAZETTEER_PATH", gaz.path)
+    monkeypatch.setattr(geocode, "_geocode_city_result", lambda *a: pytest.fail("asked Nominatim"))
+    assert geocode.geocode_city("Hyderabad, PK") == {"lat": 25.39242, "lon": 68.37366, "name": "Hyderabad, PK"}
+
+
+def test_not_a_gazetteer(tmp_path):
+    bad = tmp_path / "bad.gaz"
+    bad.write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        gazetteer.Gazetteer(str(bad))
@@ -0,0 +1,93 @@
+"""The LLM response cache: conversations that differ only in volatile ids share an entry."""
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration
+
+from agents.llm_cache import SQLiteLLMCache, bypass_llm_cache
+from conftest import ScriptedModel
+from tools import tracing
+
+LLM = "model=test temperature=0.2"
+
+
+def _conversation(call_id, msg_id="m1", city="Pune"):
+    return dumps([
+        HumanMessage(f"Plan a trip to {city}", id=msg_id),
+        AIMessage("", id=f"{msg_id}-ai", response_metadata={"created": msg_id},
+                  tool_calls=[{"name": "weather_tool", "args": {"city": city}, "id": call_id}]),
+        ToolMessage("sunny", tool_call_id=call_id, id=f"{msg_id}-tool"),
+    ])
+
+
+def _answer(text="the plan", tokens=120):
+    return [ChatGeneration(message=AIMessage(text, usage_metadata={
+        "input_tokens": tokens - 20, "output_tokens": 20, "total_tokens": tokens}))]
+
+
+def test_tool_call_and_message_ids_are_aliased():
+    a = SQLiteLLMCache.cache_key(_conversation("call_abc", "m1"), LLM)
+    b = SQLiteLLMCache.cache_key(_conversation("call_xyz", "m2"), LLM)
+    assert a == b
+    assert a != SQLiteLLMCache.cache_key(_conversation("call_abc", city="Goa"), LLM)
+    assert a != SQLiteLLMCache.cache_key(_conversation("call_abc"), LLM + " tools=[]")
+
+
+def test_distinct_tool_calls_stay_distinct():
+    calls = [{"name": "t", "args": {}, "id": "x"}, {"name": "t", "args": {}, "id": "y"}]
+    two = dumps([AIMessage("", tool_calls=calls), ToolMessage("1", tool_call_id="x"), ToolMessage("2", tool_call_id="y")])
+    swapped = dumps([AIMessage("", tool_calls=calls), ToolMessage("1", tool_call_id="y"), ToolMessage("2", tool_call_id="x")])
+    assert SQLiteLLMCache.cache_key(two, LLM) != SQLiteLLMCache.cache_key(swapped, LLM)
+
+
+def test_replays_the_stored_answer(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite3"))
+    assert cache.lookup(_conversation("call_1"), LLM) is None
+    cache.update(_conversation("call_1"), LLM, _answer())
+    [hit] = cache.lookup(_conversation("call_2", "m9"), LLM)
+    assert isinstance(hit.message, AIMessage) and hit.message.content == "the plan"
+    assert cache.stats()["hits"] == 1 and cache.stats()["tokens_saved"] == 120
+
+
+def test_bypass(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite3"))
+    with bypass_llm_cache():
+        cache.update(_conversation("c"), LLM, _answer())
+    assert cache.lookup(_conversation("c"), LLM) is None
+    cache.update(_conversation("c"), LLM, _answer())
+    with bypass_llm_cache():
+        assert cache.lookup(_conversation("c"), LLM) is None
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite3"), ttl=-1)
+    cache.update(_conversation("c"), LLM, _answer())
+    assert cache.lookup(_conversation("c"), LLM) is None
+
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite3"), max_bytes=0)
+    cache.update(_conversation("c", city="Pune"), LLM, _answer())
+    assert cache.stats()["entries"] == 0
+    cache.max_bytes = 10 ** 6
+    for city in ("Pune", "Goa", "Agra"):
+        cache.update(_conversation("c", city=city), LLM, _answer(city * 50))
+    cache.lookup(_conversation("c", city="Pune"), LLM)  # Goa is now the least recently used
+    sizes = cache._db.execute("SELECT size FROM llm_cache").fetchall()
+    cache.max_bytes = sum(s for (s,) in sizes) - 1
+    cache.update(_conversation("c", city="Pune"), LLM, _answer("Pune" * 50))
+    assert cache.lookup(_conversation("c", city="Goa"), LLM) is None
+    assert cache.lookup(_conversation("c", city="Pune"), LLM) is not None
+
+
+def test_replayed_usage_is_not_counted_as_spend(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite3"))
+    replies = iter([_answer("the plan", 120)[0].message])
+    model = ScriptedModel(replies=replies, cache=cache, callbacks=tracing.llm_callbacks())
+    counters = []
+    for _ in range(2):
+        with tracing.trace("plan") as tr:
+            assert model.invoke("Plan a trip to Pune").content == "the plan"
+        counters.append({k: v for k, v in tr.counters.items() if k.startswith("llm.")})
+    assert model.calls == 1
+    assert counters[0] == {"llm.prompt_tokens": 100, "llm.completion_tokens": 20, "llm.turns": 1}
+    assert counters[1] == {"llm.cached_prompt_tokens": 100, "llm.cached_completion_tokens": 20, "llm.cached_turns": 1}
@@ -0,0 +1,31 @@
+"""The offline POI index answers with the same POI records as Overpass."""
+from tools import poi_fetcher, poi_index
+
+LAT, LON = 17.385, 78.4867
+
+FEATURES = [
+    (LAT + 0.001, LON, {"name": "Salar Jung Museum", "tourism": "museum", "opening_hours": "Sa-Th 10:00-17:00",
+                        "fee": "yes", "wikidata": "Q1128813", "addr:street": "Salar Jung Road"}),
+    (LAT, LON + 0.002, {"name": "Covered Bazaar", "leisure": "park", "indoor": "yes"}),
+    (LAT - 0.001, LON, {"name": "Old Gate", "historic": "yes", "website": "https://example.org"}),
+    (LAT, LON - 0.003, {"name": "Town Market", "amenity": "marketplace", "fee": "no"}),
+    (LAT, LON + 0.001, {"name": "Bus Stop", "highway": "bus_stop"}),  # not a POI the query selects
+]
+
+
+def test_index_pois_equal_overpass_pois(tmp_path):
+    path = str(tmp_path / "pois.idx")
+    assert poi_index.build_index(FEATURES, path) == 4
+    index = poi_index.POIIndex(path)
+    try:
+        from_index = index.query(LAT, LON, radius=2000, limit=10)
+    finally:
+        index.close()
+    elements = [{"type": "node", "lat": lat, "lon": lon, "tags": tags} for lat, lon, tags in FEATURES
+                if poi_index.select_category(tags)]
+    from_overpass = poi_fetcher._parse_elements(elements, limit=10)
+    assert sorted(from_index) == sorted(from_overpass)
+    by_name = {p.name: p for p in from_index}
+    assert by_name["Covered Bazaar"].indoor                                 # indoor=yes survives the index
+    assert ("fee", "yes") in by_name["Salar Jung Museum"].tags
+    assert by_name["Old Gate"].category == "historic"
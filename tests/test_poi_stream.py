@@ -0,0 +1,87 @@
+"""The streaming Overpass parser reads elements correctly wherever the chunks split the body."""
+import json
+
+import pytest
+
+from tools import poi_fetcher
+
+ELEMENTS = [
+    {"type": "count", "id": 0, "tags": {"nodes": "3", "ways": "1", "total": "4"}},
+    {"type": "node", "id": 1, "lat": 17.38, "lon": 78.48, "tags": {"name": "Charminar", "historic": "monument"}},
+    {"type": "node", "id": 2, "lat": 17.39, "lon": 78.47, "tags": {"tourism": "viewpoint"}},
+    {"type": "node", "id": 3, "lat": 17.36, "lon": 78.47,
+     "tags": {"name": 'The "Old" Gate {east} [1591]', "note": "back\\slash \\\" and }]"}},
+    {"type": "way", "id": 4, "center": {"lat": 17.41, "lon": 78.47},
+     "tags": {"name": "Lumbinī Park — ದ್ವಾರ", "leisure": "park"}},
+]
+BODY = json.dumps({"version": 0.6, "osm3s": {"copyright": "[odbl]"}, "elements": ELEMENTS},
+                  ensure_ascii=False).encode("utf-8")
+# the element without a name is skipped; `out count` results are kept
+EXPECTED = [e for i, e in enumerate(ELEMENTS) if i != 2]
+
+
+def _read(chunks):
+    stats = {"elements": 0, "bytes": 0, "complete": 0}
+    return list(poi_fetcher._iter_elements(chunks, stats)), stats
+
+
+@pytest.mark.parametrize("text, end", [
+    ('{"a": 1} tail', 8),
+    ('{"a": {"b": [1, {"c": 2}]}}, {', 27),
+    ('{"a": "}]{[", "b": 1}', 21),
+    ('{"a": "say \\"}\\" ok"}', 21),
+    ('{"a": "c:\\\\"}', 13),
+])
+def test_object_end(text, end):
+    assert poi_fetcher._object_end(text, 0) == end
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": [1, 2', '{"a": "unfinished }', '{"a": "esc \\"}', '{"a": "x \\" }]"', '{"a": 12', '',
+])
+def test_object_end_of_an_incomplete_object(text):
+    assert poi_fetcher._object_end(text, 0) == -1
+
+
+def test_whole_body():
+    elements, stats = _read([BODY])
+    assert elements == EXPECTED
+    assert stats == {"elements": len(ELEMENTS), "bytes": len(BODY), "complete": 1}
+
+
+def test_every_split_point():
+    for cut in range(1, len(BODY)):
+        elements, stats = _read([BODY[:cut], b"", BODY[cut:]])
+        assert elements == EXPECTED, cut
+        assert stats["complete"] == 1
+
+
+def test_one_byte_chunks():
+    # splits every multi-byte character and escape sequence as well
+    elements, _ = _read(BODY[i:i + 1] for i in range(len(BODY)))
+    assert elements == EXPECTED
+
+
+def test_stopping_early_leaves_the_rest_unread():
+    stats = {"elements": 0, "bytes": 0, "complete": 0}
+    chunks = (BODY[i:i + 16] for i in range(0, len(BODY), 16))
+    first = next(poi_fetcher._iter_elements(chunks, stats))
+    assert first == ELEMENTS[0]
+    assert stats["bytes"] < len(BODY) and not stats["complete"]
+
+
+@pytest.mark.parametrize("body", [
+    b'{"remark": "runtime error"}',
+    BODY[:len(BODY) // 2],
+    BODY[:BODY.rindex(b"]")],
+    b'{"elements": [1, 2]}',
+])
+def test_malformed_bodies(body):
+    with pytest.raises(ValueError):
+        _read([body])
+
+
+def test_count_blocks_split_a_batched_answer():
+    body = json.dumps({"elements": [ELEMENTS[0], ELEMENTS[1], ELEMENTS[0], ELEMENTS[4]]}).encode()
+    elements, _ = _read([body[:40], body[40:]])
+    assert [e["type"] for e in elements] == ["count", "node", "count", "way"]
@@ -0,0 +1,69 @@
+"""A truncated answer for a wider circle must not leave a smaller circle short of POIs."""
+import pytest
+
+from tools import poi_fetcher
+from tools.fetch_context import FetchContext
+from tools.geo import haversine_m
+from tools.poi_cache import poi_cache
+from tools.poi_record import POI
+from tools.transport import FetchResult
+
+LAT, LON = 17.385, 78.4867
+M_PER_DEG = 111_320.0
+
+
+def _world(far_m, n_far, n_near=12):
+    """Overpass lists `n_far` POIs at `far_m` metres north before `n_near` POIs close to the centre."""
+    far = [POI(f"far{i}", LAT + far_m / M_PER_DEG, LON, "park", False, ()) for i in range(n_far)]
+    near = [POI(f"near{i}", LAT + 100 * (i + 1) / 12 / M_PER_DEG, LON, "museum", True, ()) for i in range(n_near)]
+    return far + near
+
+
+@pytest.fixture
+def overpass(monkeypatch):
+    calls = []
+
+    def install(world):
+        def fake(lat, lon, radius, limit):
+            calls.append((radius, limit))
+            inside = [p for p in world if haversine_m(lat, lon, p.lat, p.lon) <= radius]
+            return FetchResult((inside[:limit], len(inside) <= limit))
+        monkeypatch.setattr(poi_fetcher, "_fetch_pois_overpass", fake)
+        return calls
+
+    monkeypatch.setattr("tools.poi_index.get_index", lambda: None)
+    poi_cache.clear()
+    yield install
+    poi_cache.clear()
+
+
+def test_fetcher_refetches_a_short_bucket_subset(overpass):
+    calls = overpass(_world(1800, 20))
+    res = poi_fetcher.fetch_pois_result(LAT, LON, radius=1500, limit=8)
+    assert [p.name for p in res.value] == [f"near{i}" for i in range(8)]
+    assert calls == [(2000, 8), (1500, 8)]
+
+
+def test_fetcher_uses_a_sufficient_bucket_answer(overpass):
+    calls = overpass(_world(1800, 0))
+    res = poi_fetcher.fetch_pois_result(LAT, LON, radius=1500, limit=8)
+    assert len(res.value) == 8
+    assert calls == [(2000, 8)]
+
+
+def test_context_refetches_when_the_widened_pool_falls_short(overpass):
+    calls = overpass(_world(3000, 60))
+    ctx = FetchContext()
+    pois = ctx.pois(LAT, LON, radius=2000, limit=8)
+    assert [p.name for p in pois] == [f"near{i}" for i in range(8)]
+    assert calls == [(3500, 40), (2000, 8)]
+    # and the exact answer is remembered for the rest of the plan
+    assert ctx.pois(LAT, LON, radius=2000, limit=8) == pois
+    assert len(calls) == 2
+
+
+def test_context_answers_from_a_complete_pool(overpass):
+    calls = overpass(_world(3000, 5))
+    pois = FetchContext().pois(LAT, LON, radius=2000, limit=8)
+    assert len(pois) == 8
+    assert calls == [(3500, 40)]
@@ -0,0 +1,141 @@
+"""A session re-plan recomputes only what the changed parameters affect."""
+import datetime
+import sqlite3
+
+import pytest
+from langchain_core.messages import AIMessage
+from langgraph.prebuilt import create_react_agent
+
+import main_graph
+from agents import replan
+from conftest import ScriptedModel
+from tools.itinerary_tools import itinerary_tool
+from tools.weather_tools import weather_tool
+
+START = datetime.date.today() + datetime.timedelta(days=3)
+
+
+def _day(offset):
+    return (START + datetime.timedelta(days=offset)).isoformat()
+
+
+@pytest.fixture(autouse=True)
+def sessions(monkeypatch, tmp_path):
+    monkeypatch.setattr(replan, "REPLAN_DB", str(tmp_path / "sessions.sqlite3"))
+
+
+def _run(session, city="Pune", start=0, end=2, daily_limit=3, mode="fast"):
+    """Node -> whether it recomputed (a non-empty update) in one re-plan."""
+    ran = {}
+    for kind, chunk in replan.stream_replan(session, city, _day(start), _day(end), daily_limit, mode):
+        if kind == "updates":
+            for node, update in chunk.items():
+                ran[node] = bool(update)
+    return ran
+
+
+def test_new_end_date_fetches_only_the_added_days(upstream):
+    _run("s1")
+    upstream["reset"]()
+    ran = _run("s1", end=3)
+    assert upstream["geocode"] == [] and upstream["pois"] == []
+    assert upstream["weather"] == [(_day(3), _day(3))]
+    assert not ran["geocode"] and not ran["pois"] and ran["weather"]
+    assert _day(3) in replan.session_answer("s1")
+
+
+def test_new_city_recomputes_everything(upstream):
+    _run("s1")
+    upstream["reset"]()
+    ran = _run("s1", city="Goa")
+    assert upstream["geocode"] == ["Goa"]
+    assert len(upstream["pois"]) == 1 and upstream["weather"] == [(_day(0), _day(2))]
+    assert all(ran[n] for n in ("geocode", "pois", "weather", "schedule", "compose"))
+    assert "Goa" in replan.session_answer("s1")
+
+
+def test_new_daily_limit_reruns_only_schedule_and_compose(upstream):
+    _run("s1")
+    upstream["reset"]()
+    ran = _run("s1", daily_limit=4)
+    assert upstream["geocode"] == upstream["pois"] == upstream["weather"] == []
+    assert {n for n, recomputed in ran.items() if recomputed} == {"request", "schedule", "compose", "polish"}
+
+
+def test_unchanged_plan_is_answered_from_the_checkpoint(upstream):
+    first = replan.replan("s1", "Pune", _day(0), _day(2), 3, mode="fast")
+    upstream["reset"]()
+    assert replan.replan("s1", "Pune", _day(0), _day(2), 3, mode="fast") == first
+    assert upstream["geocode"] == upstream["pois"] == upstream["weather"] == []
+
+
+def test_sessions_keep_only_their_latest_checkpoint(upstream):
+    for limit in (2, 3, 4):
+        _run("s1", daily_limit=limit)
+    _run("s2")
+    db = sqlite3.connect(replan.REPLAN_DB)
+    rows = dict(db.execute("SELECT thread_id, COUNT(*) FROM checkpoints GROUP BY thread_id").fetchall())
+    assert rows == {"s1": 1, "s2": 1}
+    stale = db.execute("SELECT COUNT(*) FROM writes w WHERE checkpoint_id < "
+                       "(SELECT MAX(checkpoint_id) FROM checkpoints c WHERE c.thread_id = w.thread_id)").fetchone()
+    assert stale == (0,)
+    # the kept checkpoint is the latest one, and the next run still builds on it
+    assert replan.get_replanner().get_state(replan._run_config("s1")).values["daily_limit"] == 4
+    upstream["reset"]()
+    _run("s1", daily_limit=4)
+    assert upstream["geocode"] == upstream["pois"] == upstream["weather"] == []
+    replan.forget_session("s1")
+    assert replan.session_answer("s1") is None
+
+
+def _supervisor(models):
+    """A supervisor over the real tools whose model calls itinerary_tool and weather_tool, then answers."""
+    def build():
+        replies = iter([
+            AIMessage("", tool_calls=[
+                {"name": "itinerary_tool", "args": {"city": "Pune", "start_date": _day(0), "end_date": _day(2),
+                                                    "daily_limit": 3}, "id": "c1"},
+                {"name": "weather_tool", "args": {"city": "Pune", "start_date": _day(0), "end_date": _day(2)},
+                 "id": "c2"},
+            ]),
+            AIMessage(f"agent plan {len(models) + 1}"),
+        ])
+        model = ScriptedModel(replies=replies)
+        models.append(model)
+        tools = [main_graph._as_tool(itinerary_tool), main_graph._as_tool(weather_tool)]
+        return create_react_agent(model, tools)
+    return build
+
+
+def test_agent_mode_runs_the_supervisor_on_the_session_data(upstream, monkeypatch):
+    models = []
+    monkeypatch.setattr(main_graph, "get_supervisor", _supervisor(models))
+    assert main_graph.plan_trip("Pune", _day(0), _day(2), 3, mode="agent", session="s1") == "agent plan 1"
+    # the supervisor's tool calls were served from what the graph had just fetched
+    assert (len(upstream["geocode"]), len(upstream["pois"]), len(upstream["weather"])) == (1, 1, 1)
+
+    upstream["reset"]()
+    assert main_graph.plan_trip("Pune", _day(0), _day(2), 4, mode="agent", session="s1") == "agent plan 2"
+    assert upstream["geocode"] == upstream["pois"] == upstream["weather"] == []
+    assert [m.calls for m in models] == [2, 2]
+
+    # nothing changed: answered from the checkpoint, no model call
+    assert main_graph.plan_trip("Pune", _day(0), _day(2), 4, mode="agent", session="s1") == "agent plan 2"
+    assert len(models) == 2
+
+
+def test_switching_mode_does_not_reuse_the_other_modes_answer(upstream, monkeypatch):
+    monkeypatch.setattr(main_graph, "polish_plan", lambda md: "polished")
+    draft = replan.replan("s1", "Pune", _day(0), _day(2), 3, mode="fast")
+    assert draft != "polished"
+    assert replan.replan("s1", "Pune", _day(0), _day(2), 3, mode="fast_polish") == "polished"
+    assert replan.replan("s1", "Pune", _day(0), _day(2), 3, mode="fast") == draft
+
+
+def test_agent_mode_stream(upstream, monkeypatch):
+    monkeypatch.setattr(main_graph, "get_supervisor", _supervisor([]))
+    events = list(main_graph.stream_plan("Pune", _day(0), _day(2), 3, mode="agent", session="s1"))
+    assert events[-1].kind == "final" and events[-1].data == "agent plan 1"
+    assert "agent (LLM turns)" in [e.name for e in events if e.kind == "stage"]
+    again = list(main_graph.stream_plan("Pune", _day(0), _day(2), 3, mode="agent", session="s1"))
+    assert "agent (LLM turns) (reused)" in [e.name for e in again if e.kind == "stage"]
@@ -0,0 +1,56 @@
+import random
+
+from tools.scheduler import schedule_days
+
+
+def _pool(n, indoor=(), seed=0):
+    rng = random.Random(seed)
+    return [{"name": f"p{i}", "lat": 17.38 + rng.uniform(-0.02, 0.02), "lon": 78.48 + rng.uniform(-0.02, 0.02),
+             "is_indoor": i in indoor} for i in range(n)]
+
+
+def _sizes(plans):
+    return [len(p.stops) for p in plans]
+
+
+def test_rainy_day_gets_the_indoor_pois():
+    pool = _pool(10, indoor={0, 4, 8})
+    plans = schedule_days(pool, 5, 3, [False, True, False, False, False])
+    assert sorted(p["name"] for p in plans[1].stops) == ["p0", "p4", "p8"]
+    assert sum(_sizes(plans)) == 10
+
+
+def test_rainy_day_prefers_indoor_over_outdoor():
+    pool = _pool(20, indoor={1, 5, 9, 13, 17}, seed=3)
+    plans = schedule_days(pool, 3, 3, [False, True, False])
+    assert _sizes(plans) == [3, 3, 3]
+    assert all(p["is_indoor"] for p in plans[1].stops)
+
+
+def test_rainy_day_short_of_indoor_places_fills_up():
+    pool = _pool(12, indoor={2})
+    plans = schedule_days(pool, 3, 3, [True, False, True])
+    assert _sizes(plans) == [3, 3, 3]
+    assert [p["name"] for p in plans[0].stops + plans[2].stops].count("p2") == 1
+
+
+def test_days_fill_evenly():
+    assert _sizes(schedule_days(_pool(8), 4, 3, [False] * 4)) == [2, 2, 2, 2]
+    assert _sizes(schedule_days(_pool(10), 4, 3, [False] * 4)) == [3, 3, 2, 2]
+    assert _sizes(schedule_days(_pool(30), 4, 3, [False] * 4)) == [3, 3, 3, 3]
+
+
+def test_every_poi_is_used_once():
+    pool = _pool(25, indoor=set(range(0, 25, 3)), seed=7)
+    plans = schedule_days(pool, 6, 4, [i % 2 == 0 for i in range(6)])
+    names = [p["name"] for plan in plans for p in plan.stops]
+    assert len(names) == len(set(names)) == 24
+
+
+def test_edge_cases():
+    assert schedule_days([], 3, 3, []) == [([], 0.0)] * 3
+    assert schedule_days(_pool(3), 0, 3, []) == []
+    plans = schedule_days(_pool(2), 4, 3, [True] * 4)
+    assert sum(_sizes(plans)) == 2
+    no_coords = [{"name": "a", "lat": None, "lon": None}, {"name": "b", "lat": None, "lon": None}]
+    assert sum(_sizes(schedule_days(no_coords, 1, 3, [False]))) == 2
@@ -0,0 +1,148 @@
+"""The planning service: admission control (429), deadlines (504) and the SSE stream."""
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import server
+from main_graph import PlanEvent
+
+TRIP = {"city": "Pune", "start_date": "2030-01-01", "end_date": "2030-01-02"}
+
+
+def _serve(coro_fn, limit=1, max_queue=0):
+    """Run `coro_fn(client)` against the app with a fresh limiter (no lifespan: no warmer, default executor)."""
+    async def main():
+        server.app.state.limiter = server.Limiter(limit, max_queue)
+        server.app.state.started = time.time()
+        server.app.state.warmer = None
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await coro_fn(client)
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def slow_plan(monkeypatch):
+    async def aplan_trip(city, start_date, end_date, daily_limit, mode, use_llm_cache):
+        await asyncio.sleep(0.3)
+        return f"plan for {city}"
+
+    monkeypatch.setattr(server, "aplan_trip", aplan_trip)
+
+
+def test_limiter_queues_then_rejects():
+    async def main():
+        lim = server.Limiter(1, 1)
+        await lim.acquire(1)
+        queued = asyncio.ensure_future(lim.acquire(1))
+        await asyncio.sleep(0)
+        assert lim.stats()["queued"] == 1
+        with pytest.raises(server.Saturated):
+            await lim.acquire(1)
+        lim.release()
+        await queued
+        assert (lim.active, lim.queued, lim.rejected) == (1, 0, 1)
+        with pytest.raises(asyncio.TimeoutError):
+            await lim.acquire(0.05)  # queued past its deadline
+        assert lim.queued == 0
+
+    asyncio.run(main())
+
+
+def test_full_queue_answers_429(slow_plan):
+    async def run(client):
+        return await asyncio.gather(*(client.post("/plan", json=TRIP) for _ in range(3)))
+
+    codes = sorted(r.status_code for r in _serve(run, limit=1, max_queue=1))
+    assert codes == [200, 200, 429]
+
+
+def test_429_carries_retry_after(slow_plan):
+    async def run(client):
+        first = asyncio.ensure_future(client.post("/plan", json=TRIP))
+        await asyncio.sleep(0.05)
+        rejected = await client.post("/plan", json=TRIP)
+        await first
+        return rejected
+
+    r = _serve(run, limit=1, max_queue=0)
+    assert r.status_code == 429 and r.headers["retry-after"] == str(server.SERVICE_RETRY_AFTER_S)
+
+
+def test_deadline_answers_504(slow_plan):
+    async def run(client):
+        late = await client.post("/plan", json=TRIP, headers={"X-Request-Deadline": "0.05"})
+        # the second request spends its whole budget waiting for the slot
+        busy = asyncio.ensure_future(client.post("/plan", json=TRIP))
+        await asyncio.sleep(0.05)
+        queued = await client.post("/plan", json=TRIP, headers={"X-Request-Deadline": "0.05"})
+        return late, queued, await busy
+
+    late, queued, busy = _serve(run, limit=1, max_queue=1)
+    assert (late.status_code, late.json()) == (504, {"error": "deadline exceeded"})
+    assert (queued.status_code, queued.json()) == (504, {"error": "deadline exceeded while queued"})
+    assert busy.status_code == 200 and busy.json()["result"] == "plan for Pune"
+
+
+def test_bad_requests_answer_400():
+    async def run(client):
+        return [await client.post("/plan", json={"city": "Pune"}),
+                await client.post("/plan", json=TRIP, headers={"X-Request-Deadline": "soon"}),
+                await client.post("/plan", content=b"[1]")]
+
+    assert [r.status_code for r in _serve(run)] == [400, 400, 400]
+
+
+def _events(body):
+    """(event, data) pairs of an SSE body; every frame is "event: ...\\ndata: <json>\\n\\n"."""
+    assert body.endswith("\n\n")
+    out = []
+    for frame in body[:-2].split("\n\n"):
+        event, data = frame.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return out
+
+
+def test_stream_frames_each_plan_event(monkeypatch):
+    def stream_plan(**trip):
+        yield PlanEvent("tool_start", "itinerary_tool", None, 0.01)
+        yield PlanEvent("token", "", "line one\nline two", 0.02)
+        yield PlanEvent("final", "", f"plan for {trip['city']}", 0.03)
+
+    monkeypatch.setattr(server, "stream_plan", stream_plan)
+
+    async def run(client):
+        r = await client.get("/plan/stream", params=TRIP)
+        return r, server.app.state.limiter
+
+    r, limiter = _serve(run)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/event-stream")
+    assert _events(r.text) == [
+        ("tool_start", {"name": "itinerary_tool", "data": None, "elapsed": 0.01}),
+        ("token", {"name": "", "data": "line one\nline two", "elapsed": 0.02}),
+        ("final", {"name": "", "data": "plan for Pune", "elapsed": 0.03}),
+    ]
+    assert limiter.active == 0
+
+
+def test_stream_past_its_deadline_ends_with_an_error_event(monkeypatch):
+    def stream_plan(**trip):
+        yield PlanEvent("tool_start", "weather_tool", None, 0.0)
+        time.sleep(0.3)
+        yield PlanEvent("final", "", "too late", 0.3)
+
+    monkeypatch.setattr(server, "stream_plan", stream_plan)
+
+    async def run(client):
+        r = await client.get("/plan/stream", params=TRIP, headers={"X-Request-Deadline": "0.1"})
+        await asyncio.sleep(0.4)  # the slot is freed once the abandoned step finishes
+        return r, server.app.state.limiter.active
+
+    r, active = _serve(run)
+    assert [e for e, _ in _events(r.text)] == ["tool_start", "error"]
+    assert _events(r.text)[-1][1] == {"error": "deadline exceeded"}
+    assert active == 0
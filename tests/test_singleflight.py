@@ -0,0 +1,113 @@
+"""Single-flight: concurrent identical calls share one execution, its result and its exception."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from tools.singleflight import SingleFlight
+
+
+def _wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Gate:
+    """A fetch that blocks until released, then returns `result` or raises `error`; counts its runs."""
+
+    def __init__(self, result="value", error=None):
+        self.result, self.error = result, error
+        self.release = threading.Event()
+        self.runs = 0
+
+    def __call__(self, *args):
+        self.runs += 1
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return (self.result,) + args
+
+
+def _threads(flight, key, fn, n):
+    out = [None] * n
+
+    def call(i):
+        try:
+            out[i] = flight.do(key, fn, key)
+        except Exception as e:
+            out[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, out
+
+
+def test_do_coalesces_concurrent_calls():
+    flight, fetch = SingleFlight("sf_test"), Gate()
+    threads, out = _threads(flight, "pune", fetch, 5)
+    _wait_for(lambda: flight.stats()["coalesced"] == 4)
+    fetch.release.set()
+    for t in threads:
+        t.join()
+    assert out == [("value", "pune")] * 5 and fetch.runs == 1
+    assert flight.stats() == {"calls": 1, "coalesced": 4, "in_flight": 0}
+    # nothing is remembered once the call completes
+    assert flight.do("pune", fetch, "pune") == ("value", "pune") and fetch.runs == 2
+
+
+def test_different_keys_do_not_coalesce():
+    flight, fetch = SingleFlight("sf_test"), Gate()
+    fetch.release.set()
+    assert flight.do("a", fetch, "a") != flight.do("b", fetch, "b")
+    assert fetch.runs == 2
+
+
+def test_do_raises_the_exception_in_every_waiter():
+    flight, fetch = SingleFlight("sf_test"), Gate(error=RuntimeError("upstream down"))
+    threads, out = _threads(flight, "pune", fetch, 3)
+    _wait_for(lambda: flight.stats()["coalesced"] == 2)
+    fetch.release.set()
+    for t in threads:
+        t.join()
+    assert all(isinstance(e, RuntimeError) and str(e) == "upstream down" for e in out)
+    assert fetch.runs == 1 and flight.stats()["in_flight"] == 0
+
+
+@pytest.mark.parametrize("error", [None, ValueError("bad response")])
+def test_ado_coalesces_and_propagates(error):
+    flight, fetch = SingleFlight("sf_test"), Gate(error=error)
+
+    async def main():
+        tasks = [asyncio.ensure_future(flight.ado("goa", fetch, "goa")) for _ in range(4)]
+        while flight.stats()["coalesced"] < 3:
+            await asyncio.sleep(0.005)
+        # a thread arriving now joins the same call
+        threads, out = _threads(flight, "goa", fetch, 1)
+        await asyncio.to_thread(_wait_for, lambda: flight.stats()["coalesced"] == 4)
+        fetch.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        threads[0].join()
+        return results + out
+
+    results = asyncio.run(main())
+    assert fetch.runs == 1
+    assert results == [error or ("value", "goa")] * 5
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    flight, fetch = SingleFlight("sf_test"), Gate()
+
+    async def main():
+        leader = asyncio.ensure_future(flight.ado("k", fetch, "k"))
+        follower = asyncio.ensure_future(flight.ado("k", fetch, "k"))
+        while flight.stats()["coalesced"] < 1:
+            await asyncio.sleep(0.005)
+        leader.cancel()
+        fetch.release.set()
+        return await follower
+
+    assert asyncio.run(main()) == ("value", "k")
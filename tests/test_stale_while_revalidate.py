@@ -0,0 +1,98 @@
+"""Expired cache entries are served while one background refresh per key renews them."""
+import threading
+import types
+
+import pytest
+
+from tools import cache as cache_mod, revalidate as rv, weather_fetcher
+from tools.cache import TieredCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache_mod, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.mark.parametrize("disk", [False, True])
+def test_stale_window(clock, tmp_path, disk):
+    c = TieredCache("swr_test", ttl=10, stale_ttl=100, path=str(tmp_path / "c.sqlite3") if disk else None)
+    c.set("k", "v")
+    assert c.lookup("k") == ("v", True)
+    clock[0] += 50
+    if disk:
+        c._mem.clear()  # served from the SQLite tier
+    assert c.lookup("k") == ("v", False)
+    assert c.get("k", "default") == "default"
+    clock[0] += 100
+    assert c.lookup("k") is None
+    assert c.stats()["stale_hits"] == 1
+
+
+def test_entries_without_expiry_stay_fresh(clock):
+    c = TieredCache("swr_test", ttl=10, stale_ttl=100)
+    c.set("k", "v", ttl=None)
+    clock[0] += 10 ** 6
+    assert c.lookup("k") == ("v", True)
+
+
+def test_one_refresh_per_key():
+    gate = threading.Event()
+    runs = []
+
+    def refresh(key):
+        gate.wait(5)
+        runs.append(key)
+        return True
+
+    assert rv.revalidate("swr_test", "a", refresh, "a")
+    assert not rv.revalidate("swr_test", "a", refresh, "a")  # already queued
+    assert rv.revalidate("swr_test", "b", refresh, "b")
+    gate.set()
+    assert rv.drain(5)
+    assert sorted(runs) == ["a", "b"]
+    # once done, the key can be refreshed again
+    assert rv.revalidate("swr_test", "a", refresh, "a") and rv.drain(5)
+
+
+def test_failures_and_overflow_are_counted(monkeypatch):
+    before = rv.revalidate_stats()
+
+    def boom():
+        raise RuntimeError("upstream down")
+
+    rv.revalidate("swr_test", "boom", boom)
+    rv.revalidate("swr_test", "no", lambda: False)  # nothing stored counts as a failure too
+    assert rv.drain(5)
+    monkeypatch.setattr(rv, "REFRESH_MAX_PENDING", 0)
+    assert not rv.revalidate("swr_test", "dropped", lambda: True)
+    after = rv.revalidate_stats()
+    assert after["error"] - before["error"] == 2
+    assert after["dropped"] - before["dropped"] == 1
+
+
+def test_weather_serves_stale_days_and_refreshes_them(clock, monkeypatch):
+    day_cache = TieredCache("weather_day_test", ttl=10, stale_ttl=1000)
+    monkeypatch.setattr(weather_fetcher, "_day_cache", day_cache)
+    fetches = []
+
+    def fake_remote(lat, lon, start_date, end_date):
+        fetches.append((start_date, end_date))
+        days = weather_fetcher._days(start_date, end_date)
+        daily = {"time": [d.isoformat() for d in days]}
+        for k in weather_fetcher.DAILY_VARS:
+            daily[k] = [float(len(fetches))] * len(days)
+        return weather_fetcher.FetchResult(daily)
+
+    monkeypatch.setattr(weather_fetcher, "_fetch_remote", fake_remote)
+    monkeypatch.setattr(weather_fetcher, "_day_ttl", lambda day: 10)
+    first = weather_fetcher._fetch_weather_result(18.52, 73.86, "2030-01-01", "2030-01-03")
+    assert first.value["precipitation_sum"] == [1.0] * 3
+
+    clock[0] += 60
+    stale = weather_fetcher._fetch_weather_result(18.52, 73.86, "2030-01-01", "2030-01-03")
+    assert stale.value == first.value  # answered at once from the expired days
+    assert rv.drain(5)
+    assert fetches == [("2030-01-01", "2030-01-03")] * 2
+    assert day_cache.lookup("18.52,73.86:2030-01-02") == ({k: 2.0 for k in weather_fetcher.DAILY_VARS}, True)
@@ -0,0 +1,82 @@
+"""The supervisor's child fan-out: concurrency, per-child timeouts and error isolation."""
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agents import supervisor_agent as sup
+from tools.fetch_context import FetchContext, current_context
+
+
+class FakeChild:
+    """A child agent that answers after `delay` seconds (or raises `error`)."""
+
+    def __init__(self, answer="ok", delay=0.0, error=None):
+        self.answer, self.delay, self.error = answer, delay, error
+        self.cancelled = False
+        self.context = None
+
+    async def ainvoke(self, payload):
+        self.context = current_context()
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return {"messages": [HumanMessage(payload["messages"][0]["content"]), AIMessage(self.answer)]}
+
+
+def test_final_text():
+    call = AIMessage("", tool_calls=[{"name": "t", "args": {}, "id": "1"}])
+    assert sup.final_text({"messages": [HumanMessage("q"), AIMessage("answer"), call]}) == "answer"
+    assert sup.final_text({"messages": [{"role": "assistant", "content": "from a dict"}]}) == "from a dict"
+    assert sup.final_text({"messages": [HumanMessage("q"), call]}) == "ERROR: child produced no answer"
+    assert sup.final_text(None) == "ERROR: child produced no answer"
+
+
+def test_children_run_concurrently():
+    calls = [(name, FakeChild(name, delay=0.3), f"prompt {name}") for name in ("weather", "pois", "itinerary")]
+    started = time.monotonic()
+    assert sup.run_children(calls, timeout=5) == {"weather": "weather", "pois": "pois", "itinerary": "itinerary"}
+    assert time.monotonic() - started < 0.8
+
+
+def test_a_slow_child_is_cancelled_at_its_timeout():
+    slow = FakeChild("late", delay=30)
+    started = time.monotonic()
+    results = sup.run_children([("weather", FakeChild("sunny"), "p"), ("pois", slow, "p")], timeout=0.3)
+    assert time.monotonic() - started < 2
+    assert results["weather"] == "sunny" and results["pois"].startswith("TIMEOUT")
+    assert slow.cancelled
+    slow.cancelled = False
+    assert sup.run_child(slow, "p", timeout=0.2).startswith("TIMEOUT")
+    assert slow.cancelled
+
+
+def test_a_failing_child_does_not_sink_the_others():
+    results = sup.run_children([("weather", FakeChild(error=RuntimeError("upstream down")), "p"),
+                                ("pois", FakeChild("museums"), "p")], timeout=5)
+    assert results == {"weather": "ERROR: RuntimeError: upstream down", "pois": "museums"}
+    assert sup.run_child(FakeChild(error=ValueError("bad")), "p") == "ERROR: ValueError: bad"
+
+
+def test_children_see_the_callers_fetch_context():
+    child = FakeChild()
+    with FetchContext().activate() as ctx:
+        sup.run_child(child, "p")
+    assert child.context is ctx
+
+
+@pytest.mark.parametrize("slots, floor", [(None, 0.0), (1, 0.4)])
+def test_async_fan_out_and_slots(slots, floor):
+    async def fan_out():
+        sem = asyncio.Semaphore(slots) if slots else None
+        calls = [("a", FakeChild("A", delay=0.2), "p"), ("b", FakeChild("B", delay=0.2), "p")]
+        return await sup.arun_children(calls, timeout=5, slots=sem)
+
+    started = time.monotonic()
+    assert asyncio.run(fan_out()) == {"a": "A", "b": "B"}
+    assert floor <= time.monotonic() - started < floor + 0.35
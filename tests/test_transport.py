@@ -0,0 +1,170 @@
+"""The shared HTTP transport: retries, Retry-After, per-host concurrency and rate limits."""
+import email.utils
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from bench.fake_servers import FakeUpstreams, ServiceConfig
+from tools import transport
+from tools.transport import HostPolicy, UpstreamError
+
+
+class Scripted:
+    """Loopback server answering with the next (status, headers, delay) of `script`, then 200s."""
+
+    def __init__(self, script=(), delay=0.0):
+        self.script = list(script)
+        self.delay = delay
+        self.arrivals = []
+        self.active = self.max_active = 0
+        self._lock = threading.Lock()
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, headers, delay = owner._next()
+                try:
+                    if delay:
+                        time.sleep(delay)
+                    self.send_response(status)
+                    for k, v in headers.items():
+                        self.send_header(k, v)
+                    self.send_header("Content-Length", "2")
+                    self.end_headers()
+                    self.wfile.write(b"{}")
+                finally:
+                    with owner._lock:
+                        owner.active -= 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/x"
+
+    def _next(self):
+        with self._lock:
+            self.arrivals.append(time.monotonic())
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            step = self.script.pop(0) if self.script else 200
+        status, headers, delay = step if isinstance(step, tuple) else (step, {}, 0.0)
+        return status, headers, delay or self.delay
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """serve(script, policy=..., delay=...) -> a Scripted server whose host uses `policy`; no backoff waits."""
+    monkeypatch.setattr(transport, "_backoff", lambda attempt: 0.0)
+    servers = []
+
+    def start(script=(), policy=HostPolicy(), delay=0.0):
+        s = Scripted(script, delay)
+        monkeypatch.setitem(transport.HOST_POLICIES, transport.host_of(s.url), policy)
+        servers.append(s)
+        return s
+
+    yield start
+    for s in servers:
+        s.close()
+
+
+@pytest.mark.parametrize("script", [[503, 502], [429], [(429, {"Retry-After": "0"}, 0.0)] * 2])
+def test_retries_until_success(serve, script):
+    s = serve(script)
+    assert transport.get(s.url).status_code == 200
+    assert len(s.arrivals) == len(script) + 1
+    assert transport.transport_stats()[transport.host_of(s.url)]["retries"] == len(script)
+
+
+def test_retries_are_bounded(serve):
+    s = serve([503] * 5, HostPolicy(max_retries=2))
+    with pytest.raises(UpstreamError) as e:
+        transport.get(s.url)
+    assert (e.value.kind, e.value.status) == ("unavailable", 503)
+    assert len(s.arrivals) == 3
+
+
+def test_other_client_errors_are_not_retried(serve):
+    s = serve([404])
+    with pytest.raises(UpstreamError) as e:
+        transport.get(s.url)
+    assert e.value.kind == "bad_response" and len(s.arrivals) == 1
+
+
+def test_timeouts_are_retried(serve):
+    s = serve([(200, {}, 0.5)])
+    assert transport.get(s.url, timeout=0.1).status_code == 200
+    slow = serve(delay=0.5)
+    with pytest.raises(UpstreamError) as e:
+        transport.get(slow.url, timeout=0.1)
+    assert e.value.kind == "unavailable" and e.value.status is None
+
+
+def test_a_long_retry_after_gives_up_at_once(serve):
+    s = serve([(429, {"Retry-After": str(int(transport.MAX_RETRY_AFTER) + 60)}, 0.0)])
+    started = time.monotonic()
+    with pytest.raises(UpstreamError) as e:
+        transport.get(s.url)
+    assert e.value.throttled and len(s.arrivals) == 1
+    assert time.monotonic() - started < 1
+
+
+def test_retry_after_is_honoured(serve, monkeypatch):
+    slept = []
+    monkeypatch.setattr(transport, "time", types.SimpleNamespace(sleep=slept.append, monotonic=time.monotonic,
+                                                                 time=time.time))
+    s = serve([(503, {"Retry-After": "3"}, 0.0)])
+    assert transport.get(s.url).status_code == 200
+    assert slept == [3.0]
+
+
+def test_retry_after_http_date():
+    resp = requests.Response()
+    resp.headers["Retry-After"] = email.utils.formatdate(time.time() + 20, usegmt=True)
+    assert 18 <= transport._retry_after(resp) <= 20
+    resp.headers["Retry-After"] = "soon"
+    assert transport._retry_after(resp) is None
+
+
+def test_per_host_concurrency(serve):
+    s = serve(policy=HostPolicy(max_concurrency=2), delay=0.2)
+    threads = [threading.Thread(target=transport.get, args=(s.url,)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(s.arrivals) == 6 and s.max_active == 2
+
+
+def test_per_host_rate_interval(serve):
+    s = serve(policy=HostPolicy(max_concurrency=4, min_interval=0.15))
+    threads = [threading.Thread(target=transport.get, args=(s.url,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    gaps = [b - a for a, b in zip(s.arrivals, s.arrivals[1:])]
+    assert len(gaps) == 3 and min(gaps) >= 0.13
+
+
+def test_against_a_failing_fake_upstream(monkeypatch):
+    monkeypatch.setattr(transport, "_backoff", lambda attempt: 0.0)
+    with FakeUpstreams({"open_meteo": ServiceConfig(error_rate=1.0, error_status=502)}) as fake:
+        url = fake.urls["OPEN_METEO_URL"]
+        with pytest.raises(UpstreamError) as e:
+            transport.get(url, params={"start_date": "2030-01-01", "end_date": "2030-01-01"})
+        assert (e.value.kind, e.value.status) == ("unavailable", 502)
+        assert fake.services["open_meteo"].requests == transport.DEFAULT_POLICY.max_retries + 1
@@ -0,0 +1,63 @@
+"""An agent that keeps calling tools past its turn limit still gives the plan an answer."""
+import asyncio
+import itertools
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+from langgraph.prebuilt import create_react_agent
+
+import main_graph
+from agents.compaction import pre_model_hook, turn_limit
+from conftest import ScriptedModel
+
+PAYLOAD = {"messages": [{"role": "user", "content": "plan a trip"}]}
+
+
+@tool
+def lookup(city: str) -> str:
+    """Look a city up."""
+    return f"{city}: sunny"
+
+
+def _agent(replies, limit=None):
+    """An agent capped at two turns; an explicit recursion `limit` that ends mid-turn makes LangGraph raise."""
+    model = ScriptedModel(replies=iter(replies))
+    config = {"recursion_limit": limit} if limit else turn_limit(2)
+    return create_react_agent(model, [lookup], pre_model_hook=pre_model_hook("test")).with_config(config)
+
+
+def _calls(content=""):
+    """Endless replies that call `lookup` again, each with `content` alongside."""
+    return (AIMessage(content=content, tool_calls=[{"name": "lookup", "args": {"city": "Pune"}, "id": f"c{i}"}])
+            for i in itertools.count())
+
+
+def test_answer_within_the_limit_is_returned():
+    assert main_graph.invoke_agent(_agent([AIMessage(content="the plan")]), PAYLOAD) == "the plan"
+
+
+@pytest.mark.parametrize("limit", [None, 7])
+def test_cut_off_run_keeps_text_written_with_tool_calls(limit):
+    assert main_graph.invoke_agent(_agent(_calls("draft plan"), limit), PAYLOAD) == "draft plan"
+
+
+@pytest.mark.parametrize("limit", [None, 7])
+def test_cut_off_run_without_text_is_an_error(limit):
+    answer = main_graph.invoke_agent(_agent(_calls(), limit), PAYLOAD)
+    assert answer.startswith("ERROR:") and "turns" in answer
+
+
+@pytest.mark.parametrize("limit", [None, 7])
+def test_async_cut_off_run(limit):
+    answer = asyncio.run(main_graph.ainvoke_agent(_agent(_calls("draft plan"), limit), PAYLOAD))
+    assert answer == "draft plan"
+
+
+@pytest.mark.parametrize("limit", [None, 7])
+def test_stream_ends_with_a_final_event(monkeypatch, limit):
+    monkeypatch.setattr(main_graph, "get_supervisor", lambda: _agent(_calls(), limit))
+    events = list(main_graph._stream_agent("Pune", "2026-11-01", "2026-11-02", 3))
+    assert events[-1].kind == "final"
+    assert events[-1].data.startswith("ERROR:")
+    assert "lookup" in [e.name for e in events if e.kind == "tool"]
@@ -0,0 +1,53 @@
+"""Batched multi-city weather requests never span more than Open-Meteo's forecast window."""
+import datetime
+
+import pytest
+
+from tools import weather_fetcher
+from tools.cache import TieredCache
+
+START = datetime.date(2026, 11, 1)
+
+
+def _day(offset):
+    return (START + datetime.timedelta(days=offset)).isoformat()
+
+
+@pytest.fixture
+def open_meteo(monkeypatch):
+    calls = []
+
+    def fake(points, start_date, end_date):
+        calls.append((len(points), start_date, end_date))
+        days = weather_fetcher._days(start_date, end_date)
+        daily = {"time": [d.isoformat() for d in days]}
+        for k in weather_fetcher.DAILY_VARS:
+            daily[k] = [1.0] * len(days)
+        return [weather_fetcher.FetchResult(dict(daily)) for _ in points]
+
+    monkeypatch.setattr(weather_fetcher, "_fetch_remote_many", fake)
+    monkeypatch.setattr(weather_fetcher, "_day_cache", TieredCache("weather_day_test", ttl=3600))
+    return calls
+
+
+def test_close_legs_share_one_request(open_meteo):
+    legs = [(48.85, 2.35, _day(0), _day(3)), (52.52, 13.40, _day(4), _day(7))]
+    res = weather_fetcher._fetch_weather_batch(legs)
+    assert open_meteo == [(2, _day(0), _day(7))]
+    assert [len(r.value["time"]) for r in res] == [4, 4]
+
+
+def test_far_apart_legs_get_their_own_requests(open_meteo):
+    legs = [(48.85, 2.35, _day(0), _day(3)), (52.52, 13.40, _day(40), _day(42)), (41.90, 12.50, _day(5), _day(9))]
+    res = weather_fetcher._fetch_weather_batch(legs)
+    assert open_meteo == [(2, _day(0), _day(9)), (1, _day(40), _day(42))]
+    assert all(r.ok and r.value for r in res)
+
+
+def test_no_request_spans_more_than_the_window(open_meteo):
+    legs = [(40.0 + i, 10.0, _day(5 * i), _day(5 * i + 2)) for i in range(8)]
+    res = weather_fetcher._fetch_weather_batch(legs)
+    spans = [(datetime.date.fromisoformat(e) - datetime.date.fromisoformat(s)).days + 1 for _, s, e in open_meteo]
+    assert max(spans) <= weather_fetcher.WEATHER_BATCH_MAX_DAYS
+    assert sum(n for n, _, _ in open_meteo) == 8
+    assert all(r.ok and r.value for r in res)
@@ -94,6 +94,16 @@ weather_tool: Callable = _weather
 poi_tool: Callable = _poi
 itinerary_tool: Callable = _itin
 
+# Async counterparts (optional). When present they are registered alongside the sync
+# callables so the agent's ainvoke/astream path never blocks the event loop.
+aweather_tool = getattr(mod_weather, "aweather_tool", None) if mod_weather else None
+apoi_tool = getattr(mod_poi, "apoi_tool", None) if mod_poi else None
+aitinerary_tool = getattr(mod_itin, "aitinerary_tool", None) if mod_itin else None
+
+# Multi-city trips (optional): one batched POI and weather fetch for all legs.
+multi_city_itinerary_tool = getattr(mod_itin, "multi_city_itinerary_tool", None) if mod_itin else None
+amulti_city_itinerary_tool = getattr(mod_itin, "amulti_city_itinerary_tool", None) if mod_itin else None
+
 
 # Optional: small runtime preflight helper (not executed on import)
 def preflight_print():
@@ -0,0 +1,20 @@
+"""Helpers for running the async tool pipeline from synchronous callers."""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Coroutine
+
+
+def run_sync(coro: Coroutine) -> Any:
+    """Run `coro` to completion from sync code (Streamlit, sync LangGraph tool calls).
+
+    When already inside a running event loop (a sync tool invoked from async code),
+    the coroutine runs on its own loop in a worker thread instead of deadlocking.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    ctx = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(ctx.run, asyncio.run, coro).result()
@@ -0,0 +1,33 @@
+"""
+Token budget for text the tools hand back to the model.
+
+Every ReAct turn re-sends earlier tool output, so each tool renders its
+answer under TOOL_OUTPUT_TOKENS (a rough 4-characters-per-token estimate;
+no tokenizer needed). Lines that do not fit are dropped from the end and
+replaced by a "... and N more" marker.
+"""
+import os
+from typing import List
+
+TOOL_OUTPUT_TOKENS = int(os.getenv("TOOL_OUTPUT_TOKENS", 800))
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def fit_lines(lines: List[str], budget: int, more: str = "- ... and {n} more") -> List[str]:
+    """The longest prefix of `lines` that fits in `budget` tokens (one per newline included)."""
+    out: List[str] = []
+    used = 0
+    for i, line in enumerate(lines):
+        cost = estimate_tokens(line) + 1
+        # keep room for the marker unless this is the last line
+        reserve = 0 if i == len(lines) - 1 else estimate_tokens(more) + 2
+        if used + cost + reserve > budget:
+            out.append(more.format(n=len(lines) - i))
+            break
+        out.append(line)
+        used += cost
+    return out
@@ -0,0 +1,217 @@
+"""
+Two-tier (memory LRU + SQLite) key/value cache with per-entry TTL.
+
+Values must be JSON-serialisable. The memory tier answers repeat lookups
+without touching disk; the SQLite tier lets entries survive process restarts.
+Several caches can share one database file by using different namespaces.
+Entries past their stale window are purged from a namespace when its file is
+opened and every CACHE_PURGE_EVERY writes after that.
+"""
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from tools import tracing
+
+DEFAULT_CACHE_DIR = os.getenv("TRAVEL_AGENT_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache"))
+
+# writes between purges of the expired entries (0 = only when the file is opened)
+CACHE_PURGE_EVERY = int(os.getenv("CACHE_PURGE_EVERY", 1000))
+
+_MISSING = object()
+
+
+def default_db_path(filename: str = "cache.sqlite3") -> str:
+    return os.path.join(DEFAULT_CACHE_DIR, filename)
+
+
+class TieredCache:
+    """LRU memory tier in front of an optional SQLite tier.
+
+    Args:
+        namespace: logical table partition inside the SQLite file.
+        ttl: default time-to-live in seconds (None = never expires).
+        max_entries: capacity of the in-memory LRU tier.
+        path: SQLite file path, or None for a memory-only cache.
+        stale_ttl: how long past expiry `lookup()` still returns an entry (marked stale).
+    """
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None, max_entries: int = 1024,
+                 path: Optional[str] = None, stale_ttl: float = 0.0):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.path = path
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self._writes = 0
+        if path:
+            self._open_db(path)
+
+    def _open_db(self, path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " ns TEXT NOT NULL, k TEXT NOT NULL, v TEXT NOT NULL, expires_at REAL,"
+                " PRIMARY KEY (ns, k))"
+            )
+            db.commit()
+            self._db = db
+        except sqlite3.Error:
+            # A broken/readonly cache file must never break the app: fall back to memory only.
+            self._db = None
+            return
+        # entries left behind by earlier processes would otherwise never be removed
+        self.purge_expired()
+
+    # --- memory tier -------------------------------------------------------
+    def _mem_put(self, key: str, value: Any, expires_at: Optional[float]) -> None:
+        self._mem[key] = (value, expires_at)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _find(self, key: str, now: float):
+        """(value, expires_at, from_disk) from the first tier holding `key` within the stale window, or None."""
+        item = self._mem.get(key)
+        if item is not None:
+            if item[1] is None or item[1] + self.stale_ttl > now:
+                self._mem.move_to_end(key)
+                return item + (False,)
+            del self._mem[key]
+        if self._db is not None:
+            try:
+                row = self._db.execute(
+                    "SELECT v, expires_at FROM kv WHERE ns = ? AND k = ?", (self.namespace, key)
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None and (row[1] is None or row[1] + self.stale_ttl > now):
+                value = json.loads(row[0])
+                self._mem_put(key, value, row[1])
+                return value, row[1], True
+        return None
+
+    # --- public API --------------------------------------------------------
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value for `key`, or `default` if absent/expired."""
+        now = time.time()
+        with self._lock:
+            item = self._find(key, now)
+            if item is not None and (item[1] is None or item[1] > now):
+                self.hits += 1
+                self.disk_hits += item[2]
+                tracing.record_cache(self.namespace, True)
+                return item[0]
+            self.misses += 1
+            tracing.record_cache(self.namespace, False)
+            return default
+
+    def lookup(self, key: str) -> Optional[Tuple[Any, bool]]:
+        """(value, fresh) for `key`, or None if absent.
+
+        Expired entries are still returned, with fresh=False, for `stale_ttl`
+        seconds past their expiry so the caller can serve them while it
+        refreshes the entry in the background.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._find(key, now)
+            if item is None:
+                self.misses += 1
+                tracing.record_cache(self.namespace, False)
+                return None
+            fresh = item[1] is None or item[1] > now
+            self.hits += 1
+            self.disk_hits += item[2]
+            if not fresh:
+                self.stale_hits += 1
+            tracing.record_cache(self.namespace, True, stale=not fresh)
+            return item[0], fresh
+
+    def set(self, key: str, value: Any, ttl: Any = _MISSING) -> None:
+        """Store `value` under `key`. `ttl` overrides the default (None = no expiry)."""
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires_at = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._mem_put(key, value, expires_at)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO kv (ns, k, v, expires_at) VALUES (?, ?, ?, ?)",
+                        (self.namespace, key, json.dumps(value), expires_at),
+                    )
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+                self._writes += 1
+                if CACHE_PURGE_EVERY and self._writes % CACHE_PURGE_EVERY == 0:
+                    self.purge_expired()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._mem.pop(key, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM kv WHERE ns = ? AND k = ?", (self.namespace, key))
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+
+    def purge_expired(self) -> int:
+        """Drop entries past expiry and the stale window from both tiers. Returns rows removed from disk."""
+        now = time.time() - self.stale_ttl
+        removed = 0
+        with self._lock:
+            for k in [k for k, (_, exp) in self._mem.items() if exp is not None and exp <= now]:
+                del self._mem[k]
+            if self._db is not None:
+                try:
+                    cur = self._db.execute(
+                        "DELETE FROM kv WHERE ns = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                        (self.namespace, now),
+                    )
+                    self._db.commit()
+                    removed = cur.rowcount
+                except sqlite3.Error:
+                    pass
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM kv WHERE ns = ?", (self.namespace,))
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+            self.hits = self.misses = self.disk_hits = self.stale_hits = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "namespace": self.namespace,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "stale_hits": self.stale_hits,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "memory_entries": len(self._mem),
+                "persistent": self._db is not None,
+            }
@@ -0,0 +1,267 @@
+"""
+Request-scoped fetch context.
+
+One "Plan Trip" run calls weather_tool, poi_tool and itinerary_tool for the same
+city and dates. A FetchContext memoizes geocode, weather and POI results for the
+duration of that plan so each upstream is hit once:
+
+    ctx = FetchContext()
+    supervisor = get_supervisor(context=ctx)   # tools are bound to ctx
+    supervisor.invoke(...)
+    ctx.upstream_calls  # -> {"geocode": 1, "pois": 1, "weather": 1}
+
+Tools look the active context up with `get_context()`; outside a plan they get
+a throwaway context, which behaves exactly like calling the fetchers directly.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from dateutil.parser import parse as parse_date
+
+from tools import geocode as _geocode_mod
+from tools import tracing
+from tools import poi_fetcher as _poi_mod
+from tools import weather_fetcher as _weather_mod
+from tools.geo import pois_within
+from tools.poi_record import POI
+
+# POI requests are widened to at least this pool so the small poi_tool query and
+# the large itinerary_tool query are both served by a single Overpass call.
+POOL_RADIUS = 3500
+POOL_LIMIT = 40
+
+_current: contextvars.ContextVar[Optional["FetchContext"]] = contextvars.ContextVar("fetch_context", default=None)
+
+
+def slice_daily(daily: Dict[str, Any], start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
+    """Cut an Open-Meteo `daily` block down to [start_date, end_date], or None if not covered."""
+    times = daily.get("time") or []
+    if start_date not in times or end_date not in times:
+        return None
+    i, j = times.index(start_date), times.index(end_date) + 1
+    if j <= i:
+        return None
+    return {k: (v[i:j] if isinstance(v, list) and len(v) == len(times) else v) for k, v in daily.items()}
+
+
+class FetchContext:
+    """Per-plan memo of geocode / POI / weather results."""
+
+    def __init__(self, pool_radius: int = POOL_RADIUS, pool_limit: int = POOL_LIMIT):
+        self.pool_radius = pool_radius
+        self.pool_limit = pool_limit
+        self._geocode: Dict[str, Optional[Dict[str, Any]]] = {}
+        # each entry: (lat, lon, radius, limit, results)
+        self._pois: List[tuple] = []
+        # each entry: (lat, lon, daily)
+        self._weather: List[tuple] = []
+        self._locks = {k: threading.Lock() for k in ("geocode", "pois", "weather")}
+        self.upstream_calls = {"geocode": 0, "pois": 0, "weather": 0}
+        # last upstream failure per kind (tools.transport.UpstreamError), for tool messages
+        self.errors: Dict[str, Any] = {}
+
+    # --- activation --------------------------------------------------------
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def bind(self, fn: Callable) -> Callable:
+        """Wrap a tool so it runs with this context active (signature/docstring preserved)."""
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with self.activate():
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.activate():
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def _record(self, kind: str, res) -> None:
+        if res.error is not None:
+            self.errors[kind] = res.error
+        else:
+            self.errors.pop(kind, None)
+
+    # --- seeding ------------------------------------------------------------
+    # Results known from elsewhere (e.g. a checkpointed session, agents.replan) are
+    # served to the tools like results fetched during this plan.
+    def seed_geocode(self, city: str, g: Dict[str, Any]) -> None:
+        with self._locks["geocode"]:
+            self._geocode[_geocode_mod.normalize_query(city)] = g
+
+    def seed_pois(self, lat: float, lon: float, radius: int, limit: int, results: List[POI]) -> None:
+        with self._locks["pois"]:
+            self._pois.append((lat, lon, radius, limit, results))
+
+    def seed_weather(self, lat: float, lon: float, daily: Dict[str, Any]) -> None:
+        with self._locks["weather"]:
+            self._weather.append((lat, lon, daily))
+
+    # --- memoized fetchers -------------------------------------------------
+    def geocode(self, city: str) -> Optional[Dict[str, Any]]:
+        key = _geocode_mod.normalize_query(city)
+        with self._locks["geocode"]:
+            if key in self._geocode:
+                tracing.record_cache("plan.geocode", True)
+                return self._geocode[key]
+            tracing.record_cache("plan.geocode", False)
+            self.upstream_calls["geocode"] += 1
+            res = _geocode_mod.geocode_city_result(city)
+            self._record("geocode", res)
+            # only remember successes: a transient failure should be retried by the next tool
+            if res.value is not None:
+                self._geocode[key] = res.value
+            return res.value
+
+    def pois(self, lat: float, lon: float, radius: int = 2000, limit: int = 8) -> List[POI]:
+        with self._locks["pois"]:
+            hit = self._pois_from_pool(lat, lon, radius, limit)
+            tracing.record_cache("plan.pois", hit is not None)
+            if hit is not None:
+                return hit
+            fetch_radius = max(radius, self.pool_radius)
+            fetch_limit = max(limit, self.pool_limit)
+            results = self._fetch_pool(lat, lon, fetch_radius, fetch_limit)
+            return self._pool_subset(lat, lon, radius, limit, fetch_radius, fetch_limit, results)
+
+    def _fetch_pool(self, lat: float, lon: float, radius: int, limit: int) -> List[POI]:
+        self.upstream_calls["pois"] += 1
+        res = _poi_mod.fetch_pois_result(lat, lon, radius=radius, limit=limit)
+        self._record("pois", res)
+        if res.value:
+            self._pois.append((lat, lon, radius, limit, res.value))
+        return res.value or []
+
+    def _pool_subset(self, lat: float, lon: float, radius: int, limit: int,
+                     prad: int, plim: int, results: List[POI]) -> List[POI]:
+        """Our circle's POIs out of a freshly fetched pool; fetches our circle alone if the pool can't tell."""
+        subset = pois_within(results, lat, lon, radius, limit)
+        if len(subset) >= limit or len(results) < plim or (prad, plim) == (radius, limit):
+            return subset
+        # the widened pool was truncated before it held `limit` POIs inside our circle
+        return pois_within(self._fetch_pool(lat, lon, radius, limit), lat, lon, radius, limit)
+
+    def _pois_from_pool(self, lat: float, lon: float, radius: int, limit: int) -> Optional[List[POI]]:
+        for plat, plon, prad, plim, results in self._pois:
+            if (plat, plon) != (lat, lon) or prad < radius:
+                continue
+            subset = pois_within(results, lat, lon, radius, limit)
+            # A pool that came back short of its limit holds everything in its circle;
+            # a truncated one only answers if it still has `limit` matches inside ours.
+            if len(subset) >= limit or len(results) < plim:
+                return subset
+        return None
+
+    @staticmethod
+    def _iso(day: str) -> str:
+        try:
+            return parse_date(day).date().isoformat()
+        except Exception:
+            return day
+
+    def _weather_from_memo(self, lat: float, lon: float, sd: str, ed: str) -> Optional[Dict[str, Any]]:
+        for wlat, wlon, daily in self._weather:
+            if (wlat, wlon) == (lat, lon):
+                part = slice_daily(daily, sd, ed)
+                if part is not None:
+                    return part
+        return None
+
+    def weather(self, lat: float, lon: float, start_date: str, end_date: str) -> Dict[str, Any]:
+        sd, ed = self._iso(start_date), self._iso(end_date)
+        with self._locks["weather"]:
+            part = self._weather_from_memo(lat, lon, sd, ed)
+            tracing.record_cache("plan.weather", part is not None)
+            if part is not None:
+                return part
+            self.upstream_calls["weather"] += 1
+            res = _weather_mod.fetch_weather_result(lat, lon, sd, ed)
+            self._record("weather", res)
+            daily = res.value
+            if daily:
+                self._weather.append((lat, lon, daily))
+            return daily
+
+    # --- batched fetchers (multi-city trips) ---------------------------------
+    def pois_many(self, areas: Sequence[Tuple[float, float, int, int]]) -> List[List[POI]]:
+        """pois() for several (lat, lon, radius, limit) areas; the unmemoized ones share one fetch."""
+        out: List[Optional[List[POI]]] = [None] * len(areas)
+        with self._locks["pois"]:
+            todo = []
+            for i, (lat, lon, radius, limit) in enumerate(areas):
+                out[i] = self._pois_from_pool(lat, lon, radius, limit)
+                tracing.record_cache("plan.pois", out[i] is not None)
+                if out[i] is None:
+                    todo.append(i)
+            if todo:
+                self.upstream_calls["pois"] += 1
+                wide = [(lat, lon, max(radius, self.pool_radius), max(limit, self.pool_limit))
+                        for lat, lon, radius, limit in (areas[i] for i in todo)]
+                for i, area, res in zip(todo, wide, _poi_mod.fetch_pois_batch_result(wide)):
+                    self._record("pois", res)
+                    if res.value:
+                        self._pois.append(area + (res.value,))
+                    out[i] = self._pool_subset(*areas[i], area[2], area[3], res.value or [])
+        return out
+
+    def weather_many(self, legs: Sequence[Tuple[float, float, str, str]]) -> List[Dict[str, Any]]:
+        """weather() for several (lat, lon, start_date, end_date) legs; the unmemoized ones share one fetch."""
+        out: List[Optional[Dict[str, Any]]] = [None] * len(legs)
+        with self._locks["weather"]:
+            todo = []
+            for i, (lat, lon, start_date, end_date) in enumerate(legs):
+                sd, ed = self._iso(start_date), self._iso(end_date)
+                out[i] = self._weather_from_memo(lat, lon, sd, ed)
+                tracing.record_cache("plan.weather", out[i] is not None)
+                if out[i] is None:
+                    todo.append((i, (lat, lon, sd, ed)))
+            if todo:
+                self.upstream_calls["weather"] += 1
+                results = _weather_mod.fetch_weather_batch_result([leg for _, leg in todo])
+                for (i, (lat, lon, _, _)), res in zip(todo, results):
+                    self._record("weather", res)
+                    if res.value:
+                        self._weather.append((lat, lon, res.value))
+                    out[i] = res.value
+        return out
+
+    # Async variants run the memoized sync path on a worker thread; the per-kind
+    # locks keep concurrent tasks from duplicating an in-flight fetch.
+    async def ageocode(self, city: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.geocode, city)
+
+    async def apois(self, lat: float, lon: float, radius: int = 2000, limit: int = 8) -> List[POI]:
+        return await asyncio.to_thread(self.pois, lat, lon, radius, limit)
+
+    async def aweather(self, lat: float, lon: float, start_date: str, end_date: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.weather, lat, lon, start_date, end_date)
+
+    async def apois_many(self, areas: Sequence[Tuple[float, float, int, int]]) -> List[List[POI]]:
+        return await asyncio.to_thread(self.pois_many, areas)
+
+    async def aweather_many(self, legs: Sequence[Tuple[float, float, str, str]]) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.weather_many, legs)
+
+
+def current_context() -> Optional[FetchContext]:
+    """The FetchContext active for this plan, if any."""
+    return _current.get()
+
+
+def get_context() -> FetchContext:
+    """Active FetchContext, or a fresh throwaway one when called outside a plan."""
+    return _current.get() or FetchContext(pool_radius=0, pool_limit=0)
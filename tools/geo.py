@@ -0,0 +1,32 @@
+"""Small geographic helpers shared by the fetchers and caches."""
+import math
+from typing import Iterable, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from tools.poi_record import POI
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def pois_within(pois: Iterable["POI"], lat: float, lon: float, radius: float,
+                limit: Optional[int] = None) -> List["POI"]:
+    """Keep POIs whose coordinates fall inside the circle, preserving input order."""
+    out = []
+    for p in pois:
+        plat, plon = p.lat, p.lon
+        if plat is None or plon is None:
+            continue
+        if haversine_m(lat, lon, plat, plon) <= radius:
+            out.append(p)
+            if limit is not None and len(out) >= limit:
+                break
+    return out
@@ -1,17 +1,50 @@
-import requests
+import os
+import re
+import unicodedata
 from typing import Optional, Dict, Any
 
-def geocode_city(city: str) -> Optional[Dict[str, Any]]:
-    """Simple geocoding using Nominatim (OpenStreetMap)."""
+from tools import tracing, transport
+from tools.cache import TieredCache, default_db_path
+from tools.revalidate import revalidate
+from tools.singleflight import SingleFlight
+from tools.transport import FetchResult, UpstreamError
+
+# Positive results are stable for a long time; misses are cached briefly so a
+# typo doesn't hammer Nominatim (1 req/s policy) but a fixed entry shows up soon.
+GEOCODE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = float(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL", 3600))
+# Expired entries keep being served for this long while a background refresh runs.
+GEOCODE_STALE_TTL = float(os.getenv("GEOCODE_STALE_TTL", 30 * 24 * 3600))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", 2048))
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+
+_cache = TieredCache(
+    "geocode",
+    ttl=GEOCODE_TTL,
+    max_entries=GEOCODE_CACHE_SIZE,
+    path=None if os.getenv("GEOCODE_CACHE_DISABLE_DISK") else default_db_path(),
+    stale_ttl=GEOCODE_STALE_TTL,
+)
+# concurrent lookups of the same place share one Nominatim request
+_flight = SingleFlight("geocode")
+
+
+def normalize_query(city: str) -> str:
+    """Canonical cache key for a free-form place query ("  New  York, " -> "new york")."""
+    s = unicodedata.normalize("NFKC", city or "").casefold()
+    s = re.sub(r"\s*,\s*", ", ", s)
+    s = re.sub(r"\s+", " ", s)
+    return s.strip(" ,")
+
+
+def geocode_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters for the geocode cache."""
+    return _cache.stats()
+
+
+def _geocode_remote(city: str) -> Optional[Dict[str, Any]]:
+    r = transport.get(NOMINATIM_URL, params={"q": city, "format": "json", "limit": 1}, timeout=10)
     try:
-        url = "https://nominatim.openstreetmap.org/search"
-        r = requests.get(
-            url,
-            params={"q": city, "format": "json", "limit": 1},
-            headers={"User-Agent": "travel-agent-app"},
-            timeout=10,
-        )
-        r.raise_for_status()
         results = r.json()
         if not results:
             return None
@@ -21,5 +54,88 @@ def geocode_city(city: str) -> Optional[Dict[str, Any]]:
             "lon": float(res["lon"]),
             "name": res.get("display_name", city),
         }
-    except Exception:
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise UpstreamError("bad_response", transport.host_of(NOMINATIM_URL))
+
+
+def _store(key: str, result: Optional[Dict[str, Any]]) -> None:
+    _cache.set(key, result, ttl=GEOCODE_TTL if result is not None else GEOCODE_NEGATIVE_TTL)
+
+
+def _refresh(key: str, city: str) -> bool:
+    try:
+        _store(key, _geocode_remote(city))
+    except UpstreamError:
+        return False
+    return True
+
+
+def _geocode_city_result(key: str, city: str) -> FetchResult:
+    entry = _cache.lookup(key)
+    if entry is not None:
+        cached, fresh = entry
+        if not fresh:
+            revalidate("geocode", key, _refresh, key, city)
+        tracing.current_span().set(source="cache", found=cached is not None, stale=not fresh)
+        return FetchResult(cached)
+    try:
+        result = _geocode_remote(city)
+    except UpstreamError as e:
+        # transport errors are not cached: the next call should retry
+        tracing.current_span().set(source="nominatim", error=e.kind)
+        return FetchResult(None, e)
+    tracing.current_span().set(source="nominatim", found=result is not None)
+    _store(key, result)
+    return FetchResult(result)
+
+
+def _from_gazetteer(city: str) -> Optional[FetchResult]:
+    """The offline gazetteer's answer (GAZETTEER_PATH), or None to ask the cache / Nominatim."""
+    from tools.gazetteer import get_gazetteer  # lazy: keeps `python -m tools.gazetteer` warning-free
+
+    gaz = get_gazetteer()
+    if gaz is None:
         return None
+    place = gaz.lookup(city)
+    if place is None:
+        return None
+    tracing.current_span().set(source="gazetteer", found=True, score=round(place.score, 2))
+    return FetchResult(place.as_geocode())
+
+
+@tracing.traced("geocode")
+def geocode_city_result(city: str) -> FetchResult:
+    """Geocode `city`; `.value` is None both for unknown places and failures, `.error` tells them apart.
+
+    City names are answered by the offline gazetteer when one is configured;
+    addresses and places it does not know go to Nominatim (cached).
+    """
+    key = normalize_query(city)
+    if not key:
+        return FetchResult(None)
+    offline = _from_gazetteer(city)
+    if offline is not None:
+        return offline
+    return _flight.do(key, _geocode_city_result, key, city)
+
+
+def geocode_city(city: str) -> Optional[Dict[str, Any]]:
+    """Geocode `city` with the offline gazetteer or Nominatim (OpenStreetMap), cached per normalized query."""
+    return geocode_city_result(city).value
+
+
+@tracing.traced("geocode")
+async def ageocode_city_result(city: str) -> FetchResult:
+    """Async geocode_city_result (runs on a worker thread; shares cache, rate limits and in-flight calls)."""
+    key = normalize_query(city)
+    if not key:
+        return FetchResult(None)
+    offline = _from_gazetteer(city)
+    if offline is not None:
+        return offline
+    return await _flight.ado(key, _geocode_city_result, key, city)
+
+
+async def ageocode_city(city: str) -> Optional[Dict[str, Any]]:
+    """Async geocode_city."""
+    return (await ageocode_city_result(city)).value
@@ -1,10 +1,25 @@
+import asyncio
 import datetime
+from typing import Dict, List, Tuple
 from dateutil.parser import parse as parse_date
-from tools.geocode import geocode_city
-from tools.poi_fetcher import fetch_pois
-from tools.weather_fetcher import fetch_weather
+from tools import tracing
+from tools.aio import run_sync
+from tools.budget import TOOL_OUTPUT_TOKENS, estimate_tokens, fit_lines
+from tools.fetch_context import get_context
+from tools.scheduler import DayPlan, schedule_days
+from tools.transport import failure_note
 
-def itinerary_tool(city: str, start_date: str, end_date: str, daily_limit: int = 3) -> str:
+MAX_TRIP_LEGS = 10
+ITINERARY_POI_RADIUS = 3500
+
+
+def itinerary_pool(daily_limit: int, num_days: int) -> Tuple[int, int]:
+    """(radius, limit) of the POI pool an itinerary of `num_days` days is scheduled from."""
+    return ITINERARY_POI_RADIUS, max(20, daily_limit * num_days * 2)
+
+
+@tracing.traced_tool("itinerary_tool")
+async def aitinerary_tool(city: str, start_date: str, end_date: str, daily_limit: int = 3) -> str:
     """Return a markdown itinerary.
     Args:
         city (str): City name
@@ -12,9 +27,10 @@ def itinerary_tool(city: str, start_date: str, end_date: str, daily_limit: int =
         end_date (YYYY-MM-DD)
         daily_limit (int): POIs per day
     """
-    g = geocode_city(city)
+    ctx = get_context()
+    g = await ctx.ageocode(city)
     if g is None:
-        return f"ERROR: Could not geocode '{city}'."
+        return f"ERROR: Could not geocode '{city}'{failure_note(ctx.errors.get('geocode'))}."
 
     try:
         sd = parse_date(start_date).date()
@@ -26,24 +42,132 @@ def itinerary_tool(city: str, start_date: str, end_date: str, daily_limit: int =
         return "ERROR: end_date must be same or after start_date."
 
     num_days = (ed - sd).days + 1
-    pool_pois = fetch_pois(g["lat"], g["lon"], radius=3500, limit=max(20, daily_limit * num_days * 2))
-    poi_lines = "\n".join([f"- {p['name']} ({p.get('kinds','')})" for p in pool_pois]) if pool_pois else "No POIs found."
+    # weather and POIs only depend on the coordinates: fetch them concurrently
+    pool_pois, weather = await asyncio.gather(
+        ctx.apois(g["lat"], g["lon"], *itinerary_pool(daily_limit, num_days)),
+        ctx.aweather(g["lat"], g["lon"], sd.isoformat(), ed.isoformat()),
+    )
+    if not pool_pois:
+        pool_pois = []
+    return build_itinerary(g, sd, ed, daily_limit, pool_pois, weather or {},
+                           pois_note=failure_note(ctx.errors.get("pois")))
 
-    weather = fetch_weather(g["lat"], g["lon"], sd.isoformat(), ed.isoformat())
-    precip = weather.get("precipitation_sum", [])
-    tmax = weather.get("temperature_2m_max", [])
-    tmin = weather.get("temperature_2m_min", [])
 
-    indoor_kinds = {"museum", "theatre", "gallery", "library", "cinema"}
+def itinerary_tool(city: str, start_date: str, end_date: str, daily_limit: int = 3) -> str:
+    """Return a markdown itinerary.
+    Args:
+        city (str): City name
+        start_date (YYYY-MM-DD)
+        end_date (YYYY-MM-DD)
+        daily_limit (int): POIs per day
+    """
+    return run_sync(aitinerary_tool(city, start_date, end_date, daily_limit))
+
+
+@tracing.traced_tool("multi_city_itinerary_tool")
+async def amulti_city_itinerary_tool(legs: List[Dict[str, str]], daily_limit: int = 3) -> str:
+    """Return a markdown itinerary for a trip through several cities.
+    Args:
+        legs (list): the stops in travel order, each {"city": ..., "start_date": YYYY-MM-DD, "end_date": YYYY-MM-DD}
+        daily_limit (int): POIs per day
+    """
+    if not legs:
+        return "ERROR: Give at least one leg with city, start_date and end_date."
+    if len(legs) > MAX_TRIP_LEGS:
+        return f"ERROR: At most {MAX_TRIP_LEGS} legs per trip."
+    dates = []
+    for n, leg in enumerate(legs, start=1):
+        if not isinstance(leg, dict) or not leg.get("city"):
+            return f"ERROR: Leg {n} needs a city."
+        try:
+            sd = parse_date(leg.get("start_date")).date()
+            ed = parse_date(leg.get("end_date") or leg.get("start_date")).date()
+        except Exception:
+            return "ERROR: Dates must be YYYY-MM-DD."
+        if ed < sd:
+            return f"ERROR: Leg {n}: end_date must be same or after start_date."
+        dates.append((sd, ed))
+
+    ctx = get_context()
+    geos = await asyncio.gather(*(ctx.ageocode(leg["city"]) for leg in legs))
+    for leg, g in zip(legs, geos):
+        if g is None:
+            return f"ERROR: Could not geocode '{leg['city']}'{failure_note(ctx.errors.get('geocode'))}."
+
+    # every leg's POIs in one fetch and every leg's weather in another, however many legs there are
+    pools, weathers = await asyncio.gather(
+        ctx.apois_many([(g["lat"], g["lon"]) + itinerary_pool(daily_limit, (ed - sd).days + 1)
+                        for g, (sd, ed) in zip(geos, dates)]),
+        ctx.aweather_many([(g["lat"], g["lon"], sd.isoformat(), ed.isoformat()) for g, (sd, ed) in zip(geos, dates)]),
+    )
+    note = failure_note(ctx.errors.get("pois"))
+    sections = [build_itinerary(g, sd, ed, daily_limit, pool or [], weather or {}, pois_note=note,
+                                budget=TOOL_OUTPUT_TOKENS // len(legs))
+                for g, (sd, ed), pool, weather in zip(geos, dates, pools, weathers)]
+    header = f"# Multi-city trip: {' → '.join(g.get('name') for g in geos)}"
+    return "\n\n---\n\n".join([header] + sections)
+
+
+def multi_city_itinerary_tool(legs: List[Dict[str, str]], daily_limit: int = 3) -> str:
+    """Return a markdown itinerary for a trip through several cities.
+    Args:
+        legs (list): the stops in travel order, each {"city": ..., "start_date": YYYY-MM-DD, "end_date": YYYY-MM-DD}
+        daily_limit (int): POIs per day
+    """
+    return run_sync(amulti_city_itinerary_tool(legs, daily_limit))
+
+
+def build_itinerary(g: dict, sd: datetime.date, ed: datetime.date, daily_limit: int,
+                    pool_pois: list, weather: dict, pois_note: str = "", budget: int = TOOL_OUTPUT_TOKENS) -> str:
+    """Schedule POIs over the trip days and render the markdown itinerary.
+
+    The day table is always complete; the list of POIs considered gets
+    whatever is left of the `budget` (tokens).
+    """
+    plans = plan_days(g, (ed - sd).days + 1, daily_limit, pool_pois, weather)
+    return render_itinerary(g, sd, ed, plans, pool_pois, weather, pois_note, budget)
+
+
+def _pool(pool_pois: list) -> List[dict]:
     pool = []
+    seen = set()
     for p in pool_pois:
-        kinds = (p.get("kinds") or "").lower()
-        is_indoor = any(k in kinds for k in indoor_kinds)
-        pool.append({"name": p.get("name"), "is_indoor": is_indoor, "kinds": kinds})
+        if p.name in seen:
+            continue
+        seen.add(p.name)
+        pool.append({"name": p.name, "lat": p.lat, "lon": p.lon, "is_indoor": p.indoor, "category": p.category})
+    return pool
+
 
-    assigned = set()
+def rainy_days(weather: dict, num_days: int) -> List[bool]:
+    """Per trip day, whether enough rain is forecast to prefer indoor POIs."""
+    precip = weather.get("precipitation_sum", [])
+
+    def is_rainy(i: int) -> bool:
+        try:
+            return i < len(precip) and float(precip[i]) >= 2.0
+        except Exception:
+            return False
+    return [is_rainy(i) for i in range(num_days)]
+
+
+def plan_days(g: dict, num_days: int, daily_limit: int, pool_pois: list, weather: dict) -> List[DayPlan]:
+    """The day assignments: a compact group of POIs per day, ordered as a walking route."""
+    pool = _pool(pool_pois)
+    # compact geographic group per day, ordered as a walking route (tools/scheduler.py)
+    with tracing.span("itinerary.schedule", pool=len(pool), days=num_days, daily_limit=daily_limit):
+        return schedule_days(pool, num_days, daily_limit, rainy_days(weather, num_days),
+                             center=(g.get("lat"), g.get("lon")) if g.get("lat") is not None else None)
+
+
+def render_itinerary(g: dict, sd: datetime.date, ed: datetime.date, plans: List[DayPlan], pool_pois: list,
+                     weather: dict, pois_note: str = "", budget: int = TOOL_OUTPUT_TOKENS) -> str:
+    """The markdown itinerary for day assignments from plan_days."""
+    precip = weather.get("precipitation_sum", [])
+    tmax = weather.get("temperature_2m_max", [])
+    tmin = weather.get("temperature_2m_min", [])
+    pool = _pool(pool_pois)
     rows = []
-    idx = 0
 
     def weather_note_for_day(i: int) -> str:
         note_parts = []
@@ -71,42 +195,17 @@ def itinerary_tool(city: str, start_date: str, end_date: str, daily_limit: int =
                 pass
         return "; ".join(note_parts) if note_parts else "No specific weather notes"
 
-    for day_index in range(num_days):
+    for day_index, plan in enumerate(plans):
         date = (sd + datetime.timedelta(days=day_index)).isoformat()
-        rainy = False
-        if day_index < len(precip):
-            try:
-                rainy = float(precip[day_index]) >= 2.0
-            except Exception:
-                rainy = False
-
-        day_selected = []
-        attempts = 0
-        while len(day_selected) < daily_limit and attempts < max(1, len(pool)) * 2:
-            p = pool[idx % max(1, len(pool))] if pool else None
-            idx += 1; attempts += 1
-            if p is None:
-                break
-            if p["name"] in assigned:
-                continue
-            if rainy and not p["is_indoor"]:
-                continue
-            day_selected.append(p["name"])
-            assigned.add(p["name"])
-        if len(day_selected) < daily_limit:
-            for p in pool:
-                if p["name"] in assigned:
-                    continue
-                day_selected.append(p["name"])
-                assigned.add(p["name"])
-                if len(day_selected) >= daily_limit:
-                    break
-
-        morning = day_selected[0] if len(day_selected) > 0 else "Free / explore locally"
-        afternoon = day_selected[1] if len(day_selected) > 1 else "Free / explore locally"
-        evening = day_selected[2] if len(day_selected) > 2 else "Dinner / relax"
+        names = [p["name"] for p in plan.stops]
+        # split the route into three consecutive parts of the day
+        parts = [names[len(names) * k // 3:len(names) * (k + 1) // 3] for k in range(3)]
+        morning = " → ".join(parts[0]) or "Free / explore locally"
+        afternoon = " → ".join(parts[1]) or "Free / explore locally"
+        evening = " → ".join(parts[2]) or "Dinner / relax"
         notes = weather_note_for_day(day_index)
-        rows.append({"date": date, "morning": morning, "afternoon": afternoon, "evening": evening, "notes": notes})
+        rows.append({"date": date, "morning": morning, "afternoon": afternoon, "evening": evening,
+                     "walk_km": plan.distance_m / 1000.0, "notes": notes})
 
     md = []
     md.append(f"# Itinerary for {g.get('name')}")
@@ -114,11 +213,15 @@ def itinerary_tool(city: str, start_date: str, end_date: str, daily_limit: int =
     md.append("")
     md.append("## Travel Itinerary")
     md.append("")
-    md.append("| Day | Morning | Afternoon | Evening | Notes |")
-    md.append("|---:|---|---|---|---|")
+    md.append("| Day | Morning | Afternoon | Evening | Walk (km) | Notes |")
+    md.append("|---:|---|---|---|---:|---|")
     for i, r in enumerate(rows, start=1):
-        md.append(f"| {i} | {r['morning']} | {r['afternoon']} | {r['evening']} | {r['notes']} |")
+        md.append(f"| {i} | {r['morning']} | {r['afternoon']} | {r['evening']} | {r['walk_km']:.1f} | {r['notes']} |")
     md.append("")
     md.append("## POIs considered")
-    md.append(poi_lines)
+    if pool:
+        lines = [f"- {p['name']} ({p['category'] or 'place'}{', indoor' if p['is_indoor'] else ''})" for p in pool]
+        md.extend(fit_lines(lines, budget - estimate_tokens("\n".join(md))))
+    else:
+        md.append(f"No POIs found{pois_note}.")
     return "\n".join(md)
@@ -0,0 +1,205 @@
+"""
+In-memory cache of Overpass POI responses, keyed by geohash tile and radius bucket.
+
+Requests are widened to a radius bucket before hitting Overpass, and any later
+request whose circle lies inside a cached (larger or equal) circle is answered
+locally by distance-filtering the cached elements. Entries expire after a TTL
+and the cache evicts least-recently-used entries to stay under a byte budget.
+Expired entries are kept for another POI_STALE_TTL seconds so `lookup()` can
+serve them while the caller refreshes them in the background.
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from tools import tracing
+from tools.geo import haversine_m, pois_within
+from tools.poi_record import POI
+
+POI_CACHE_TTL = float(os.getenv("POI_CACHE_TTL", 24 * 3600))
+POI_STALE_TTL = float(os.getenv("POI_STALE_TTL", 7 * 24 * 3600))
+POI_CACHE_MAX_BYTES = int(os.getenv("POI_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+GEOHASH_PRECISION = 5  # ~4.9 km x 4.9 km tiles
+RADIUS_BUCKETS = (500, 1000, 2000, 3500, 5000, 10000)
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch, lon_lo = (ch << 1) | 1, mid
+            else:
+                ch, lon_hi = ch << 1, mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch, lat_lo = (ch << 1) | 1, mid
+            else:
+                ch, lat_hi = ch << 1, mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(out)
+
+
+def _tile_size(precision: int = GEOHASH_PRECISION):
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def neighbour_tiles(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> List[str]:
+    """The tile containing (lat, lon) followed by its 8 neighbours."""
+    dlat, dlon = _tile_size(precision)
+    tiles = [geohash(lat, lon, precision)]
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dx or dy:
+                t = geohash(max(-90.0, min(90.0, lat + dy * dlat)), (lon + dx * dlon + 180.0) % 360.0 - 180.0, precision)
+                if t not in tiles:
+                    tiles.append(t)
+    return tiles
+
+
+def radius_bucket(radius: int) -> int:
+    for b in RADIUS_BUCKETS:
+        if radius <= b:
+            return b
+    return int(radius)
+
+
+class _Entry(NamedTuple):
+    lat: float
+    lon: float
+    radius: int
+    limit: int
+    results: List[POI]
+    complete: bool  # False when Overpass truncated the answer at `limit`
+    expires_at: float
+    nbytes: int
+
+
+class POICache:
+    def __init__(self, ttl: float = POI_CACHE_TTL, max_bytes: int = POI_CACHE_MAX_BYTES,
+                 stale_ttl: float = POI_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_tile: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(lat: float, lon: float, radius: int, limit: int) -> str:
+        return f"{geohash(lat, lon)}:{radius}:{limit}:{lat:.5f},{lon:.5f}"
+
+    def get(self, lat: float, lon: float, radius: int, limit: int) -> Optional[List[POI]]:
+        """Answer from any unexpired cached circle that covers (lat, lon, radius), or None."""
+        entry = self.lookup(lat, lon, radius, limit, allow_stale=False)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, lat: float, lon: float, radius: int, limit: int,
+               allow_stale: bool = True) -> Optional[Tuple[List[POI], bool]]:
+        """(results, fresh) from a cached circle covering (lat, lon, radius), or None.
+
+        Unexpired circles win; an expired one inside the stale window is used
+        (fresh=False) only when nothing fresher covers the request.
+        """
+        now = time.time()
+        with self._lock:
+            keys = [k for t in neighbour_tiles(lat, lon) for k in self._by_tile.get(t, ())]
+            # largest circles first: they are the most likely to cover the request
+            keys.sort(key=lambda k: -self._entries[k].radius)
+            stale = None
+            for key in keys:
+                e = self._entries[key]
+                if e.expires_at + self.stale_ttl <= now:
+                    self._drop(key)
+                    continue
+                fresh = e.expires_at > now
+                if not fresh and (not allow_stale or stale is not None):
+                    continue
+                if haversine_m(lat, lon, e.lat, e.lon) + radius > e.radius:
+                    continue
+                subset = pois_within(e.results, lat, lon, radius, limit)
+                # a truncated answer only covers us if it still yields `limit` matches
+                if not (e.complete or len(subset) >= limit):
+                    continue
+                if not fresh:
+                    stale = (key, subset)
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                tracing.record_cache("poi", True)
+                return subset, True
+            if stale is not None:
+                self._entries.move_to_end(stale[0])
+                self.hits += 1
+                self.stale_hits += 1
+                tracing.record_cache("poi", True, stale=True)
+                return stale[1], False
+            self.misses += 1
+            tracing.record_cache("poi", False)
+            return None
+
+    def put(self, lat: float, lon: float, radius: int, limit: int, results: List[POI], complete: bool) -> None:
+        nbytes = len(json.dumps(results, separators=(",", ":")))
+        if nbytes > self.max_bytes:
+            return
+        key = self._key(lat, lon, radius, limit)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(lat, lon, radius, limit, results, complete, time.time() + self.ttl, nbytes)
+            self._by_tile.setdefault(key.split(":", 1)[0], set()).add(key)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        e = self._entries.pop(key)
+        self.bytes -= e.nbytes
+        tile = key.split(":", 1)[0]
+        keys = self._by_tile.get(tile)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_tile[tile]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_tile.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+            }
+
+
+poi_cache = POICache()
@@ -1,39 +1,382 @@
+"""
+Points of interest around a location, from the first source that can answer:
+
+1. the offline index (tools.poi_index, when POI_INDEX_PATH is set and covers
+   the point);
+2. the POI cache (tools.poi_cache): Overpass answers kept per geohash tile and
+   radius bucket, so a smaller circle inside a cached one needs no query;
+   expired entries are served while a background refresh runs;
+3. the Overpass API. Queries ask for whole radius buckets, and the response is
+   parsed as it streams in, stopping once `limit` POIs are read.
+   fetch_pois_batch_result covers several circles with one query.
+
+Concurrent identical lookups share one fetch. The *_result functions report
+upstream failures as a FetchResult instead of an empty list.
+"""
+import asyncio
+import codecs
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
 import requests
-from typing import List, Dict, Any
 
-def fetch_pois(lat: float, lon: float, radius: int = 2000, limit: int = 8) -> List[Dict[str, Any]]:
-    """Fetch POIs using Overpass API (fallback if OpenTripMap not used)."""
+from tools import tracing, transport
+from tools.geo import pois_within
+from tools.poi_cache import poi_cache, radius_bucket
+from tools.poi_record import POI, poi_from_tags
+from tools.revalidate import revalidate
+from tools.singleflight import SingleFlight
+from tools.transport import FetchResult, UpstreamError
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+# concurrent requests for the same area share one lookup (and Overpass query)
+_flight = SingleFlight("pois")
+CHUNK_SIZE = 64 * 1024
+
+_ARRAY_START = re.compile(r'"elements"\s*:\s*\[')
+_SEPARATORS = re.compile(r"[\s,]*")
+# skips complete strings and plain characters, stopping at the next bracket or at a quote
+# that opens a string cut off by the chunk boundary
+try:
+    # possessive quantifiers (Python 3.11+) skip whole runs without backtracking
+    _TOKEN = re.compile(r'(?:"[^"\\]*+(?:\\.[^"\\]*+)*+"|[^"{}\[\]]++)*+([{}\[\]"])')
+except re.error:
+    _TOKEN = re.compile(r'(?:"[^"\\]*(?:\\.[^"\\]*)*"|[^"{}\[\]])*([{}\[\]"])')
+_NAME_KEY = re.compile(r'"name"\s*:')
+# `out count` results, which separate the per-circle blocks of a batched query
+_COUNT_TYPE = re.compile(r'"type"\s*:\s*"count"')
+
+
+def _object_end(buf: str, pos: int) -> int:
+    """Index just past the JSON object starting at buf[pos], or -1 if it is not complete yet."""
+    depth = 0
+    while True:
+        # anchored: finditer would retry a failed match from inside the last string
+        m = _TOKEN.match(buf, pos)
+        if m is None:
+            return -1
+        pos = m.end()
+        t = m.group(1)
+        if t in "{[":
+            depth += 1
+        elif t in "}]":
+            depth -= 1
+            if depth == 0:
+                return m.end()
+        elif t == '"':
+            return -1
+
+
+def _iter_elements(chunks: Iterable[bytes], stats: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+    """Decode the named objects of the top-level "elements" array as the body arrives.
+
+    Object boundaries are found with a string-aware bracket scan, so elements
+    without a name (other than `out count` results) are skipped without being
+    decoded. Only the current chunk
+    and element are held in memory. `stats` counts elements and bytes read.
+    """
+    decode = codecs.getincrementaldecoder("utf-8")().decode
+    chunks = iter(chunks)
+    buf = ""
+
+    def more() -> bool:
+        nonlocal buf
+        for chunk in chunks:
+            if chunk:
+                stats["bytes"] += len(chunk)
+                buf += decode(chunk)
+                return True
+        return False
+
+    m = _ARRAY_START.search(buf)
+    while m is None:
+        if not more():
+            raise ValueError("no elements array in the response")
+        m = _ARRAY_START.search(buf)
+    pos = m.end()
+    while True:
+        pos = _SEPARATORS.match(buf, pos).end()
+        if pos >= len(buf):
+            if not more():
+                raise ValueError("response ended inside the elements array")
+            continue
+        if buf[pos] == "]":
+            stats["complete"] = 1
+            return
+        if buf[pos] != "{":
+            raise ValueError("unexpected content in the elements array")
+        end = _object_end(buf, pos)
+        if end < 0:
+            if not more():
+                raise ValueError("response ended inside an element")
+            continue
+        stats["elements"] += 1
+        text = buf[pos:end]
+        if _NAME_KEY.search(text) or _COUNT_TYPE.search(text):
+            yield json.loads(text)
+        pos = end
+        if pos > CHUNK_SIZE:
+            buf, pos = buf[pos:], 0
+
+
+def _parse_elements(el: Iterable[Dict[str, Any]], limit: int) -> List[POI]:
+    """The first `limit` uniquely named elements; stops consuming `el` once they are found."""
+    results = []
+    seen = set()
+    for e in el:
+        tags = e.get("tags", {})
+        name = tags.get("name")
+        if not name:
+            continue
+        key = name.strip().lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        # nodes carry lat/lon, ways only the computed `center`
+        center = e.get("center") or {}
+        results.append(poi_from_tags(name, e.get("lat", center.get("lat")), e.get("lon", center.get("lon")), tags))
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _flight_key(lat: float, lon: float, radius: int, limit: int) -> tuple:
+    return (round(lat, 6), round(lon, 6), int(radius), int(limit))
+
+
+def _local_pois(lat: float, lon: float, radius: int, limit: int, sp: Any = None) -> Optional[List[POI]]:
+    """Results from the offline index or the POI cache, or None if Overpass must answer.
+
+    `sp` (the fetch span) is told where the answer came from.
+    """
+    from tools.poi_index import get_index  # lazy: keeps `python -m tools.poi_index` warning-free
+
+    index = get_index()
+    if index is not None and index.covers(lat, lon):
+        results = index.query(lat, lon, radius, limit)
+        if results:
+            if sp is not None:
+                sp.set(source="index", count=len(results))
+            return results
+    entry = poi_cache.lookup(lat, lon, radius, limit)
+    if entry is None:
+        return None
+    cached, fresh = entry
+    if not fresh:
+        bucket = radius_bucket(radius)
+        revalidate("poi", _flight_key(lat, lon, bucket, limit), _refresh, lat, lon, bucket, limit)
+    if sp is not None:
+        sp.set(source="cache", count=len(cached), stale=not fresh)
+    return cached
+
+
+def _bucket_subset(lat: float, lon: float, radius: int, limit: int, bucket: int,
+                   results: List[POI], complete: bool, sp: Any = None) -> FetchResult:
+    """The POIs of our circle out of an answer for its whole radius bucket.
+
+    A truncated bucket answer can run out of its `limit` POIs before the
+    smaller circle inside it has its share; then the circle is queried alone.
+    """
+    out = pois_within(results, lat, lon, radius, limit)
+    if complete or len(out) >= limit or bucket <= radius:
+        return FetchResult(out)
+    if sp is not None:
+        sp.set(refetched=True)
+    res = _fetch_pois_overpass(lat, lon, radius, limit)
+    if not res.ok:
+        return FetchResult(out, res.error)
+    poi_cache.put(lat, lon, radius, limit, *res.value)
+    return FetchResult(pois_within(res.value[0], lat, lon, radius, limit))
+
+
+def _fetch_pois_result(lat: float, lon: float, radius: int, limit: int) -> FetchResult:
+    sp = tracing.current_span().set(radius=radius, limit=limit)
+    local = _local_pois(lat, lon, radius, limit, sp)
+    if local is not None:
+        return FetchResult(local)
+    # query the whole radius bucket so neighbouring radii can reuse this answer
+    bucket = radius_bucket(radius)
+    res = _fetch_pois_overpass(lat, lon, bucket, limit)
+    if res.ok:
+        results, complete = res.value
+        poi_cache.put(lat, lon, bucket, limit, results, complete)
+        out = _bucket_subset(lat, lon, radius, limit, bucket, results, complete, sp)
+        sp.set(source="overpass", fetched=len(results), count=len(out.value))
+        return out
+    sp.set(source="overpass", error=res.error.kind)
+    return FetchResult([], res.error)
+
+
+def _refresh(lat: float, lon: float, radius: int, limit: int) -> bool:
+    res = _fetch_pois_overpass(lat, lon, radius, limit)
+    if not res.ok:
+        return False
+    poi_cache.put(lat, lon, radius, limit, *res.value)
+    return True
+
+
+@tracing.traced("pois")
+def fetch_pois_result(lat: float, lon: float, radius: int = 2000, limit: int = 8) -> FetchResult:
+    """Fetch POIs from the local index (POI_INDEX_PATH) or Overpass API, reporting upstream failures."""
+    return _flight.do(_flight_key(lat, lon, radius, limit), _fetch_pois_result, lat, lon, radius, limit)
+
+
+def _area_set(lat: float, lon: float, radius: int, name: str) -> str:
+    """Overpass statement collecting the named features of one circle into set `.name`."""
+    return f"""
+    (
+      nw(around:{radius},{lat},{lon})["tourism"]["name"];
+      nw(around:{radius},{lat},{lon})["historic"]["name"];
+      nw(around:{radius},{lat},{lon})["leisure"]["name"];
+      nw(around:{radius},{lat},{lon})["amenity"~"^(museum|theatre|gallery|marketplace|park)$"]["name"];
+    )->.{name};"""
+
+
+def _fetch_pois_overpass(lat: float, lon: float, radius: int, limit: int) -> FetchResult:
+    """Overpass query; `.value` is (results, complete) where complete=False means truncated at `limit`."""
+    # named features only; nodes come with their coordinates, ways with just tags and centre
+    # (no node lists), so the answer carries nothing the parser would throw away
+    query = f"""
+    [out:json][timeout:15];{_area_set(lat, lon, radius, "pois")}
+    node.pois;
+    out body {limit};
+    way.pois;
+    out tags center {limit};
+    """
+    try:
+        r = transport.post(OVERPASS_URL, data=query.encode("utf-8"), timeout=20, stream=True)
+    except UpstreamError as e:
+        return FetchResult(None, e)
+    stats = {"elements": 0, "bytes": 0, "complete": 0}
+    try:
+        # stop reading as soon as `limit` unique POIs are in; closing drops the rest of the body
+        results = _parse_elements(_iter_elements(r.iter_content(CHUNK_SIZE), stats), limit)
+    except ValueError:
+        return FetchResult(None, UpstreamError("bad_response", transport.host_of(OVERPASS_URL)))
+    except requests.RequestException as e:
+        # the connection broke while the body was streaming
+        return FetchResult(None, UpstreamError("unavailable", transport.host_of(OVERPASS_URL),
+                                               message=e.__class__.__name__))
+    finally:
+        r.close()
+    tracing.current_span().set(bytes_read=stats["bytes"], elements=stats["elements"],
+                               stopped_early=not stats["complete"])
+    complete = bool(stats["complete"]) and stats["elements"] < limit and len(results) < limit
+    return FetchResult((results, complete))
+
+
+def _fetch_pois_overpass_many(areas: Sequence[Tuple[float, float, int, int]]) -> FetchResult:
+    """One Overpass query for several (lat, lon, radius, limit) circles.
+
+    `.value` is one (results, complete) pair per circle. Each circle's block
+    starts with an `out count` result, which marks where its elements begin
+    and tells whether its `limit` cut anything off.
+    """
+    blocks = "".join(f"""{_area_set(lat, lon, radius, f"leg{i}")}
+    .leg{i} out count;
+    node.leg{i};
+    out body {limit};
+    way.leg{i};
+    out tags center {limit};""" for i, (lat, lon, radius, limit) in enumerate(areas))
+    query = f"""
+    [out:json][timeout:25];{blocks}
+    """
+    try:
+        r = transport.post(OVERPASS_URL, data=query.encode("utf-8"), timeout=30, stream=True)
+    except UpstreamError as e:
+        return FetchResult(None, e)
+    stats = {"elements": 0, "bytes": 0, "complete": 0}
+    legs: List[List[Dict[str, Any]]] = []
+    counts: List[Dict[str, Any]] = []
     try:
-        query = f"""
-        [out:json][timeout:15];
-        (
-          node(around:{radius},{lat},{lon})["tourism"];
-          way(around:{radius},{lat},{lon})["tourism"];
-          node(around:{radius},{lat},{lon})["historic"];
-          way(around:{radius},{lat},{lon})["historic"];
-          node(around:{radius},{lat},{lon})["leisure"];
-          way(around:{radius},{lat},{lon})["leisure"];
-          node(around:{radius},{lat},{lon})["amenity"~"museum|theatre|gallery|marketplace|park"];
-        );
-        out center {limit};
-        """
-        r = requests.post("https://overpass-api.de/api/interpreter", data=query.encode("utf-8"), timeout=20)
-        r.raise_for_status()
-        el = r.json().get("elements", [])
-        results = []
-        seen = set()
-        for e in el:
-            tags = e.get("tags", {})
-            name = tags.get("name")
-            if not name:
-                continue
-            key = name.strip().lower()
-            if key in seen:
-                continue
-            seen.add(key)
-            results.append({"name": name, "tags": tags})
-            if len(results) >= limit:
-                break
-        return results
-    except Exception:
-        return []
+        for e in _iter_elements(r.iter_content(CHUNK_SIZE), stats):
+            if e.get("type") == "count":
+                counts.append(e.get("tags") or {})
+                legs.append([])
+            elif legs:
+                legs[-1].append(e)
+            else:
+                raise ValueError("element before the first count")
+        if len(legs) != len(areas):
+            raise ValueError(f"{len(legs)} blocks for {len(areas)} areas")
+    except ValueError:
+        return FetchResult(None, UpstreamError("bad_response", transport.host_of(OVERPASS_URL)))
+    except requests.RequestException as e:
+        return FetchResult(None, UpstreamError("unavailable", transport.host_of(OVERPASS_URL),
+                                               message=e.__class__.__name__))
+    finally:
+        r.close()
+    tracing.current_span().set(bytes_read=stats["bytes"], elements=stats["elements"], areas=len(areas))
+    out = []
+    for (_, _, _, limit), elements, count in zip(areas, legs, counts):
+        results = _parse_elements(elements, limit)
+        try:
+            cut = int(count.get("nodes", 0)) > limit or int(count.get("ways", 0)) > limit
+        except (TypeError, ValueError):
+            cut = True
+        out.append((results, not cut and len(results) < limit))
+    return FetchResult(out)
+
+
+def _fetch_pois_batch(areas: Sequence[Tuple[float, float, int, int]]) -> List[FetchResult]:
+    sp = tracing.current_span().set(areas=len(areas))
+    out: List[Optional[FetchResult]] = [None] * len(areas)
+    todo: Dict[Tuple[float, float, int, int], List[int]] = {}
+    for i, (lat, lon, radius, limit) in enumerate(areas):
+        local = _local_pois(lat, lon, radius, limit)
+        if local is not None:
+            out[i] = FetchResult(local)
+        else:
+            # whole radius buckets, as in fetch_pois_result; identical circles are queried once
+            todo.setdefault((lat, lon, radius_bucket(radius), limit), []).append(i)
+    sp.set(local=len(areas) - sum(len(v) for v in todo.values()), fetched_areas=len(todo))
+    if len(todo) == 1:
+        # a single circle keeps the streaming early stop of the plain query
+        res = _fetch_pois_overpass(*next(iter(todo)))
+        res = FetchResult([res.value], None) if res.ok else res
+    elif todo:
+        res = _fetch_pois_overpass_many(list(todo))
+    for k, (area, idx) in enumerate(todo.items()):
+        if not res.ok:
+            for i in idx:
+                out[i] = FetchResult([], res.error)
+            continue
+        results, complete = res.value[k]
+        poi_cache.put(*area, results, complete)
+        for i in idx:
+            out[i] = _bucket_subset(*areas[i], area[2], results, complete)
+    return out
+
+
+@tracing.traced("pois_batch")
+def fetch_pois_batch_result(areas: Sequence[Tuple[float, float, int, int]]) -> List[FetchResult]:
+    """fetch_pois_result for several (lat, lon, radius, limit) areas, e.g. the legs of a multi-city trip.
+
+    Areas the index or the cache can answer are served locally; all the
+    others share a single Overpass query, whose answer is split back per
+    area (and cached per area like a single-area fetch).
+    """
+    return _fetch_pois_batch(areas)
+
+
+async def afetch_pois_batch_result(areas: Sequence[Tuple[float, float, int, int]]) -> List[FetchResult]:
+    """Async fetch_pois_batch_result (runs on a worker thread)."""
+    return await asyncio.to_thread(fetch_pois_batch_result, areas)
+
+
+def fetch_pois(lat: float, lon: float, radius: int = 2000, limit: int = 8) -> List[POI]:
+    """Fetch POIs from the local index, the cache or Overpass (see fetch_pois_result)."""
+    return fetch_pois_result(lat, lon, radius=radius, limit=limit).value
+
+
+@tracing.traced("pois")
+async def afetch_pois_result(lat: float, lon: float, radius: int = 2000, limit: int = 8) -> FetchResult:
+    """Async fetch_pois_result (runs on a worker thread; shares the pooled transport and in-flight calls)."""
+    return await _flight.ado(_flight_key(lat, lon, radius, limit), _fetch_pois_result, lat, lon, radius, limit)
+
+
+async def afetch_pois(lat: float, lon: float, radius: int = 2000, limit: int = 8) -> List[POI]:
+    """Async fetch_pois."""
+    return (await afetch_pois_result(lat, lon, radius=radius, limit=limit)).value
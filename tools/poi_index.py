@@ -0,0 +1,325 @@
+"""
+Offline POI index built from a local OpenStreetMap extract.
+
+Build once from an OSM XML (.osm/.xml), PBF (.pbf, needs the optional `osmium`
+package) or GeoJSON extract:
+
+    python -m tools.poi_index build hyderabad.osm.pbf data/pois.idx
+
+then point the app at it with `POI_INDEX_PATH=data/pois.idx`. `fetch_pois`
+answers radius queries from the index (deterministic nearest-first order) and
+only falls back to Overpass outside the indexed area.
+
+Only the features the Overpass query selects are kept (named tourism / historic
+/ leisure, plus amenity=museum|theatre|gallery|marketplace|park), with the tags
+tools.poi_record reads; rebuild the index after changing POI_SALIENT_TAGS. The
+file is a fixed-cell lat/lon grid and is memory-mapped, so opening it is O(1)
+and a query touches only the handful of cells its circle overlaps.
+
+File layout (little-endian):
+    header   "<8sdIIdddd"  magic, cell_deg, n_cells, n_records, min_lat, min_lon, max_lat, max_lon
+    keys     n_cells x int64           sorted cell keys
+    cells    n_cells x "<II"           (first record, record count)
+    records  n_records x "<ddII"       (lat, lon, blob offset, blob length), grouped by cell
+    blob     utf-8 JSON {"name", "tags"} per record
+"""
+from __future__ import annotations
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tools.geo import haversine_m
+from tools.poi_record import POI, POI_CATEGORY_KEYS, POI_SALIENT_TAGS, poi_from_tags
+
+MAGIC = b"POIIDX01"
+HEADER = struct.Struct("<8sdIIdddd")
+CELL = struct.Struct("<II")
+RECORD = struct.Struct("<ddII")
+DEFAULT_CELL_DEG = 0.01  # ~1.1 km of latitude
+
+AMENITY_VALUES = {"museum", "theatre", "gallery", "marketplace", "park"}
+# every tag poi_from_tags reads, so an index POI equals the Overpass one (as of the
+# POI_SALIENT_TAGS in effect when the index is built)
+SALIENT_TAGS = tuple(dict.fromkeys(("name",) + POI_CATEGORY_KEYS + ("indoor",) + POI_SALIENT_TAGS))
+_OFFSET = 1 << 20
+
+
+def select_category(tags: Dict[str, str]) -> Optional[str]:
+    """Category for a feature the Overpass query would return, or None to drop it."""
+    if not tags.get("name"):
+        return None
+    for key in ("tourism", "historic", "leisure"):
+        if tags.get(key):
+            return key
+    if tags.get("amenity") in AMENITY_VALUES:
+        return "amenity"
+    return None
+
+
+def _cell_key(iy: int, ix: int) -> int:
+    return ((iy + _OFFSET) << 21) | (ix + _OFFSET)
+
+
+# --- readers -----------------------------------------------------------------
+Feature = Tuple[float, float, Dict[str, str]]
+
+
+def _centroid(coords: Iterable[Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+    n = 0
+    slat = slon = 0.0
+    for lat, lon in coords:
+        slat += lat
+        slon += lon
+        n += 1
+    return (slat / n, slon / n) if n else None
+
+
+def read_geojson(path: str) -> Iterator[Feature]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for feat in data.get("features", []):
+        tags = {k: str(v) for k, v in (feat.get("properties") or {}).items() if v is not None}
+        geom = feat.get("geometry") or {}
+        pts: List[Tuple[float, float]] = []
+
+        def walk(c):
+            if c and isinstance(c[0], (int, float)):
+                pts.append((float(c[1]), float(c[0])))
+            else:
+                for sub in c or []:
+                    walk(sub)
+        walk(geom.get("coordinates"))
+        c = _centroid(pts)
+        if c:
+            yield c[0], c[1], tags
+
+
+def read_osm_xml(path: str) -> Iterator[Feature]:
+    import xml.etree.ElementTree as ET
+
+    nodes: Dict[int, Tuple[float, float]] = {}
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "node":
+            lat, lon = float(el.get("lat")), float(el.get("lon"))
+            nodes[int(el.get("id"))] = (lat, lon)
+            tags = {t.get("k"): t.get("v") for t in el.iter("tag")}
+            if tags:
+                yield lat, lon, tags
+            el.clear()
+        elif el.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in el.iter("tag")}
+            if select_category(tags):
+                c = _centroid(nodes[int(nd.get("ref"))] for nd in el.iter("nd") if int(nd.get("ref")) in nodes)
+                if c:
+                    yield c[0], c[1], tags
+            el.clear()
+
+
+def read_osm_pbf(path: str) -> Iterator[Feature]:
+    try:
+        import osmium  # optional dependency, only needed for .pbf extracts
+    except ImportError as e:
+        raise ImportError("Reading .pbf extracts requires the 'osmium' package (pip install osmium).") from e
+
+    out: List[Feature] = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if select_category(tags):
+                out.append((n.location.lat, n.location.lon, tags))
+
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if select_category(tags):
+                c = _centroid((nd.lat, nd.lon) for nd in w.nodes if nd.location.valid())
+                if c:
+                    out.append((c[0], c[1], tags))
+
+    Handler().apply_file(path, locations=True)
+    return iter(out)
+
+
+def read_extract(path: str) -> Iterator[Feature]:
+    lower = path.lower()
+    if lower.endswith(".pbf"):
+        return read_osm_pbf(path)
+    if lower.endswith((".geojson", ".json")):
+        return read_geojson(path)
+    return read_osm_xml(path)
+
+
+# --- build -------------------------------------------------------------------
+def build_index(features: Iterable[Feature], out_path: str, cell_deg: float = DEFAULT_CELL_DEG) -> int:
+    """Write the index file. Returns the number of records kept."""
+    cells: Dict[int, List[Tuple[float, float, bytes]]] = {}
+    min_lat = min_lon = math.inf
+    max_lat = max_lon = -math.inf
+    seen = set()
+    for lat, lon, tags in features:
+        if not select_category(tags):
+            continue
+        dedupe = (tags["name"].strip().lower(), round(lat, 5), round(lon, 5))
+        if dedupe in seen:
+            continue
+        seen.add(dedupe)
+        blob = json.dumps(
+            {"name": tags["name"], "tags": {k: tags[k] for k in SALIENT_TAGS if k in tags}},
+            ensure_ascii=False, separators=(",", ":"),
+        ).encode("utf-8")
+        key = _cell_key(math.floor(lat / cell_deg), math.floor(lon / cell_deg))
+        cells.setdefault(key, []).append((lat, lon, blob))
+        min_lat, min_lon = min(min_lat, lat), min(min_lon, lon)
+        max_lat, max_lon = max(max_lat, lat), max(max_lon, lon)
+
+    keys = sorted(cells)
+    n_records = sum(len(v) for v in cells.values())
+    if not n_records:
+        min_lat = min_lon = max_lat = max_lon = 0.0
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, cell_deg, len(keys), n_records, min_lat, min_lon, max_lat, max_lon))
+        f.write(struct.pack(f"<{len(keys)}q", *keys))
+        start = 0
+        for k in keys:
+            f.write(CELL.pack(start, len(cells[k])))
+            start += len(cells[k])
+        blob_off = 0
+        for k in keys:
+            for lat, lon, blob in cells[k]:
+                f.write(RECORD.pack(lat, lon, blob_off, len(blob)))
+                blob_off += len(blob)
+        for k in keys:
+            for _, _, blob in cells[k]:
+                f.write(blob)
+    os.replace(tmp, out_path)
+    return n_records
+
+
+# --- query -------------------------------------------------------------------
+class POIIndex:
+    """Read-only, memory-mapped view of an index file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.cell_deg, self.n_cells, self.n_records,
+         self.min_lat, self.min_lon, self.max_lat, self.max_lon) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a POI index file")
+        off = HEADER.size
+        self._keys = memoryview(self._mm)[off:off + 8 * self.n_cells].cast("q")
+        self._cells_off = off + 8 * self.n_cells
+        self._records_off = self._cells_off + CELL.size * self.n_cells
+        self._blob_off = self._records_off + RECORD.size * self.n_records
+
+    def covers(self, lat: float, lon: float) -> bool:
+        return self.n_records > 0 and self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon
+
+    def _records_in_cell(self, key: int) -> Iterator[Tuple[float, float, int, int]]:
+        i = bisect_left(self._keys, key)
+        if i >= self.n_cells or self._keys[i] != key:
+            return
+        start, count = CELL.unpack_from(self._mm, self._cells_off + CELL.size * i)
+        for r in range(start, start + count):
+            yield RECORD.unpack_from(self._mm, self._records_off + RECORD.size * r)
+
+    def query(self, lat: float, lon: float, radius: float, limit: int) -> List[POI]:
+        """POIs within `radius` metres, nearest first, unique by name."""
+        dlat = radius / 111320.0
+        dlon = radius / max(1e-6, 111320.0 * math.cos(math.radians(lat)))
+        y0, y1 = math.floor((lat - dlat) / self.cell_deg), math.floor((lat + dlat) / self.cell_deg)
+        x0, x1 = math.floor((lon - dlon) / self.cell_deg), math.floor((lon + dlon) / self.cell_deg)
+        hits = []
+        for iy in range(y0, y1 + 1):
+            for ix in range(x0, x1 + 1):
+                for plat, plon, boff, blen in self._records_in_cell(_cell_key(iy, ix)):
+                    d = haversine_m(lat, lon, plat, plon)
+                    if d <= radius:
+                        hits.append((d, plat, plon, boff, blen))
+        # blob offsets are unique and fixed per file, so they make a stable tie-breaker;
+        # only the records that can make the cut are decoded
+        hits.sort(key=lambda t: (t[0], t[3]))
+        results = []
+        seen = set()
+        for d, plat, plon, boff, blen in hits:
+            rec = json.loads(self._mm[self._blob_off + boff:self._blob_off + boff + blen])
+            name, tags = rec["name"], rec["tags"]
+            key = name.strip().lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(poi_from_tags(name, plat, plon, tags))
+            if len(results) >= limit:
+                break
+        return results
+
+    def close(self) -> None:
+        self._keys.release()
+        self._mm.close()
+        self._f.close()
+
+
+_index: Optional[POIIndex] = None
+_index_path: Optional[str] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> Optional[POIIndex]:
+    """The index named by POI_INDEX_PATH, opened once per process (None if unset/missing)."""
+    global _index, _index_path
+    path = os.getenv("POI_INDEX_PATH")
+    if not path or not os.path.exists(path):
+        return None
+    with _index_lock:
+        if _index is None or _index_path != path:
+            try:
+                _index = POIIndex(path)
+                _index_path = path
+            except (OSError, ValueError):
+                _index = None
+        return _index
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tools.poi_index", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build an index from an OSM/GeoJSON extract")
+    b.add_argument("extract")
+    b.add_argument("output")
+    b.add_argument("--cell-deg", type=float, default=DEFAULT_CELL_DEG)
+    q = sub.add_parser("query", help="run a radius query against an index")
+    q.add_argument("index")
+    q.add_argument("lat", type=float)
+    q.add_argument("lon", type=float)
+    q.add_argument("--radius", type=int, default=2000)
+    q.add_argument("--limit", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        n = build_index(read_extract(args.extract), args.output, cell_deg=args.cell_deg)
+        print(f"Indexed {n} POIs into {args.output} in {time.perf_counter() - t0:.1f}s")
+        return 0
+    idx = POIIndex(args.index)
+    t0 = time.perf_counter()
+    res = idx.query(args.lat, args.lon, args.radius, args.limit)
+    ms = (time.perf_counter() - t0) * 1000
+    for p in res:
+        print(f"{p.name}\t{p.lat:.5f},{p.lon:.5f}\t{p.category}")
+    print(f"{len(res)} results in {ms:.2f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
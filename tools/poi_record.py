@@ -0,0 +1,40 @@
+"""
+Compact POI record shared by the Overpass parser, the offline index and the caches.
+
+Raw OSM tag dicts carry wikidata ids, addresses and other noise that is
+useless to the planner (and expensive once rendered into a prompt). Each
+feature is boiled down while it is parsed: name, position, one category, an
+indoor flag for rainy days, and a few salient tags.
+"""
+from __future__ import annotations
+import os
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# category values that keep visitors out of the rain
+INDOOR_CATEGORIES = {"museum", "gallery", "theatre", "cinema", "library", "aquarium", "arts_centre",
+                     "planetarium", "zoo_house", "shopping_centre", "marketplace"}
+POI_SALIENT_TAGS = tuple(t for t in os.getenv("POI_SALIENT_TAGS", "opening_hours,fee").split(",") if t)
+# OSM keys a POI's category is read from, in order of precedence
+POI_CATEGORY_KEYS = ("tourism", "historic", "leisure", "amenity")
+
+
+class POI(NamedTuple):
+    name: str
+    lat: Optional[float]
+    lon: Optional[float]
+    category: str                       # "museum", "park", "castle", ...
+    indoor: bool
+    tags: Tuple[Tuple[str, str], ...]   # (key, value) pairs from POI_SALIENT_TAGS
+
+
+def poi_from_tags(name: str, lat: Optional[float], lon: Optional[float], tags: Dict[str, str]) -> POI:
+    category = ""
+    for key in POI_CATEGORY_KEYS:
+        value = tags.get(key)
+        if value:
+            # e.g. tourism=museum -> "museum", historic=yes -> "historic"
+            category = key if value == "yes" else value
+            break
+    indoor = category in INDOOR_CATEGORIES or tags.get("indoor") == "yes"
+    salient = tuple((k, str(tags[k])) for k in POI_SALIENT_TAGS if tags.get(k))
+    return POI(name, lat, lon, category, indoor, salient)
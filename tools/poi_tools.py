@@ -1,17 +1,40 @@
-from tools.geocode import geocode_city
-from tools.poi_fetcher import fetch_pois
+from tools import tracing
+from tools.aio import run_sync
+from tools.budget import TOOL_OUTPUT_TOKENS, estimate_tokens, fit_lines
+from tools.fetch_context import get_context
+from tools.transport import failure_note
 
-def poi_tool(city: str, radius: int = 2000, limit: int = 8) -> str:
+
+def _describe(p) -> str:
+    parts = [p.category or "place"]
+    if p.indoor:
+        parts.append("indoor")
+    parts.extend(f"{k}: {v}" for k, v in p.tags)
+    return ", ".join(parts)
+
+
+def format_pois(g: dict, pois: list, ctx) -> str:
+    """poi_tool's answer for a list of POIs near the geocoded city `g`."""
+    if not pois:
+        return f"WARNING: No POIs found for {g['name']}{failure_note(ctx.errors.get('pois'))}."
+
+    header = f"Top {len(pois)} POIs near {g['name']}:"
+    lines = [f"{i+1}. {p.name} ({_describe(p)})" for i, p in enumerate(pois)]
+    return "\n".join([header] + fit_lines(lines, TOOL_OUTPUT_TOKENS - estimate_tokens(header)))
+
+
+@tracing.traced_tool("poi_tool")
+async def apoi_tool(city: str, radius: int = 2000, limit: int = 8) -> str:
     """Return POIs near a city. Args: city (str), radius (int meters), limit (int)."""
-    g = geocode_city(city)
+    ctx = get_context()
+    g = await ctx.ageocode(city)
     if g is None:
-        return f"ERROR: Could not geocode '{city}'."
-    
-    pois = fetch_pois(g["lat"], g["lon"], radius=radius, limit=limit)
-    if not pois:
-        return f"WARNING: No POIs found for {g['name']}."
-    
-    lines = [f"Top {len(pois)} POIs near {g['name']}:"] + [
-        f"{i+1}. {p['name']} ({p.get('tags', {})})" for i, p in enumerate(pois)
-    ]
-    return "\n".join(lines)
+        return f"ERROR: Could not geocode '{city}'{failure_note(ctx.errors.get('geocode'))}."
+
+    pois = await ctx.apois(g["lat"], g["lon"], radius=radius, limit=limit)
+    return format_pois(g, pois, ctx)
+
+
+def poi_tool(city: str, radius: int = 2000, limit: int = 8) -> str:
+    """Return POIs near a city. Args: city (str), radius (int meters), limit (int)."""
+    return run_sync(apoi_tool(city, radius, limit))
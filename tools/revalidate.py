@@ -0,0 +1,91 @@
+"""
+Background refresh for stale-while-revalidate caches.
+
+When a fetcher finds an entry that has expired but is still inside its
+stale window, it answers with the old value at once and hands the refresh
+to `revalidate()`. Refreshes run on one small shared pool of
+REFRESH_CONCURRENCY threads, so a burst of stale hits turns into a trickle
+of upstream requests (the transport's per-host rate limits still apply on
+top). A key that is already queued or running is not queued again, and
+once REFRESH_MAX_PENDING refreshes are waiting new ones are dropped: the
+entry simply stays stale and the next hit asks again.
+
+    if not fresh:
+        revalidate("geocode", key, _refresh_geocode, key, city)
+
+A refresh function returns True when it stored a new value. Refreshes run
+in an empty context, so their spans never land on the trace of the request
+that happened to trigger them.
+"""
+from __future__ import annotations
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+from tools import tracing
+
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", 2))
+REFRESH_MAX_PENDING = int(os.getenv("REFRESH_MAX_PENDING", 256))
+
+log = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: Set[Hashable] = set()
+_cond = threading.Condition()
+_stats = {"scheduled": 0, "ok": 0, "error": 0, "dropped": 0}
+
+
+def revalidate(cache: str, key: Hashable, fn: Callable[..., Any], *args: Any) -> bool:
+    """Run fn(*args) in the background to refresh `key` of `cache`. False if it was not scheduled."""
+    global _executor
+    k = (cache, key)
+    with _cond:
+        if k in _pending:
+            return False
+        if len(_pending) >= REFRESH_MAX_PENDING:
+            _stats["dropped"] += 1
+            tracing.record_refresh(cache, "dropped")
+            return False
+        _pending.add(k)
+        _stats["scheduled"] += 1
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=REFRESH_CONCURRENCY, thread_name_prefix="revalidate")
+        executor = _executor
+    executor.submit(contextvars.Context().run, _run, cache, k, fn, args)
+    return True
+
+
+def _run(cache: str, k: Hashable, fn: Callable[..., Any], args: tuple) -> None:
+    outcome = "error"
+    try:
+        if fn(*args):
+            outcome = "ok"
+    except Exception:
+        log.exception("background refresh of %s %r failed", cache, k[1])
+    finally:
+        with _cond:
+            _pending.discard(k)
+            _stats[outcome] += 1
+            _cond.notify_all()
+    tracing.record_refresh(cache, outcome)
+
+
+def drain(timeout: Optional[float] = None) -> bool:
+    """Wait until no refresh is queued or running. False if `timeout` ran out first."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _cond:
+        while _pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            _cond.wait(remaining)
+    return True
+
+
+def revalidate_stats() -> Dict[str, int]:
+    with _cond:
+        return dict(_stats, pending=len(_pending), concurrency=REFRESH_CONCURRENCY)
@@ -0,0 +1,211 @@
+"""
+Geographic day scheduler for itineraries.
+
+Splits a POI pool into one compact group per day and orders each group as a
+short walking route:
+
+1. give every day a quota: the stops are spread as evenly as daily_limit
+   allows, with rainy days first taking up to daily_limit indoor POIs
+2. project POIs to a local metric plane; a capacitated k-means groups the
+   indoor POIs over the rainy days, then the rest over the dry days; a rainy
+   day left short of indoor places takes the nearest leftovers
+3. order each day with nearest-neighbour from the stop closest to the city
+   centre, then improve the open path with 2-opt on a haversine distance matrix
+
+Everything is vectorized with NumPy, so thousands of candidates over multi-week
+trips schedule in milliseconds.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from tools.geo import EARTH_RADIUS_M
+
+MAX_ITERATIONS = 12
+
+
+class DayPlan(NamedTuple):
+    stops: List[Dict[str, Any]]  # POIs in visiting order
+    distance_m: float            # walking distance along the route
+
+
+def haversine_matrix(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Pairwise great-circle distances in metres."""
+    p = np.radians(lat)[:, None]
+    q = np.radians(lat)[None, :]
+    dl = np.radians(lon)[None, :] - np.radians(lon)[:, None]
+    a = np.sin((q - p) / 2) ** 2 + np.cos(p) * np.cos(q) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _project(lat: np.ndarray, lon: np.ndarray, lat0: float, lon0: float) -> np.ndarray:
+    # equirectangular projection: accurate to well under 1% across a city
+    x = np.radians(lon - lon0) * np.cos(np.radians(lat0)) * EARTH_RADIUS_M
+    y = np.radians(lat - lat0) * EARTH_RADIUS_M
+    return np.column_stack([x, y])
+
+
+def _init_centroids(xy: np.ndarray, k: int) -> np.ndarray:
+    """Deterministic farthest-point seeding, starting from the point nearest the pool's mean."""
+    first = int(np.argmin(np.linalg.norm(xy - xy.mean(axis=0), axis=1)))
+    chosen = [first]
+    d = np.linalg.norm(xy - xy[first], axis=1)
+    for _ in range(1, k):
+        nxt = int(np.argmax(d))
+        chosen.append(nxt)
+        d = np.minimum(d, np.linalg.norm(xy - xy[nxt], axis=1))
+    return xy[chosen].copy()
+
+
+def _assign(cost: np.ndarray, capacity: np.ndarray, total: int) -> np.ndarray:
+    """Greedy capacitated assignment: cheapest (poi, day) pairs first. -1 = unassigned."""
+    n, k = cost.shape
+    labels = np.full(n, -1, dtype=np.int64)
+    room = np.array(capacity, dtype=np.int64)
+    # A day can only end up with points among its `total` cheapest ones (anything it
+    # skips was placed elsewhere, and at most `total` points are placed), so only
+    # those k * total pairs need sorting instead of all n * k.
+    m = min(total, n)
+    rows = np.argpartition(cost, m - 1, axis=0)[:m] if m < n else np.tile(np.arange(n)[:, None], (1, k))
+    cols = np.broadcast_to(np.arange(k), rows.shape)
+    pair_cost = cost[rows, cols].ravel()
+    pair_rows, pair_cols = rows.ravel(), cols.ravel()
+    placed = 0
+    for p in np.argsort(pair_cost, kind="stable"):
+        i, j = int(pair_rows[p]), int(pair_cols[p])
+        if labels[i] >= 0 or room[j] == 0:
+            continue
+        labels[i] = j
+        room[j] -= 1
+        placed += 1
+        if placed >= total:
+            break
+    return labels
+
+
+def _fill(counts: np.ndarray, caps: np.ndarray, total: int) -> np.ndarray:
+    """Add `total` stops to `counts`, one at a time to the emptiest day with room (earliest on ties)."""
+    counts = counts.copy()
+    for _ in range(min(total, int((caps - counts).sum()))):
+        j = int(np.argmin(np.where(counts < caps, counts, np.iinfo(np.int64).max)))
+        counts[j] += 1
+    return counts
+
+
+def _cluster(xy: np.ndarray, quotas: np.ndarray) -> np.ndarray:
+    """Capacitated k-means: label rows with days so day j gets quotas[j] of them (-1 = left over).
+
+    The quotas must not add up to more than len(xy).
+    """
+    days = np.where(quotas > 0)[0]
+    labels = np.full(len(xy), -1, dtype=np.int64)
+    if days.size == 0 or len(xy) == 0:
+        return labels
+    caps = quotas[days]
+    total = min(int(caps.sum()), len(xy))
+    centroids = _init_centroids(xy, days.size)
+    for _ in range(MAX_ITERATIONS):
+        dist = np.linalg.norm(xy[:, None, :] - centroids[None, :, :], axis=2)
+        new = _assign(dist, caps, total)
+        if np.array_equal(new, labels):
+            break
+        labels = new
+        for j in range(days.size):
+            members = labels == j
+            if members.any():
+                centroids[j] = xy[members].mean(axis=0)
+    return np.where(labels >= 0, days[np.maximum(labels, 0)], -1)
+
+
+def _route(dist: np.ndarray, start: int) -> List[int]:
+    """Nearest-neighbour path from `start`, improved with 2-opt (open path)."""
+    n = dist.shape[0]
+    order = [start]
+    left = np.ones(n, dtype=bool)
+    left[start] = False
+    while left.any():
+        cand = np.where(left)[0]
+        nxt = int(cand[np.argmin(dist[order[-1], cand])])
+        order.append(nxt)
+        left[nxt] = False
+    improved = True
+    while improved and n > 3:
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b = order[i - 1], order[i]
+                c = order[j]
+                d_ = order[j + 1] if j + 1 < n else None
+                before = dist[a, b] + (dist[c, d_] if d_ is not None else 0.0)
+                after = dist[a, c] + (dist[b, d_] if d_ is not None else 0.0)
+                if after + 1e-9 < before:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+    return order
+
+
+def schedule_days(pool: Sequence[Dict[str, Any]], num_days: int, daily_limit: int,
+                  rainy: Sequence[bool], center: Optional[Sequence[float]] = None) -> List[DayPlan]:
+    """Assign POIs (dicts with name, lat, lon, is_indoor) to days and order each day.
+
+    POIs without coordinates are treated as being at the centre. Returns one
+    DayPlan per day; a day can hold fewer than `daily_limit` stops if the pool
+    runs out.
+    """
+    if num_days <= 0:
+        return []
+    if not pool or daily_limit <= 0:
+        return [DayPlan([], 0.0) for _ in range(num_days)]
+
+    lat0, lon0 = (center[0], center[1]) if center else (None, None)
+    have = [p for p in pool if p.get("lat") is not None and p.get("lon") is not None]
+    if lat0 is None:
+        lat0 = float(np.mean([p["lat"] for p in have])) if have else 0.0
+        lon0 = float(np.mean([p["lon"] for p in have])) if have else 0.0
+    lat = np.array([p["lat"] if p.get("lat") is not None else lat0 for p in pool], dtype=float)
+    lon = np.array([p["lon"] if p.get("lon") is not None else lon0 for p in pool], dtype=float)
+    indoor = np.array([bool(p.get("is_indoor")) for p in pool])
+    rain = np.array([bool(rainy[d]) if d < len(rainy) else False for d in range(num_days)])
+
+    xy = _project(lat, lon, lat0, lon0)
+    limits = np.full(num_days, daily_limit, dtype=np.int64)
+    total = min(len(pool), num_days * daily_limit)
+    wet = np.where(rain)[0]
+    inside = np.where(indoor)[0]
+
+    # quotas: rainy days first take what indoor POIs there are, then every day fills evenly
+    indoor_quota = np.zeros(num_days, dtype=np.int64)
+    indoor_quota[wet] = _fill(np.zeros(wet.size, dtype=np.int64), limits[wet], inside.size)
+    quotas = _fill(indoor_quota, limits, total - int(indoor_quota.sum()))
+
+    labels = np.full(len(pool), -1, dtype=np.int64)
+    if wet.size and inside.size:
+        labels[inside] = _cluster(xy[inside], indoor_quota)
+    rest = np.where(labels < 0)[0]
+    dry_quota = quotas.copy()
+    dry_quota[wet] = 0
+    labels[rest] = _cluster(xy[rest], dry_quota)
+    # rainy days short of indoor places take the leftovers closest to their group
+    for day in wet:
+        short = int(quotas[day]) - int(np.sum(labels == day))
+        left = np.where(labels < 0)[0]
+        if short <= 0 or left.size == 0:
+            continue
+        members = labels == day
+        anchor = xy[members].mean(axis=0) if members.any() else np.zeros(2)
+        labels[left[np.argsort(np.linalg.norm(xy[left] - anchor, axis=1), kind="stable")[:short]]] = day
+
+    home = np.array([0.0, 0.0])  # the centre in projected coordinates
+    plans = []
+    for day in range(num_days):
+        idx = np.where(labels == day)[0]
+        if idx.size == 0:
+            plans.append(DayPlan([], 0.0))
+            continue
+        dist = haversine_matrix(lat[idx], lon[idx])
+        start = int(np.argmin(np.linalg.norm(xy[idx] - home, axis=1)))
+        order = _route(dist, start)
+        walked = float(sum(dist[order[i], order[i + 1]] for i in range(len(order) - 1)))
+        plans.append(DayPlan([pool[int(idx[o])] for o in order], walked))
+    return plans
@@ -0,0 +1,98 @@
+"""
+Single-flight request coalescing.
+
+When many sessions ask for the same city at the same moment, only the first
+caller for a key (the leader) runs the fetch; everyone who arrives while it
+is in flight waits for that call and receives the same result, or the same
+exception. Threads block on the shared future; asyncio tasks await it
+without tying up a worker thread, and a cancelled waiter does not cancel
+the shared call.
+
+    _flight = SingleFlight("geocode")
+    result = _flight.do(key, fetch, city)            # from a thread
+    result = await _flight.ado(key, fetch, city)     # from a coroutine (fetch still runs on a thread)
+
+Keys must identify the request exactly (normalized query, coordinates,
+radius, limit, dates...). Nothing is remembered once a call completes;
+caching stays the job of the caches behind the fetchers.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+from tools import tracing
+
+_flights: Dict[str, "SingleFlight"] = {}
+_flights_lock = threading.Lock()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.calls = 0      # calls actually executed (leaders)
+        self.coalesced = 0  # callers served by someone else's call
+        with _flights_lock:
+            _flights[name] = self
+
+    def _join(self, key: Hashable):
+        """Return (future, is_leader) for `key`."""
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                fut = self._calls[key] = Future()
+                self.calls += 1
+                leader = True
+        if not leader:
+            tracing.record_coalesced(self.name)
+            tracing.current_span().set(coalesced=True)
+        return fut, leader
+
+    def _run(self, key: Hashable, fut: Future, fn: Callable, args: tuple, kwargs: dict) -> None:
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._calls.pop(key, None)
+            fut.set_exception(e)
+        else:
+            with self._lock:
+                self._calls.pop(key, None)
+            fut.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs) unless an identical call is in flight; return its result."""
+        fut, leader = self._join(key)
+        if leader:
+            self._run(key, fut, fn, args, kwargs)
+        return fut.result()
+
+    async def ado(self, key: Hashable, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Async do(): the leader runs the sync `fn` on a worker thread."""
+        fut, leader = self._join(key)
+        if leader:
+            # not awaited directly: if the leader's task is cancelled the call still
+            # completes and its waiters get the result
+            ctx = contextvars.copy_context()
+            asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(ctx.run, self._run, key, fut, fn, args, kwargs))
+        return await asyncio.shield(asyncio.wrap_future(fut))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+def singleflight_stats() -> Dict[str, Dict[str, int]]:
+    """Per-fetcher counts of upstream calls made and callers coalesced onto them."""
+    with _flights_lock:
+        flights = list(_flights.values())
+    return {f.name: f.stats() for f in flights}
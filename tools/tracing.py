@@ -0,0 +1,510 @@
+"""
+Lightweight tracing and metrics for plans.
+
+Spans time one stage (an upstream request, a fetcher, a tool, an LLM turn,
+a child agent) and carry a few attributes: payload sizes, token counts,
+retries, cache outcomes. Spans opened while a plan trace is active are
+collected into that trace, including spans from worker threads that
+inherited the plan's context. Every span also feeds process-wide counters
+and histograms, which can be scraped in Prometheus text format:
+
+    with tracing.trace("plan", city="Hyderabad") as tr:
+        plan_trip(...)
+    tr.to_dict()                 # plan-level trace, JSON-serializable
+    tracing.prometheus_text()    # process-wide metrics
+
+Set TRACING=0 to disable: `span()` then returns a shared no-op object and
+the metric helpers return immediately. Set TRACE_DIR to write every finished
+plan trace to <TRACE_DIR>/<trace_id>.json.
+"""
+from __future__ import annotations
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+enabled = os.getenv("TRACING", "1").lower() not in ("0", "false", "no", "off")
+TRACE_DIR = os.getenv("TRACE_DIR")
+
+_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+TOKEN_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+# --- metrics -----------------------------------------------------------------
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Metric:
+    def __init__(self, name: str, help_text: str, kind: str):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text, "counter")
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, value: float = 1.0, **labels: Any) -> None:
+        if not enabled:
+            return
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, v in items:
+            yield self.name, labels, v
+
+
+class Histogram(_Metric):
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, "histogram")
+        self.buckets = tuple(buckets)
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        if not enabled:
+            return
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        with self._lock:
+            items = [(k, list(c), t[0]) for k, (c, t) in self._values.items()]
+        for labels, counts, total in items:
+            running = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", labels + (("le", le),), running
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, running
+
+
+SPAN_SECONDS = Histogram("travel_span_seconds", "Duration of traced stages.")
+SPAN_ERRORS = Counter("travel_span_errors_total", "Traced stages that raised.")
+CACHE_REQUESTS = Counter("travel_cache_requests_total", "Cache lookups by cache and result (hit/stale/miss).")
+UPSTREAM_REQUESTS = Counter("travel_upstream_requests_total", "Upstream HTTP requests by host and outcome.")
+UPSTREAM_RETRIES = Counter("travel_upstream_retries_total", "Upstream HTTP retries by host.")
+UPSTREAM_BYTES = Histogram("travel_upstream_response_bytes", "Upstream response body sizes.", SIZE_BUCKETS)
+LLM_TOKENS = Counter("travel_llm_tokens_total", "LLM tokens by kind (prompt/completion).")
+LLM_CACHED_TOKENS = Counter("travel_llm_cached_tokens_total",
+                            "LLM tokens replayed from the response cache (not spent), by kind.")
+TOOL_OUTPUT_BYTES = Histogram("travel_tool_output_bytes", "Size of tool output returned to the agent.", SIZE_BUCKETS)
+COALESCED_CALLS = Counter("travel_coalesced_calls_total", "Fetches served by an identical in-flight call.")
+CACHE_REFRESHES = Counter("travel_cache_refreshes_total", "Background cache refreshes by cache and outcome.")
+AGENT_INPUT_TOKENS = Histogram("travel_agent_input_tokens", "Estimated tokens sent to the model per agent turn.",
+                               TOKEN_BUCKETS)
+
+METRICS: List[_Metric] = [SPAN_SECONDS, SPAN_ERRORS, CACHE_REQUESTS, UPSTREAM_REQUESTS, UPSTREAM_RETRIES,
+                          UPSTREAM_BYTES, LLM_TOKENS, LLM_CACHED_TOKENS, TOOL_OUTPUT_BYTES, COALESCED_CALLS, CACHE_REFRESHES,
+                          AGENT_INPUT_TOKENS]
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text() -> str:
+    """All process-wide metrics in the Prometheus text exposition format."""
+    out = []
+    for m in METRICS:
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        for name, labels, value in m.samples():
+            lbl = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            out.append(f"{name}{{{lbl}}} {value:g}" if lbl else f"{name} {value:g}")
+    return "\n".join(out) + "\n"
+
+
+def reset_metrics() -> None:
+    for m in METRICS:
+        with m._lock:
+            m._values.clear()
+
+
+# --- spans and traces ----------------------------------------------------------
+
+class Span:
+    __slots__ = ("id", "parent", "name", "start", "end", "attrs", "error", "_trace", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.error: Optional[str] = None
+        self.start = self.end = 0.0
+        self.parent: Optional[str] = None
+        self._trace: Optional[Trace] = None
+        self._token: Optional[contextvars.Token] = None
+
+    def set(self, **attrs: Any) -> "Span":
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self) -> "Span":
+        parent = _span.get()
+        self.parent = parent.id if parent is not None else None
+        self._trace = _trace.get()
+        self._token = _span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end = time.perf_counter()
+        _span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+            SPAN_ERRORS.inc(span=self.name)
+        SPAN_SECONDS.observe(self.end - self.start, span=self.name)
+        if self._trace is not None:
+            self._trace.spans.append(self)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class _NoopSpan:
+    """Returned by span() when tracing is disabled."""
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> "_NoopSpan":
+        return self
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs: Any):
+    """Context manager timing one stage; use `.set(...)` on it to attach attributes."""
+    if not enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def current_span():
+    """The innermost open span (or a no-op), for attaching attributes from deeper code."""
+    return (_span.get() or _NOOP) if enabled else _NOOP
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Decorator wrapping a sync or async function in a span."""
+    def deco(fn: Callable) -> Callable:
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+class Trace:
+    """All spans and counters of one plan."""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []  # list.append is atomic; spans arrive from worker threads
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def count(self, key: str, value: float = 1.0) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        spans = sorted(self.spans, key=lambda s: s.start)
+        stages: Dict[str, Dict[str, float]] = {}
+        for s in spans:
+            st = stages.setdefault(s.name, {"count": 0, "total_ms": 0.0})
+            st["count"] += 1
+            st["total_ms"] = round(st["total_ms"] + s.duration * 1000, 3)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "started_at": self.started_at,
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "stages": stages,
+            "counters": dict(self.counters),
+            "spans": [{
+                "id": s.id,
+                "parent": s.parent,
+                "name": s.name,
+                "start_ms": round((s.start - self.start) * 1000, 3),
+                "duration_ms": round(s.duration * 1000, 3),
+                "attrs": s.attrs,
+                **({"error": s.error} if s.error else {}),
+            } for s in spans],
+        }
+
+    def to_json(self, **kwargs: Any) -> str:
+        return json.dumps(self.to_dict(), default=str, **kwargs)
+
+
+@contextmanager
+def trace(name: str, **attrs: Any):
+    """Collect the spans of one plan. Nested inside an active trace it is just a span.
+
+    Yields the Trace (or None when tracing is disabled or nested).
+    """
+    if not enabled:
+        yield None
+        return
+    if _trace.get() is not None:
+        with span(name, **attrs):
+            yield _trace.get()
+        return
+    tr = Trace(name, attrs)
+    token = _trace.set(tr)
+    try:
+        with span(name, **attrs):
+            yield tr
+    finally:
+        tr.end = time.perf_counter()
+        _trace.reset(token)
+        if TRACE_DIR:
+            _write(tr)
+
+
+def _write(tr: Trace) -> None:
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        with open(os.path.join(TRACE_DIR, f"{tr.id}.json"), "w", encoding="utf-8") as f:
+            f.write(tr.to_json(indent=2))
+    except OSError:
+        pass  # traces are diagnostics: never fail a plan over them
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get() if enabled else None
+
+
+# --- helpers used by the instrumented modules -------------------------------------
+
+def record_cache(cache: str, hit: bool, stale: bool = False) -> None:
+    """Count a cache lookup process-wide and on the active plan trace.
+
+    A stale hit is an expired entry served while it is refreshed in the background.
+    """
+    if not enabled:
+        return
+    result = "stale" if stale else ("hit" if hit else "miss")
+    CACHE_REQUESTS.inc(cache=cache, result=result)
+    tr = _trace.get()
+    if tr is not None:
+        tr.count(f"cache.{cache}.{result}")
+
+
+def record_coalesced(fetcher: str) -> None:
+    if not enabled:
+        return
+    COALESCED_CALLS.inc(fetcher=fetcher)
+    tr = _trace.get()
+    if tr is not None:
+        tr.count(f"coalesced.{fetcher}")
+
+
+def record_refresh(cache: str, outcome: str) -> None:
+    if not enabled:
+        return
+    CACHE_REFRESHES.inc(cache=cache, outcome=outcome)
+
+
+def record_agent_turn(agent: str, turn: int, tokens: int) -> None:
+    if not enabled:
+        return
+    AGENT_INPUT_TOKENS.observe(tokens, agent=agent)
+    tr = _trace.get()
+    if tr is not None:
+        tr.count(f"agent.{agent}.turns")
+        tr.count(f"agent.{agent}.input_tokens", tokens)
+        tr.count(f"agent.{agent}.turn{turn}.input_tokens", tokens)
+
+
+def record_upstream(host: str, outcome: str, nbytes: Optional[int] = None, retries: int = 0) -> None:
+    if not enabled:
+        return
+    UPSTREAM_REQUESTS.inc(host=host, outcome=outcome)
+    if retries:
+        UPSTREAM_RETRIES.inc(retries, host=host)
+    if nbytes is not None:
+        UPSTREAM_BYTES.observe(nbytes, host=host)
+    tr = _trace.get()
+    if tr is not None:
+        tr.count(f"upstream.{host}.requests")
+        if retries:
+            tr.count(f"upstream.{host}.retries", retries)
+        if nbytes:
+            tr.count(f"upstream.{host}.bytes", nbytes)
+
+
+def record_tool_output(tool: str, text: Any) -> None:
+    if not enabled:
+        return
+    n = len(text.encode("utf-8")) if isinstance(text, str) else 0
+    TOOL_OUTPUT_BYTES.observe(n, tool=tool)
+    current_span().set(output_bytes=n)
+
+
+def _record_tokens(tr: Optional[Trace], prompt: int, completion: int, cached: bool = False) -> None:
+    """Token usage of one LLM turn; a turn replayed from the LLM cache is counted apart, as nothing was spent."""
+    (LLM_CACHED_TOKENS if cached else LLM_TOKENS).inc(prompt, kind="prompt")
+    (LLM_CACHED_TOKENS if cached else LLM_TOKENS).inc(completion, kind="completion")
+    if tr is not None:
+        prefix = "llm.cached_" if cached else "llm."
+        tr.count(prefix + "prompt_tokens", prompt)
+        tr.count(prefix + "completion_tokens", completion)
+        tr.count(prefix + "turns")
+
+
+def traced_tool(name: str) -> Callable[[Callable], Callable]:
+    """Like traced(), for async tools: also records the size of the text they return."""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                out = await fn(*args, **kwargs)
+                record_tool_output(name, out)
+                return out
+        return wrapper
+    return deco
+
+
+# --- LangChain callback: one span per LLM turn -----------------------------------------
+
+def llm_callbacks() -> list:
+    """Callback handlers to attach to chat models (empty when tracing is disabled)."""
+    if not enabled:
+        return []
+    return [_handler()]
+
+
+_handler_instance = None
+_handler_lock = threading.Lock()
+
+
+def _handler():
+    global _handler_instance
+    if _handler_instance is not None:
+        return _handler_instance
+    with _handler_lock:
+        if _handler_instance is not None:
+            return _handler_instance
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class LLMTraceHandler(BaseCallbackHandler):
+            # run in the caller's thread/context so the plan's trace and parent span are visible
+            run_inline = True
+
+            def __init__(self):
+                self._open: Dict[Any, Tuple[Span, Any]] = {}
+                self._lock = threading.Lock()
+
+            def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+                chars = sum(len(str(getattr(m, "content", "") or "")) for batch in messages for m in batch)
+                model = ((kwargs.get("invocation_params") or {}).get("model")
+                         or (kwargs.get("metadata") or {}).get("ls_model_name"))
+                s = Span("llm", {"model": model, "messages": sum(len(b) for b in messages), "prompt_chars": chars})
+                # not entered as the current span: LangChain may end it from another callback frame
+                parent = _span.get()
+                s.parent = parent.id if parent is not None else None
+                s._trace = _trace.get()
+                s.start = time.perf_counter()
+                with self._lock:
+                    self._open[run_id] = (s, s._trace)
+
+            def _finish(self, run_id, error: Optional[BaseException] = None, response=None):
+                with self._lock:
+                    item = self._open.pop(run_id, None)
+                if item is None:
+                    return
+                s, tr = item
+                s.end = time.perf_counter()
+                if response is not None:
+                    prompt, completion, tool_calls, out_chars = _usage(response)
+                    cached = _replayed(response)
+                    s.set(prompt_tokens=prompt, completion_tokens=completion, tool_calls=tool_calls,
+                          completion_chars=out_chars, cached=cached)
+                    _record_tokens(tr, prompt, completion, cached)
+                if error is not None:
+                    s.error = f"{type(error).__name__}: {error}"
+                    SPAN_ERRORS.inc(span="llm")
+                SPAN_SECONDS.observe(s.duration, span="llm")
+                if tr is not None:
+                    tr.spans.append(s)
+
+            def on_llm_end(self, response, *, run_id, **kwargs):
+                self._finish(run_id, response=response)
+
+            def on_llm_error(self, error, *, run_id, **kwargs):
+                self._finish(run_id, error=error)
+
+        _handler_instance = LLMTraceHandler()
+    return _handler_instance
+
+
+def _replayed(response) -> bool:
+    """Whether an LLMResult came from the LLM response cache (agents.llm_cache marks its generations)."""
+    gens = [g for batch in response.generations or [] for g in batch]
+    return bool(gens) and all((g.generation_info or {}).get("cached") for g in gens)
+
+
+def _usage(response) -> Tuple[int, int, int, int]:
+    """(prompt_tokens, completion_tokens, tool_calls, completion_chars) of an LLMResult."""
+    prompt = completion = tool_calls = chars = 0
+    for batch in response.generations or []:
+        for g in batch:
+            msg = getattr(g, "message", None)
+            usage = getattr(msg, "usage_metadata", None) or {}
+            prompt += int(usage.get("input_tokens") or 0)
+            completion += int(usage.get("output_tokens") or 0)
+            tool_calls += len(getattr(msg, "tool_calls", None) or [])
+            chars += len(str(getattr(msg, "content", "") or g.text or ""))
+    if not (prompt or completion):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt = int(usage.get("prompt_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or 0)
+    return prompt, completion, tool_calls, chars
@@ -0,0 +1,221 @@
+"""
+Shared HTTP transport for the fetchers.
+
+- one pooled keep-alive `requests.Session` per host
+- bounded retries with jittered exponential backoff on 429/5xx and connection
+  errors, honouring `Retry-After`
+- per-host concurrency and request-rate caps (Nominatim: 1 req/s, Overpass:
+  two concurrent slots per client)
+- typed failures (`UpstreamError`) and a `FetchResult` wrapper so callers can
+  tell "no data" apart from "upstream throttled/unavailable"
+"""
+from __future__ import annotations
+import email.utils
+import random
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tools import tracing
+
+USER_AGENT = "travel-agent-app"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 30.0
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class HostPolicy(NamedTuple):
+    max_concurrency: int = 4
+    min_interval: float = 0.0  # seconds between request starts
+    max_retries: int = 2
+
+
+HOST_POLICIES: Dict[str, HostPolicy] = {
+    "nominatim.openstreetmap.org": HostPolicy(max_concurrency=1, min_interval=1.0, max_retries=2),
+    "overpass-api.de": HostPolicy(max_concurrency=2, min_interval=0.0, max_retries=2),
+    "api.open-meteo.com": HostPolicy(max_concurrency=8, min_interval=0.0, max_retries=2),
+}
+DEFAULT_POLICY = HostPolicy()
+
+
+class UpstreamError(Exception):
+    """A request that failed after retries. `kind` is one of
+    "throttled" (429), "unavailable" (5xx, timeout, connection error) or
+    "bad_response" (other 4xx, undecodable body)."""
+
+    def __init__(self, kind: str, host: str, status: Optional[int] = None, message: str = ""):
+        self.kind = kind
+        self.host = host
+        self.status = status
+        super().__init__(message or f"{host}: {kind}" + (f" (HTTP {status})" if status else ""))
+
+    @property
+    def throttled(self) -> bool:
+        return self.kind == "throttled"
+
+
+class FetchResult(NamedTuple):
+    """Value plus the error that prevented getting it (None on success / genuine no-data)."""
+    value: Any
+    error: Optional[UpstreamError] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def failure_note(err: Optional[UpstreamError]) -> str:
+    """Short suffix for tool output explaining why data is missing."""
+    if err is None:
+        return ""
+    if err.throttled:
+        return f" (upstream {err.host} is rate-limiting us; try again shortly)"
+    if err.kind == "unavailable":
+        return f" (upstream {err.host} is unavailable)"
+    return f" (unexpected response from {err.host})"
+
+
+class _Host:
+    def __init__(self, host: str, policy: HostPolicy):
+        self.host = host
+        self.policy = policy
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, policy.max_concurrency))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.slots = threading.BoundedSemaphore(max(1, policy.max_concurrency))
+        self._rate_lock = threading.Lock()
+        self._next_start = 0.0
+        self.requests = 0
+        self.retries = 0
+
+    def wait_turn(self) -> None:
+        """Block until the host's min_interval since the previous request start has passed."""
+        if self.policy.min_interval <= 0:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.policy.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+
+_hosts: Dict[str, _Host] = {}
+_hosts_lock = threading.Lock()
+
+
+def host_of(url: str) -> str:
+    """Host name of `url`, with the port when it is not the scheme's default."""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    return f"{host}:{parts.port}" if parts.port else host
+
+
+def _host_for(url: str) -> _Host:
+    # keyed by host:port so local stand-ins on different ports keep separate pools
+    host = host_of(url)
+    with _hosts_lock:
+        h = _hosts.get(host)
+        if h is None:
+            policy = HOST_POLICIES.get(host) or HOST_POLICIES.get(urlsplit(url).hostname or "", DEFAULT_POLICY)
+            h = _hosts[host] = _Host(host, policy)
+        return h
+
+
+def _retry_after(resp: requests.Response) -> Optional[float]:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+        return max(0.0, dt.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    # "equal jitter": half deterministic, half random, so concurrent clients spread out
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def request(method: str, url: str, *, timeout: float = 10, **kwargs) -> requests.Response:
+    """Send a request through the pooled per-host session.
+
+    Returns the (2xx) response or raises UpstreamError once retries are exhausted.
+    """
+    h = _host_for(url)
+    retries = [0]
+    with tracing.span("http", host=h.host, method=method) as sp:
+        try:
+            resp = _request(h, method, url, timeout, kwargs, retries)
+        except UpstreamError as e:
+            sp.set(status=e.status, outcome=e.kind, retries=retries[0])
+            tracing.record_upstream(h.host, e.kind, retries=retries[0])
+            raise
+        if tracing.enabled:
+            # a streamed body is read (or abandoned) by the caller: only its declared size is known
+            nbytes = int(resp.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(resp.content)
+            sp.set(status=resp.status_code, bytes=nbytes, retries=retries[0])
+            tracing.record_upstream(h.host, "ok", nbytes, retries[0])
+        return resp
+
+
+def _request(h: _Host, method: str, url: str, timeout: float, kwargs: Dict[str, Any], retries: list) -> requests.Response:
+    attempts = h.policy.max_retries + 1
+    last_err: Optional[UpstreamError] = None
+    for attempt in range(attempts):
+        delay = None
+        with h.slots:
+            h.wait_turn()
+            h.requests += 1
+            try:
+                resp = h.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                last_err = UpstreamError("unavailable", h.host, message=f"{h.host}: {e.__class__.__name__}")
+            else:
+                if resp.status_code < 400:
+                    return resp
+                status = resp.status_code
+                if status not in RETRY_STATUSES:
+                    resp.close()
+                    raise UpstreamError("bad_response", h.host, status)
+                last_err = UpstreamError("throttled" if status == 429 else "unavailable", h.host, status)
+                delay = _retry_after(resp)
+                resp.close()
+        if attempt + 1 >= attempts:
+            break
+        if delay is None:
+            delay = _backoff(attempt)
+        elif delay > MAX_RETRY_AFTER:
+            # the server asked us to go away for longer than a user will wait
+            break
+        h.retries += 1
+        retries[0] += 1
+        time.sleep(delay)
+    raise last_err  # type: ignore[misc]
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def transport_stats() -> Dict[str, Dict[str, Any]]:
+    """Per-host request and retry counters."""
+    with _hosts_lock:
+        return {name: {"requests": h.requests, "retries": h.retries} for name, h in _hosts.items()}
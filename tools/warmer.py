@@ -0,0 +1,231 @@
+"""
+Cache warmer for hot cities.
+
+Keeps the geocode, POI and rolling 16-day weather entries of the most
+requested cities in the caches, so plans for them never wait on an upstream.
+The hot list is WARM_CITIES (";"-separated, place names contain commas)
+followed by the cities seen most often in recent request logs, WARM_TOP in
+total. WARM_LOGS lists (os.pathsep-separated) batch_plan output files and
+TRACE_DIR trace files, or directories of them; only files modified within
+WARM_LOG_DAYS count, and they are re-read every round.
+
+Each round goes through the normal fetchers: missing entries are fetched,
+stale ones are served and renewed in the background (tools.revalidate), and
+fresh ones cost nothing. Cities are warmed WARM_CONCURRENCY at a time and
+every request still passes the transport's per-host rate limits.
+
+The POI cache (tools.poi_cache) lives in process memory only, so POI pools
+are warmed only by the warmer running inside the service. Run standalone,
+the warmer fills the SQLite-backed geocode and weather caches that the
+service shares, and skips POIs rather than spend Overpass quota on a cache
+that disappears when it exits.
+
+    python -m tools.warmer --once                      # one round, then exit
+    python -m tools.warmer --logs traces/ --interval 900
+    WARM_CITIES="Paris;Hyderabad" python server.py     # the service warms while it runs
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from tools.fetch_context import POOL_RADIUS, POOL_LIMIT
+from tools.geocode import geocode_city_result, normalize_query
+from tools.poi_fetcher import fetch_pois_result
+from tools.revalidate import drain
+from tools.weather_fetcher import fetch_weather_result
+
+WARM_CITIES = [c.strip() for c in os.getenv("WARM_CITIES", "").split(";") if c.strip()]
+WARM_LOGS = [p for p in os.getenv("WARM_LOGS", "").split(os.pathsep) if p]
+WARM_LOG_DAYS = float(os.getenv("WARM_LOG_DAYS", 7))
+WARM_TOP = int(os.getenv("WARM_TOP", 20))
+WARM_INTERVAL = float(os.getenv("WARM_INTERVAL", 1800))
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", 2))
+WARM_POI_LIMIT = int(os.getenv("WARM_POI_LIMIT", 100))
+# Open-Meteo forecasts reach 16 days ahead
+WARM_WEATHER_DAYS = int(os.getenv("WARM_WEATHER_DAYS", 16))
+
+log = logging.getLogger(__name__)
+
+
+def _log_files(paths: Sequence[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith((".json", ".jsonl")):
+                    yield os.path.join(path, name)
+        elif os.path.isfile(path):
+            yield path
+
+
+def _log_records(path: str) -> Iterator[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".json"):
+                yield json.load(f)
+                return
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    except (OSError, ValueError):
+        return
+
+
+def cities_from_logs(paths: Sequence[str], days: float = WARM_LOG_DAYS) -> List[str]:
+    """Cities in the request logs, most requested first (spelled as first seen)."""
+    cutoff = time.time() - days * 86400
+    counts: Counter = Counter()
+    names: Dict[str, str] = {}
+    for path in _log_files(paths):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                continue
+        except OSError:
+            continue
+        for rec in _log_records(path):
+            if not isinstance(rec, dict):
+                continue
+            # batch_plan output rows carry `city`, trace files carry it in `attrs`
+            city = rec.get("city") or (rec.get("attrs") or {}).get("city")
+            key = normalize_query(city) if isinstance(city, str) else ""
+            if key:
+                counts[key] += 1
+                names.setdefault(key, city.strip())
+    return [names[k] for k, _ in counts.most_common()]
+
+
+def hot_cities(cities: Sequence[str] = (), logs: Sequence[str] = (), top: int = WARM_TOP) -> List[str]:
+    """Configured cities first, then the most requested ones from `logs`, `top` in total."""
+    out: List[str] = []
+    seen = set()
+    for city in list(cities) + (cities_from_logs(logs) if logs else []):
+        key = normalize_query(city)
+        if key and key not in seen:
+            seen.add(key)
+            out.append(city)
+    return out[:max(top, len(cities))]
+
+
+def warm_city(city: str, weather_days: int = WARM_WEATHER_DAYS, poi_limit: int = WARM_POI_LIMIT,
+              pois: bool = True) -> Dict[str, Any]:
+    """Fetch (or refresh) the cached geocode, POI pool (unless `pois` is off) and weather window of one city."""
+    row: Dict[str, Any] = {"city": city}
+    geo = geocode_city_result(city)
+    if geo.value is None:
+        row["error"] = geo.error.kind if geo.error else "not_found"
+        return row
+    lat, lon = geo.value["lat"], geo.value["lon"]
+    pool = None
+    if pois:
+        # the same circle FetchContext asks for, with room for long trips
+        pool = fetch_pois_result(lat, lon, radius=POOL_RADIUS, limit=max(POOL_LIMIT, poi_limit))
+        row["pois"] = len(pool.value or [])
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    end = today + datetime.timedelta(days=weather_days - 1)
+    weather = fetch_weather_result(lat, lon, today.isoformat(), end.isoformat())
+    row["weather_days"] = len((weather.value or {}).get("time", []))
+    errors = [e.kind for e in (pool and pool.error, weather.error) if e is not None]
+    if errors:
+        row["error"] = ",".join(errors)
+    return row
+
+
+class CacheWarmer:
+    """Warms the hot cities every `interval` seconds on a background thread.
+
+    `pois=False` leaves out the memory-only POI cache, for warmers that do not
+    share a process with the planner.
+    """
+
+    def __init__(self, cities: Sequence[str] = (), logs: Sequence[str] = (), top: int = WARM_TOP,
+                 interval: float = WARM_INTERVAL, concurrency: int = WARM_CONCURRENCY, pois: bool = True):
+        self.cities = list(cities)
+        self.logs = list(logs)
+        self.top = top
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self.pois = pois
+        self.rounds = 0
+        self.last_round: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["CacheWarmer"]:
+        """The warmer configured by WARM_CITIES / WARM_LOGS, or None if neither is set."""
+        if not (WARM_CITIES or WARM_LOGS):
+            return None
+        return cls(WARM_CITIES, WARM_LOGS)
+
+    def run_once(self) -> List[Dict[str, Any]]:
+        started = time.time()
+        cities = hot_cities(self.cities, self.logs, self.top)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="warm") as pool:
+            rows = list(pool.map(lambda city: warm_city(city, pois=self.pois), cities))
+        self.rounds += 1
+        self.last_round = {
+            "finished_at": time.time(),
+            "duration_s": round(time.time() - started, 3),
+            "cities": len(rows),
+            "errors": sum(1 for r in rows if "error" in r),
+        }
+        return rows
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("cache warming round failed")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="cache-warmer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rounds": self.rounds, "interval_s": self.interval, "last_round": self.last_round}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Keep the caches warm for the most requested cities.")
+    ap.add_argument("--cities", default=";".join(WARM_CITIES), help='";"-separated city list')
+    ap.add_argument("--logs", nargs="*", default=WARM_LOGS,
+                    help="batch output JSONL / trace JSON files or directories to learn hot cities from")
+    ap.add_argument("--top", type=int, default=WARM_TOP)
+    ap.add_argument("--interval", type=float, default=WARM_INTERVAL, help="seconds between rounds")
+    ap.add_argument("--concurrency", type=int, default=WARM_CONCURRENCY)
+    ap.add_argument("--once", action="store_true", help="run one round and wait for its refreshes")
+    args = ap.parse_args()
+
+    cities = [c.strip() for c in args.cities.split(";") if c.strip()]
+    if not (cities or args.logs):
+        ap.error("no cities: pass --cities/--logs or set WARM_CITIES/WARM_LOGS")
+    # a separate process: its POI cache would be gone before the service could use it
+    warmer = CacheWarmer(cities, args.logs, args.top, args.interval, args.concurrency, pois=False)
+    while True:
+        for row in warmer.run_once():
+            print(json.dumps(row, ensure_ascii=False), flush=True)
+        if args.once:
+            drain()
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
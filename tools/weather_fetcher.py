@@ -1,19 +1,280 @@
-import requests
+import asyncio
+import datetime
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-def fetch_weather(lat: float, lon: float, start_date: str, end_date: str) -> dict:
-    """Fetch daily weather block from Open-Meteo API for given date range."""
+from tools import tracing, transport
+from tools.cache import TieredCache, default_db_path
+from tools.revalidate import revalidate
+from tools.singleflight import SingleFlight
+from tools.transport import FetchResult, UpstreamError
+
+DAILY_VARS = ("temperature_2m_max", "temperature_2m_min", "precipitation_sum", "weathercode")
+# Forecast days are re-fetched after a few hours; days safely in the past never change.
+WEATHER_FORECAST_TTL = float(os.getenv("WEATHER_FORECAST_TTL", 3 * 3600))
+# Expired forecast days keep being served for this long while a background refresh runs.
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", 24 * 3600))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", 4096))
+OPEN_METEO_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+# Longest date span one batched request may cover (Open-Meteo forecasts 16 days ahead).
+WEATHER_BATCH_MAX_DAYS = int(os.getenv("WEATHER_BATCH_MAX_DAYS", 16))
+
+_day_cache = TieredCache(
+    "weather_day",
+    ttl=WEATHER_FORECAST_TTL,
+    max_entries=WEATHER_CACHE_SIZE,
+    path=None if os.getenv("WEATHER_CACHE_DISABLE_DISK") else default_db_path(),
+    stale_ttl=WEATHER_STALE_TTL,
+)
+# concurrent requests for the same cell and dates share one fetch
+_flight = SingleFlight("weather")
+
+
+def _cell(lat: float, lon: float) -> str:
+    # ~1 km cells: every geocode of the same city lands in the same cell
+    return f"{round(lat, 2):.2f},{round(lon, 2):.2f}"
+
+
+def _day_ttl(day: datetime.date) -> Optional[float]:
+    # "past" is judged against UTC with a day of slack so no timezone still forecasts it
+    if day < datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=1):
+        return None
+    return WEATHER_FORECAST_TTL
+
+
+def _ranges(days: List[datetime.date]) -> List[Tuple[datetime.date, datetime.date]]:
+    """Contiguous [start, end] runs of the sorted `days`."""
+    ranges = []
+    for d in days:
+        if ranges and ranges[-1][1] + datetime.timedelta(days=1) == d:
+            ranges[-1] = (ranges[-1][0], d)
+        else:
+            ranges.append((d, d))
+    return ranges
+
+
+def _params(lat: Any, lon: Any, start_date: str, end_date: str) -> dict:
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "daily": ",".join(DAILY_VARS),
+        "start_date": start_date,
+        "end_date": end_date,
+        "timezone": "auto",
+    }
+
+
+def _fetch_remote(lat: float, lon: float, start_date: str, end_date: str) -> FetchResult:
     try:
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,weathercode",
-            "start_date": start_date,
-            "end_date": end_date,
-            "timezone": "auto",
-        }
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        return r.json().get("daily", {})
-    except Exception:
+        r = transport.get(OPEN_METEO_URL, params=_params(lat, lon, start_date, end_date), timeout=10)
+        return FetchResult(r.json().get("daily", {}))
+    except UpstreamError as e:
+        return FetchResult({}, e)
+    except ValueError:
+        return FetchResult({}, UpstreamError("bad_response", transport.host_of(OPEN_METEO_URL)))
+
+
+def _fetch_remote_many(points: Sequence[Tuple[float, float]], start_date: str, end_date: str) -> List[FetchResult]:
+    """One Open-Meteo request for several locations (comma-separated coordinates); a `daily` block per point."""
+    params = _params(",".join(str(lat) for lat, _ in points), ",".join(str(lon) for _, lon in points),
+                     start_date, end_date)
+    try:
+        r = transport.get(OPEN_METEO_URL, params=params, timeout=10)
+        data = r.json()
+    except UpstreamError as e:
+        return [FetchResult({}, e)] * len(points)
+    except ValueError:
+        data = None
+    # a single location answers with an object, several with a list in request order
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or len(data) != len(points):
+        return [FetchResult({}, UpstreamError("bad_response", transport.host_of(OPEN_METEO_URL)))] * len(points)
+    return [FetchResult((d.get("daily") if isinstance(d, dict) else None) or {}) for d in data]
+
+
+def _store_days(cell: str, daily: dict) -> Dict[datetime.date, dict]:
+    """Cache each day of an Open-Meteo `daily` block; returns the days by date."""
+    out = {}
+    for i, t in enumerate(daily.get("time", [])):
+        values = {k: (daily[k][i] if i < len(daily.get(k) or []) else None) for k in DAILY_VARS}
+        d = datetime.date.fromisoformat(t)
+        out[d] = values
+        _day_cache.set(f"{cell}:{t}", values, ttl=_day_ttl(d))
+    return out
+
+
+def _refresh(lat: float, lon: float, start_date: str, end_date: str) -> bool:
+    res = _fetch_remote(lat, lon, start_date, end_date)
+    if not res.ok or not res.value:
+        return False
+    _store_days(_cell(lat, lon), res.value)
+    return True
+
+
+def _days(start_date: str, end_date: str) -> Optional[List[datetime.date]]:
+    """The dates of [start_date, end_date], or None when the range is not valid ISO dates."""
+    try:
+        sd = datetime.date.fromisoformat(start_date)
+        ed = datetime.date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        return None
+    if ed < sd:
+        return None
+    return [sd + datetime.timedelta(days=i) for i in range((ed - sd).days + 1)]
+
+
+def _cached_days(lat: float, lon: float, days: List[datetime.date]) -> Dict[datetime.date, dict]:
+    """Cached days of `days` for the cell of (lat, lon); stale ones are renewed in the background."""
+    cell = _cell(lat, lon)
+    have: Dict[datetime.date, dict] = {}
+    stale: List[datetime.date] = []
+    for d in days:
+        entry = _day_cache.lookup(f"{cell}:{d.isoformat()}")
+        if entry is not None and entry[0] is not None:
+            have[d] = entry[0]
+            if not entry[1]:
+                stale.append(d)
+    if stale:
+        # expired forecasts are served as they are; one background request renews them all
+        revalidate("weather", (cell, stale[0], stale[-1]), _refresh, lat, lon,
+                   stale[0].isoformat(), stale[-1].isoformat())
+    tracing.current_span().set(stale_days=len(stale))
+    return have
+
+
+def _block(days: List[datetime.date], have: Dict[datetime.date, dict]) -> dict:
+    if any(d not in have for d in days):
         return {}
+    out = {"time": [d.isoformat() for d in days]}
+    for k in DAILY_VARS:
+        out[k] = [have[d].get(k) for d in days]
+    return out
+
+
+def _fetch_weather_result(lat: float, lon: float, start_date: str, end_date: str) -> FetchResult:
+    days = _days(start_date, end_date)
+    if days is None:
+        return _fetch_remote(lat, lon, start_date, end_date)
+
+    cell = _cell(lat, lon)
+    have = _cached_days(lat, lon, days)
+    missing = _ranges([d for d in days if d not in have])
+    tracing.current_span().set(days=len(days), cached_days=len(have), fetches=len(missing))
+    for rs, re_ in missing:
+        res = _fetch_remote(lat, lon, rs.isoformat(), re_.isoformat())
+        if not res.ok or not res.value:
+            # the callers index days positionally, so a hole means no usable block
+            return FetchResult({}, res.error)
+        have.update(_store_days(cell, res.value))
+    return FetchResult(_block(days, have))
+
+
+def _fetch_weather_batch(legs: Sequence[Tuple[float, float, str, str]]) -> List[FetchResult]:
+    out: List[Optional[FetchResult]] = [None] * len(legs)
+    pending = []
+    for i, (lat, lon, start_date, end_date) in enumerate(legs):
+        days = _days(start_date, end_date)
+        if days is None:
+            out[i] = _fetch_weather_result(lat, lon, start_date, end_date)
+            continue
+        have = _cached_days(lat, lon, days)
+        if all(d in have for d in days):
+            out[i] = FetchResult(_block(days, have))
+        else:
+            pending.append((i, lat, lon, days, have))
+    tracing.current_span().set(legs=len(legs), cached_legs=len(legs) - len(pending))
+    if not pending:
+        return out
+
+    groups = _span_groups(pending)
+    tracing.current_span().set(fetches=len(groups),
+                               fetched_days=sum((hi - lo).days + 1 for _, lo, hi in groups))
+    for group, lo, hi in groups:
+        # one request for every location in the group, over the span covering its gaps
+        points: Dict[str, Tuple[float, float]] = {}
+        for _, lat, lon, _, _ in group:
+            points.setdefault(_cell(lat, lon), (lat, lon))
+        results = _fetch_remote_many(list(points.values()), lo.isoformat(), hi.isoformat())
+        fetched: Dict[str, FetchResult] = dict(zip(points, results))
+        for i, lat, lon, days, have in group:
+            cell = _cell(lat, lon)
+            res = fetched[cell]
+            if res.ok and res.value:
+                have.update(_store_days(cell, res.value))
+            block = _block(days, have)
+            out[i] = FetchResult(block, None if block else res.error)
+    return out
+
+
+def _span_groups(pending: list) -> List[Tuple[list, datetime.date, datetime.date]]:
+    """Split the pending legs into (legs, first, last missing day) groups spanning at most
+    WEATHER_BATCH_MAX_DAYS; a leg longer than that on its own gets a group of its own."""
+    limit = datetime.timedelta(days=max(WEATHER_BATCH_MAX_DAYS, 1) - 1)
+    gaps = []
+    for leg in pending:
+        _, _, _, days, have = leg
+        missing = [d for d in days if d not in have]
+        gaps.append((missing[0], missing[-1], leg))
+    groups: List[Tuple[list, datetime.date, datetime.date]] = []
+    for lo, hi, leg in sorted(gaps, key=lambda g: (g[0], g[1])):
+        if groups and max(groups[-1][2], hi) - groups[-1][1] <= limit:
+            legs, glo, ghi = groups[-1]
+            groups[-1] = (legs + [leg], glo, max(ghi, hi))
+        else:
+            groups.append(([leg], lo, hi))
+    return groups
+
+
+@tracing.traced("weather")
+def fetch_weather_result(lat: float, lon: float, start_date: str, end_date: str) -> FetchResult:
+    """Fetch daily weather block from Open-Meteo API, reporting upstream failures.
+
+    Days are cached per ~1 km cell; only the missing contiguous sub-ranges of
+    [start_date, end_date] are requested upstream. Identical requests already
+    in flight (same cell and dates) are joined rather than repeated. Expired
+    forecast days are answered from the cache while a background refresh
+    renews them (see WEATHER_STALE_TTL).
+    """
+    key = (_cell(lat, lon), start_date, end_date)
+    return _flight.do(key, _fetch_weather_result, lat, lon, start_date, end_date)
+
+
+def fetch_weather(lat: float, lon: float, start_date: str, end_date: str) -> dict:
+    """Fetch daily weather block from Open-Meteo API for given date range."""
+    return fetch_weather_result(lat, lon, start_date, end_date).value
+
+
+@tracing.traced("weather_batch")
+def fetch_weather_batch_result(legs: Sequence[Tuple[float, float, str, str]]) -> List[FetchResult]:
+    """fetch_weather_result for several (lat, lon, start_date, end_date) legs, e.g. of a multi-city trip.
+
+    Legs whose days are all cached are answered locally. The others are grouped
+    by date so each group's missing days fit in WEATHER_BATCH_MAX_DAYS; a group
+    shares a single Open-Meteo request (comma-separated coordinates) over that
+    span, and the answer is cached per day and cell like a single-leg fetch
+    before being cut back to each leg.
+    """
+    return _fetch_weather_batch(legs)
+
+
+async def afetch_weather_batch_result(legs: Sequence[Tuple[float, float, str, str]]) -> List[FetchResult]:
+    """Async fetch_weather_batch_result (runs on a worker thread)."""
+    return await asyncio.to_thread(fetch_weather_batch_result, legs)
+
+
+@tracing.traced("weather")
+async def afetch_weather_result(lat: float, lon: float, start_date: str, end_date: str) -> FetchResult:
+    """Async fetch_weather_result (runs on a worker thread; shares the pooled transport and in-flight calls)."""
+    key = (_cell(lat, lon), start_date, end_date)
+    return await _flight.ado(key, _fetch_weather_result, lat, lon, start_date, end_date)
+
+
+async def afetch_weather(lat: float, lon: float, start_date: str, end_date: str) -> dict:
+    """Async fetch_weather."""
+    return (await afetch_weather_result(lat, lon, start_date, end_date)).value
+
+
+def weather_cache_stats() -> dict:
+    """Hit/miss counters for the per-day weather cache."""
+    return _day_cache.stats()
@@ -1,33 +1,31 @@
 from dateutil.parser import parse as parse_date
 import datetime
-from tools.geocode import geocode_city
-from tools.weather_fetcher import fetch_weather
+from typing import Optional, Tuple
+from tools import tracing
+from tools.aio import run_sync
+from tools.budget import TOOL_OUTPUT_TOKENS, estimate_tokens, fit_lines
+from tools.fetch_context import get_context
+from tools.transport import failure_note
 
-def weather_tool(city: str, start_date: str = None, end_date: str = None) -> str:
-    """Return weather summary for a city and date range."""
-    g = geocode_city(city)
-    if g is None:
-        return f"ERROR: Could not geocode '{city}'."
-    
-    lat, lon = g["lat"], g["lon"]
-    name = g["name"]
 
+def _date_range(start_date: Optional[str], end_date: Optional[str]) -> Optional[Tuple[str, str]]:
     if not start_date:
         start_date = datetime.date.today().isoformat()
     if not end_date:
         end_date = start_date
-
     try:
-        sd = parse_date(start_date).date().isoformat()
-        ed = parse_date(end_date).date().isoformat()
+        return parse_date(start_date).date().isoformat(), parse_date(end_date).date().isoformat()
     except Exception:
-        return "ERROR: Dates must be YYYY-MM-DD."
+        return None
 
-    weather = fetch_weather(lat, lon, sd, ed)
+
+def format_weather(name: str, sd: str, ed: str, weather: dict, ctx) -> str:
+    """weather_tool's answer for an Open-Meteo `daily` block."""
     if not weather:
-        return f"WARNING: No weather data for {name} between {sd} and {ed}."
+        return f"WARNING: No weather data for {name} between {sd} and {ed}{failure_note(ctx.errors.get('weather'))}."
 
-    lines = [f"Weather for {name} ({sd} to {ed}):"]
+    header = f"Weather for {name} ({sd} to {ed}):"
+    lines = []
     times = weather.get("time", [])
     tmax = weather.get("temperature_2m_max", [])
     tmin = weather.get("temperature_2m_min", [])
@@ -38,4 +36,26 @@ def weather_tool(city: str, start_date: str = None, end_date: str = None) -> str
         pr = prec[i] if i < len(prec) else "N/A"
         lines.append(f"- {d}: max {mx}°C, min {mn}°C, precipitation {pr} mm")
 
-    return "\n".join(lines)
+    return "\n".join([header] + fit_lines(lines, TOOL_OUTPUT_TOKENS - estimate_tokens(header), "- ... and {n} more days"))
+
+
+@tracing.traced_tool("weather_tool")
+async def aweather_tool(city: str, start_date: str = None, end_date: str = None) -> str:
+    """Return weather summary for a city and date range."""
+    ctx = get_context()
+    g = await ctx.ageocode(city)
+    if g is None:
+        return f"ERROR: Could not geocode '{city}'{failure_note(ctx.errors.get('geocode'))}."
+
+    dates = _date_range(start_date, end_date)
+    if dates is None:
+        return "ERROR: Dates must be YYYY-MM-DD."
+    sd, ed = dates
+
+    weather = await ctx.aweather(g["lat"], g["lon"], sd, ed)
+    return format_weather(g["name"], sd, ed, weather, ctx)
+
+
+def weather_tool(city: str, start_date: str = None, end_date: str = None) -> str:
+    """Return weather summary for a city and date range."""
+    return run_sync(aweather_tool(city, start_date, end_date))